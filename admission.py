@@ -0,0 +1,231 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+
+# Weight of the latest service time in the moving average of service times
+SERVICE_TIME_WEIGHT = 0.2
+
+
+class OverloadedError(Exception):
+    """Raised when a request is shed because it would have to wait for too
+    long until it is admitted.
+    """
+    pass
+
+
+class RateLimiter:
+    """Per-client token buckets. Each client may send burst requests at once
+    and rate requests per second on average.
+    """
+
+    def __init__(self, rate, burst, max_clients=100000):
+        """Create a new rate limiter.
+
+        Arguments:
+        rate - number of requests per second and client, 0 for no limit
+        burst - maximum number of requests a client may send at once
+        max_clients - maximum number of clients to keep track of. The least
+                      recently active clients are forgotten first.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.num_limited = 0
+        # Mapping from client to (number of tokens, time of last update)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, client):
+        """Take a token from the bucket of the given client and return
+        whether there was one, i.e. whether the request is allowed.
+
+        Arguments:
+        client - an identifier of the client
+        """
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                tokens = self.burst
+            else:
+                tokens, last_update = bucket
+                tokens = min(self.burst,
+                             tokens + (now - last_update) * self.rate)
+                self._buckets.move_to_end(client)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            else:
+                self.num_limited += 1
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed
+
+
+class _AdmissionBase:
+    """Book-keeping shared by the admission controllers: the number of
+    admitted and waiting requests and a moving average of the time the
+    admitted requests take.
+    """
+
+    def __init__(self, max_concurrent, max_queue_time):
+        """Create a new admission controller.
+
+        Arguments:
+        max_concurrent - maximum number of requests admitted at once
+        max_queue_time - maximum time in seconds a request waits for being
+                         admitted before it is shed
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue_time = max_queue_time
+        self.active = 0
+        self.waiting = 0
+        self.num_shed = 0
+        self._service_time = 0.0
+
+    def stats(self):
+        """Return the number of admitted, waiting and shed requests as
+        dictionary.
+        """
+        return {"active": self.active, "waiting": self.waiting,
+                "shed": self.num_shed}
+
+    def _should_shed(self):
+        """Return whether a new request would wait longer than the queue time
+        budget, estimated from the number of waiting requests and the
+        average service time. Such requests are shed right away.
+        """
+        expected_wait = ((self.waiting + 1) * self._service_time
+                         / self.max_concurrent)
+        return expected_wait > self.max_queue_time
+
+    def _record_service_time(self, seconds):
+        self._service_time += SERVICE_TIME_WEIGHT * (seconds
+                                                     - self._service_time)
+
+    def _overloaded_error(self):
+        self.num_shed += 1
+        return OverloadedError("%d requests in flight, %d waiting"
+                               % (self.active, self.waiting))
+
+
+class AdmissionController(_AdmissionBase):
+    """Admit at most max_concurrent requests at once. Further requests wait
+    for at most max_queue_time seconds and are shed with an OverloadedError
+    if they are not admitted by then or if they would not be admitted in
+    time judging by the recent service times.
+    """
+
+    def __init__(self, max_concurrent, max_queue_time):
+        super().__init__(max_concurrent, max_queue_time)
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def admit(self):
+        """Wait until the request is admitted and keep it admitted for the
+        duration of the with block. Raises OverloadedError if the request is
+        shed.
+        """
+        self._acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - start)
+
+    def _acquire(self):
+        with self._cond:
+            if self.active < self.max_concurrent:
+                self.active += 1
+                return
+            if self._should_shed():
+                raise self._overloaded_error()
+            deadline = time.monotonic() + self.max_queue_time
+            self.waiting += 1
+            try:
+                while self.active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._overloaded_error()
+                    self._cond.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+
+    def _release(self, service_time):
+        with self._cond:
+            self.active -= 1
+            self._record_service_time(service_time)
+            self._cond.notify()
+
+
+class AsyncAdmissionController(_AdmissionBase):
+    """Admission controller for coroutines, see AdmissionController. Waiting
+    requests are admitted in the order of their arrival.
+    """
+
+    def __init__(self, max_concurrent, max_queue_time):
+        super().__init__(max_concurrent, max_queue_time)
+        self._waiters = deque()
+
+    @asynccontextmanager
+    async def admit(self):
+        """Wait until the request is admitted and keep it admitted for the
+        duration of the async with block. Raises OverloadedError if the
+        request is shed.
+        """
+        await self._acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._record_service_time(time.monotonic() - start)
+            self._release()
+
+    async def _acquire(self):
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            return
+        if self._should_shed():
+            raise self._overloaded_error()
+        # The slot of a finished request is handed over to the waiter by
+        # setting its result, see _release()
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(waiter, self.max_queue_time)
+        except asyncio.TimeoutError:
+            raise self._overloaded_error()
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before the cancellation
+                self._release()
+            raise
+        finally:
+            self.waiting -= 1
+            if not waiter.done() or waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+
+    def _release(self):
+        """Hand the slot of a finished request over to the next waiter or
+        free it.
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
@@ -2,15 +2,39 @@
 # Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
 
 
+import os
 import sys
 import re
+import time
+import signal
 import logging
-import http.client
 import socket
 import json
+import hashlib
+import functools
+import threading
 import argparse
+import ipaddress
 from urllib import parse
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, g
+from werkzeug.serving import make_server
+from connection_pool import ConnectionPool
+from backends import Backend, parse_addresses
+from admission import AdmissionController, RateLimiter, OverloadedError
+from completion_index import CompletionIndex
+from cache import LRUCache
+from coalescing import SingleFlight, SupersessionTracker, SupersededError
+from wiki_info_index import WikiInfoIndex, load_index
+from mid_qid_table import MidToQidTable, encode_pairs
+from tsv_ingest import parse_file
+from prefork import PreforkServer, create_listening_socket
+from metrics import Registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+try:
+    import orjson
+except ImportError:
+    orjson = None
+from mapping_snapshot import (get_source_fingerprint, read_snapshot,
+                              write_snapshot)
 
 # Connection details for the Aqqu API
 HOSTNAME_AQQU = "titan.informatik.privat"
@@ -22,6 +46,20 @@ HOSTNAME_QAC = "wolga.informatik.privat"
 PORT_QAC = 8181
 PATH_PREFIX_QAC = "/?q=%s"
 
+# Maximum number of QIDs per batch tooltip request and time in seconds for
+# which clients may cache the response
+MAX_TOOLTIP_BATCH_SIZE = 200
+TOOLTIP_MAX_AGE = 24 * 60 * 60
+
+# Maximum number of answers per page of the /answers route
+MAX_ANSWERS_PAGE_SIZE = 500
+
+# Maximum number of memoized Wikipedia urls and entity JSON fragments
+ENTITY_CACHE_SIZE = 100000
+
+# Time in seconds a pre-fork worker waits for requests in flight on shutdown
+WORKER_SHUTDOWN_TIMEOUT = 30
+
 # Set up the logger
 logging.basicConfig(format='%(asctime)s : %(message)s', datefmt="%H:%M:%S",
                     level=logging.INFO)
@@ -29,6 +67,116 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Identical QAC requests in flight are merged into a single upstream request
+# and requests superseded by a newer request of the same client are dropped
+qac_flight = SingleFlight()
+qac_tracker = SupersessionTracker()
+
+# Number of candidates and of answers per candidate that are enriched with
+# Wikipedia information and returned by the /result route. 0 means all. The
+# remaining answers are requested by the client via the /answers route.
+top_candidates = 0
+top_answers = 0
+
+# Held while the mappings are reloaded in the background
+reload_lock = threading.Lock()
+
+# Time in seconds after which clients may retry a rejected QAC request
+QAC_RETRY_AFTER = 1
+
+# Set by load_mappings(), create_caches(), create_qac_limits() and when the
+# server is started
+mappings = None
+qac_cache = None
+answer_cache = None
+qac_admission = None
+qac_rate_limiter = None
+trusted_proxies = []
+qac_fallback_index = None
+qac_local_prefix_length = 0
+aqqu_backend = None
+qac_backend = None
+
+# Metrics exposed by the /metrics route
+metrics_registry = Registry()
+request_count = metrics_registry.counter(
+    "aqqu_frontend_requests_total", "Number of handled requests",
+    ("route", "status"))
+request_duration = metrics_registry.histogram(
+    "aqqu_frontend_request_duration_seconds", "Time to handle a request",
+    ("route",))
+stage_duration = metrics_registry.histogram(
+    "aqqu_frontend_stage_duration_seconds",
+    "Time spent in a stage of handling a request, e.g. aqqu_connect,"
+    " aqqu_wait, aqqu_parse, aqqu_enrich or render", ("stage",))
+upstream_errors = metrics_registry.counter(
+    "aqqu_frontend_upstream_errors_total",
+    "Number of requests to a backend that failed", ("backend",))
+qac_rejected = metrics_registry.counter(
+    "aqqu_frontend_qac_rejected_total",
+    "Number of rejected QAC requests because the client sent too many"
+    " requests (rate_limit) or the QAC API is overloaded (overload)",
+    ("reason",))
+qac_fallbacks = metrics_registry.counter(
+    "aqqu_frontend_qac_fallbacks_total",
+    "Number of QAC requests answered from the local completion index,"
+    " because the prefix is short (short_prefix), the QAC API failed (error)"
+    " or is overloaded (overload)", ("reason",))
+metrics_registry.callback(
+    "aqqu_frontend_mapping_entries", "Number of entries of a mapping",
+    "gauge", ("mapping",), lambda: collect_mapping_sizes())
+metrics_registry.callback(
+    "aqqu_frontend_cache_entries", "Number of cached results", "gauge",
+    ("cache",), lambda: collect_cache_stats("entries"))
+metrics_registry.callback(
+    "aqqu_frontend_cache_bytes", "Total size of cached results", "gauge",
+    ("cache",), lambda: collect_cache_stats("bytes"))
+metrics_registry.callback(
+    "aqqu_frontend_cache_requests_total", "Number of cache lookups",
+    "counter", ("cache", "result"), lambda: collect_cache_requests())
+metrics_registry.callback(
+    "aqqu_frontend_cache_evictions_total", "Number of evicted results",
+    "counter", ("cache",), lambda: collect_cache_stats("evictions"))
+metrics_registry.callback(
+    "aqqu_frontend_backend_connections",
+    "Number of connections to a backend", "gauge", ("backend", "state"),
+    lambda: collect_pool_stats())
+metrics_registry.callback(
+    "aqqu_frontend_backend_outstanding_requests",
+    "Number of requests in flight per backend replica", "gauge",
+    ("backend", "replica"), lambda: collect_replica_stats("outstanding"))
+metrics_registry.callback(
+    "aqqu_frontend_backend_replica_failures_total",
+    "Number of failed requests per backend replica", "counter",
+    ("backend", "replica"), lambda: collect_replica_stats("failures"))
+metrics_registry.callback(
+    "aqqu_frontend_backend_circuit_open",
+    "Whether a backend replica gets no requests after repeated failures",
+    "gauge", ("backend", "replica"),
+    lambda: collect_replica_stats("circuit_open"))
+metrics_registry.callback(
+    "aqqu_frontend_backend_retries_total",
+    "Number of requests that were also sent to a second replica, because"
+    " the first was slow (hedge) or failed (failover)", "counter",
+    ("backend", "reason"), lambda: collect_backend_retries())
+metrics_registry.callback(
+    "aqqu_frontend_qac_admission_requests",
+    "Number of QAC requests admitted to the QAC API or waiting for"
+    " admission", "gauge", ("state",), lambda: collect_admission_stats())
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.monotonic()
+
+
+@app.after_request
+def count_request(response):
+    route = request.url_rule.rule if request.url_rule else "other"
+    request_count.inc(route=route, status=response.status_code)
+    request_duration.observe(time.monotonic() - g.request_start, route=route)
+    return response
+
 
 @app.route("/")
 def home():
@@ -37,94 +185,176 @@ def home():
         # Retrieve qids in the question
         qids = request.args.get("qids")
         # Retrieve Wikipedia urls of entities in the question
-        urls = []
-        for qid in qids.split(","):
-            if qid in qid_to_wikipedia_info:
-                title, _, _ = qid_to_wikipedia_info[qid]
-                urls.append(get_url_from_title(title))
-        # Replace entity mentions by entity name
-        aqqu_question = replace_entity_mentions(question)
-        # Url encode question to send it to Aqqu API
-        aqqu_question = parse.quote(aqqu_question)
-
-        # Establish connection to Aqqu API
-        conn = http.client.HTTPConnection(HOSTNAME_AQQU + ":" + str(PORT_AQQU))
-
-        # Forward question to Aqqu API
-        answers = []
-        interpretations = []
-        error = ""
-        try:
-            conn.request("GET", PATH_PREFIX_AQQU % aqqu_question)
-            response = conn.getresponse().read().decode("utf8")
-            logger.info("Response: '%s...'" % response[:69])
-            json_obj = json.loads(response)
-            interpretations = get_interpretation_strings(json_obj)
-            answers = get_answers(json_obj)
+        urls = get_question_urls(qids)
 
-            if len(answers) == 0:
-                error = "No answers found"
+        # Return the page right away. The client requests the answers from
+        # the /result route.
+        with stage_duration.time(stage="render"):
+            return render_template("index.html",
+                                   question=question,
+                                   qids=qids,
+                                   urls=dump_json(urls))
 
-        except socket.error:
-            logger.error("Connection to Aqqu API could not be established")
-            error = "No connection to Aqqu API"
+    with stage_duration.time(stage="render"):
+        return render_template("index.html")
+
+
+@app.route("/result")
+def result():
+    """Get the interpretations and answers for the given question as json.
+    Successful responses can be cached by clients for as long as the result
+    is cached by the server.
+    """
+    question = request.args.get("q")
+    qids = request.args.get("qids", "")
+    if not question:
+        return app.response_class(get_result_json(get_error_result(
+            "No question given")), status=400, mimetype="application/json")
+
+    # Forward question to Aqqu API unless the answers are cached
+    try:
+        aqqu_result = get_aqqu_result(question, qids)
+    except socket.error:
+        logger.error("Connection to Aqqu API could not be established")
+        response = app.response_class(get_result_json(get_error_result(
+            "No connection to Aqqu API")), mimetype="application/json")
+        response.headers["Cache-Control"] = "no-store"
+        return response
 
-        # Close connection to Aqqu API
-        conn.close()
+    response = app.response_class(get_result_json(aqqu_result),
+                                  mimetype="application/json")
+    response.headers["Cache-Control"] = ("public, max-age=%d"
+                                         % answer_cache.ttl)
+    response.add_etag()
+    return response.make_conditional(request)
 
-        return render_template("index.html",
-                               question=question,
-                               qids=qids,
-                               urls=json.dumps(urls),
-                               interpretations=json.dumps(interpretations),
-                               answers=json.dumps(answers),
-                               error=error)
 
-    return render_template("index.html")
+@app.route("/answers")
+def answers():
+    """Get a page of the answers of a candidate for the given question, for
+    answers that were not returned by the /result route.
+    """
+    question = request.args.get("q")
+    qids = request.args.get("qids", "")
+    candidate = request.args.get("candidate", 0, type=int)
+    start = request.args.get("start", 0, type=int)
+    size = request.args.get("size", MAX_ANSWERS_PAGE_SIZE, type=int)
+
+    result = "[]"
+    if question:
+        try:
+            aqqu_result = get_aqqu_result(question, qids)
+            result = get_answers_page(aqqu_result, candidate, start, size)
+        except socket.error:
+            logger.error("Connection to Aqqu API could not be established")
+    return app.response_class(result, mimetype="application/json")
 
 
 @app.route("/qac")
 def qac():
     """Get completion predictions for the current question prefix.
-    """    
+    """
     # Get the current question prefix
     question_prefix = request.args.get("q")
 
     # Get the current time stamp
     timestamp = request.args.get("t")
 
-    # Url encode question prefix to send to QAC API
-    urlencoded_prefix = parse.quote(question_prefix)
+    # The rate limit applies per client address, since clients choose their
+    # client id freely
+    client = get_client_address(request.remote_addr,
+                                request.headers.get("X-Forwarded-For"))
+    if not qac_rate_limiter.allow(client):
+        return get_qac_rejection("rate_limit", 429)
 
-    # Establish connection to QAC API
-    conn = http.client.HTTPConnection(HOSTNAME_QAC + ":" + str(PORT_QAC))
+    # Requests of the same client are identified by the client id. A request
+    # is superseded as soon as a request with a newer time stamp arrives.
+    # Requests without client id are never superseded, since clients behind
+    # the same address have unrelated time stamps.
+    client_id = request.args.get("c")
+    if client_id:
+        superseded = qac_tracker.register(client_id, timestamp)
+    else:
+        superseded = threading.Event()
 
-    # Forward question prefix to QAC API
+    # Forward question prefix to QAC API unless the wikified result for the
+    # prefix is cached or already requested by someone else
     result = []
     try:
-        conn.request("GET", PATH_PREFIX_QAC % urlencoded_prefix)
-        response = conn.getresponse().read().decode("utf8")
-        logger.info("Response: '%s...'" % response[:69])
-        result = json.loads(response)
-
-        # Replace entity mentions by their wikipedia page title
-        for i, res in enumerate(result["results"]):
-            compl = res["completion"]
-            qids = res["qids"]
-            wikipedia_compl, urls = wikipediafy_qac_result(compl, qids)
-            result["results"][i]["wikified_completion"] = wikipedia_compl
-            result["results"][i]["urls"] = urls
+        cached = qac_cache.get(question_prefix)
+        if cached is None and is_short_prefix(question_prefix):
+            cached = get_local_completions(question_prefix, "short_prefix")
+        if cached is None:
+            cached = qac_flight.do(
+                question_prefix,
+                lambda: request_qac_result(question_prefix),
+                abandon=superseded)
 
         # Add received timestamp to the result
-        result.update({"timestamp": timestamp})
-
+        result = dict(cached, timestamp=timestamp)
+    except SupersededError:
+        # The client discards the empty result
+        logger.info("Drop superseded QAC request for '%s'" % question_prefix)
+    except OverloadedError:
+        cached = get_local_completions(question_prefix, "overload")
+        if cached is None:
+            return get_qac_rejection("overload", 503)
+        result = dict(cached, timestamp=timestamp)
     except socket.error:
         logger.error("Connection to QAC API could not be established")
+        cached = get_local_completions(question_prefix, "error")
+        if cached is not None:
+            result = dict(cached, timestamp=timestamp)
+
+    return dump_json(result)
+
+
+def get_client_address(remote_addr, forwarded_for):
+    """Get the address of the client that sent a request. The
+    X-Forwarded-For header is only used if the request comes from a trusted
+    proxy. Then the client is the last address in the header that is not a
+    trusted proxy itself.
+
+    Arguments:
+    remote_addr - address of the peer of the connection
+    forwarded_for - value of the X-Forwarded-For header or None
+    """
+    address = remote_addr
+    if forwarded_for and is_trusted_proxy(address):
+        for address in reversed(forwarded_for.split(",")):
+            address = address.strip()
+            if not is_trusted_proxy(address):
+                break
+    return address
+
 
-    # Close connection to QAC API
-    conn.close()
+def is_trusted_proxy(address):
+    """Return whether the given address belongs to a trusted proxy.
 
-    return json.dumps(result)
+    Arguments:
+    address - the IP address as string
+    """
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    # IPv4 clients of the dual-stack socket have IPv4-mapped addresses
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return any(ip in network for network in trusted_proxies)
+
+
+def get_qac_rejection(reason, status):
+    """Get the response for a rejected QAC request. The client ignores
+    responses with an error status.
+
+    Arguments:
+    reason - "rate_limit" or "overload"
+    status - the HTTP status code, 429 or 503
+    """
+    logger.info("Reject QAC request (%s)" % reason)
+    qac_rejected.inc(reason=reason)
+    return dump_json([]), status, {"Retry-After": str(QAC_RETRY_AFTER)}
 
 
 @app.route("/tooltip")
@@ -132,12 +362,344 @@ def tooltip():
     """Get the Wikipedia information for the given entity.
     """
     qid = request.args.get("qid")
-    if qid in qid_to_wikipedia_info:
-        title, image, abstract = qid_to_wikipedia_info[qid]
+    return dump_json(get_tooltip_info(qid))
+
+
+@app.route("/tooltips")
+def tooltips():
+    """Get the Wikipedia information for all given entities at once. The
+    response only changes with the mappings, so clients and proxies can
+    cache it.
+    """
+    qids = get_tooltip_qids(request.args.get("qids", ""))
+    etag = get_tooltips_etag(qids)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
     else:
-        title, image, abstract = "", "", ""
-    wiki_info = {"image": image, "abstract": abstract}
-    return json.dumps(wiki_info)
+        response = app.response_class(dump_json(get_tooltips_info(qids)),
+                                      mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "public, max-age=%d" % TOOLTIP_MAX_AGE
+    return response
+
+
+@app.route("/metrics")
+def metrics():
+    """Get the metrics of this process in the Prometheus text format.
+    """
+    return app.response_class(metrics_registry.render(),
+                              content_type=METRICS_CONTENT_TYPE)
+
+
+def get_question_urls(qids):
+    """Get the Wikipedia urls of the entities in a question.
+
+    Arguments:
+    qids - comma separated string of the qids in the question
+    """
+    qid_to_wikipedia_info = mappings.qid_to_wikipedia_info
+    urls = []
+    for qid in qids.split(","):
+        if qid in qid_to_wikipedia_info:
+            title, _, _ = qid_to_wikipedia_info[qid]
+            urls.append(get_url_from_title(title))
+    return urls
+
+
+def get_aqqu_result(question, qids):
+    """Get the result for the given question as returned by
+    process_aqqu_response(). Results are served from the answer cache
+    if possible. A stale cached result is returned immediately while a
+    background thread refreshes it.
+
+    Arguments:
+    question - the question string as entered by the user
+    qids - comma separated string of the qids in the question
+    """
+    key = get_answer_cache_key(question, qids)
+    result, is_stale = answer_cache.get_stale(key)
+    if result is None:
+        result = request_aqqu_result(question)
+        answer_cache.put(key, result, get_aqqu_result_size(result))
+    elif is_stale and answer_cache.begin_refresh(key):
+        thread = threading.Thread(target=refresh_aqqu_result,
+                                  args=(question, key), daemon=True)
+        thread.start()
+    return result
+
+
+def request_aqqu_result(question):
+    """Send the given question to the Aqqu API and return the result as
+    returned by process_aqqu_response().
+
+    Arguments:
+    question - the question string as entered by the user
+    """
+    try:
+        response = aqqu_backend.request(get_aqqu_path(question))
+    except socket.error:
+        upstream_errors.inc(backend="aqqu")
+        raise
+    return process_aqqu_response(response)
+
+
+def refresh_aqqu_result(question, key):
+    """Request the result for the given question from the Aqqu API and
+    update the stale answer cache entry with the given key.
+
+    Arguments:
+    question - the question string as entered by the user
+    key - the answer cache key of the question
+    """
+    try:
+        result = request_aqqu_result(question)
+        answer_cache.put(key, result, get_aqqu_result_size(result))
+    except Exception:
+        logger.exception("Refreshing cached answers for '%s' failed"
+                         % question)
+        answer_cache.end_refresh(key)
+
+
+def get_answer_cache_key(question, qids):
+    """Get the answer cache key for the given question, i.e. the question
+    without entity mentions and with normalized whitespace, plus the qids.
+
+    Arguments:
+    question - the question string as entered by the user
+    qids - comma separated string of the qids in the question
+    """
+    return " ".join(replace_entity_mentions(question).split()), qids
+
+
+def get_aqqu_result_size(result):
+    """Get the size of the given Aqqu result in bytes as needed for the
+    answer cache.
+
+    Arguments:
+    result - tuple as returned by process_aqqu_response()
+    """
+    interpretations, answers, error, answer_counts, candidates = result
+    return (len(interpretations) + len(answers) + len(error)
+            + len(answer_counts) + sum(len(c) for c in candidates))
+
+
+def get_result_json(result):
+    """Get the json string of the given Aqqu result as returned by the
+    /result route.
+
+    Arguments:
+    result - tuple as returned by process_aqqu_response()
+    """
+    interpretations, answers, error, answer_counts, _ = result
+    return ('{"interpretations": %s, "answers": %s, "answer_counts": %s,'
+            ' "error": %s}' % (interpretations, answers, answer_counts,
+                               dump_json(error)))
+
+
+def get_error_result(error):
+    """Get an Aqqu result without answers and with the given error message.
+
+    Arguments:
+    error - the error message
+    """
+    return dump_json([]), dump_json([]), error, dump_json([]), []
+
+
+def get_answers_page(result, candidate, start, size):
+    """Get the json string of the given range of answers of a candidate.
+
+    Arguments:
+    result - tuple as returned by process_aqqu_response()
+    candidate - index of the candidate
+    start - index of the first answer
+    size - number of answers, at most MAX_ANSWERS_PAGE_SIZE
+    """
+    candidates = result[4]
+    if not 0 <= candidate < len(candidates):
+        return "[]"
+    start = max(start, 0)
+    size = min(max(size, 0), MAX_ANSWERS_PAGE_SIZE)
+    with stage_duration.time(stage="aqqu_enrich"):
+        answers = load_json(candidates[candidate])[start:start + size]
+        return "[%s]" % ", ".join(get_answers([answers])[0])
+
+
+def get_aqqu_path(question):
+    """Get the request path for sending the given question to the Aqqu API.
+
+    Arguments:
+    question - the question string as entered by the user
+    """
+    # Replace entity mentions by entity name
+    aqqu_question = replace_entity_mentions(question)
+    # Url encode question to send it to Aqqu API
+    aqqu_question = parse.quote(aqqu_question)
+    return PATH_PREFIX_AQQU % aqqu_question
+
+
+def process_aqqu_response(response):
+    """Get the result for the response of the Aqqu API as tuple of
+    - the interpretation strings as json
+    - the answers of the top candidates as json, see get_top_answers()
+    - an error message
+    - the number of answers of each candidate as json
+    - the names and MIDs of the answers of each candidate as one json
+      string per candidate, from which further answers are served
+
+    Arguments:
+    response - body of the Aqqu API response as bytes
+    """
+    with stage_duration.time(stage="aqqu_parse"):
+        response = response.decode("utf8")
+        logger.info("Response: '%s...'" % response[:69])
+        json_obj = load_json(response)
+
+    with stage_duration.time(stage="aqqu_enrich"):
+        interpretations = get_interpretation_strings(json_obj)
+        candidates = get_candidate_answers(json_obj)
+        answers = get_answers(get_top_answers(candidates))
+        answer_counts = [len(cand) for cand in candidates]
+
+        error = ""
+        if len(candidates) == 0:
+            error = "No answers found"
+        return (dump_json(interpretations), dump_answers(answers), error,
+                dump_json(answer_counts), [dump_json(c) for c in candidates])
+
+
+def get_qac_path(question_prefix):
+    """Get the request path for sending the given prefix to the QAC API.
+
+    Arguments:
+    question_prefix - the question prefix as entered by the user
+    """
+    # Url encode question prefix to send to QAC API
+    urlencoded_prefix = parse.quote(question_prefix)
+    return PATH_PREFIX_QAC % urlencoded_prefix
+
+
+def request_qac_result(question_prefix):
+    """Send the given question prefix to the QAC API, add the wikified
+    completions to the response and cache the result.
+
+    Arguments:
+    question_prefix - the question prefix as entered by the user
+    """
+    try:
+        with qac_admission.admit():
+            response = qac_backend.request(get_qac_path(question_prefix))
+    except socket.error:
+        upstream_errors.inc(backend="qac")
+        raise
+    result = process_qac_response(response)
+    qac_cache.put(question_prefix, result, len(response))
+    return result
+
+
+def process_qac_response(response):
+    """Add the wikified completions and entity urls to the response of the
+    QAC API.
+
+    Arguments:
+    response - body of the QAC API response as bytes
+    """
+    with stage_duration.time(stage="qac_parse"):
+        response = response.decode("utf8")
+        logger.info("Response: '%s...'" % response[:69])
+        result = load_json(response)
+
+    # Replace entity mentions by their wikipedia page title
+    with stage_duration.time(stage="qac_enrich"):
+        wikify_qac_results(result["results"])
+    return result
+
+
+def wikify_qac_results(results):
+    """Add the wikified completion and the entity urls to each of the given
+    QAC results and return the results.
+
+    Arguments:
+    results - list of QAC results with the keys "completion" and "qids"
+    """
+    for res in results:
+        compl = res["completion"]
+        qids = res["qids"]
+        wikipedia_compl, urls = wikipediafy_qac_result(compl, qids)
+        res["wikified_completion"] = wikipedia_compl
+        res["urls"] = urls
+    return results
+
+
+def is_short_prefix(question_prefix):
+    """Return whether the given question prefix is short enough to be
+    completed from the local completion index right away.
+
+    Arguments:
+    question_prefix - the question prefix as entered by the user
+    """
+    return (qac_fallback_index is not None and question_prefix is not None
+            and len(question_prefix.strip()) <= qac_local_prefix_length)
+
+
+def get_local_completions(question_prefix, reason):
+    """Get the wikified completions for the given question prefix from the
+    local completion index in the format of process_qac_response(). Return
+    None if there is no index or it has no completions for the prefix.
+
+    Arguments:
+    question_prefix - the question prefix as entered by the user
+    reason - why the local index is used, "short_prefix", "error" or
+             "overload"
+    """
+    if qac_fallback_index is None or question_prefix is None:
+        return None
+    with stage_duration.time(stage="qac_local"):
+        results = qac_fallback_index.complete(question_prefix)
+        if not results:
+            return None
+        qac_fallbacks.inc(reason=reason)
+        return {"results": wikify_qac_results(results)}
+
+
+def get_tooltip_info(qid):
+    """Get the image and abstract of the given entity as dictionary.
+
+    Arguments:
+    qid - the QID of the entity
+    """
+    title, image, abstract = mappings.qid_to_wikipedia_info.get(
+        qid, ("", "", ""))
+    return {"image": image, "abstract": abstract}
+
+
+def get_tooltip_qids(qids):
+    """Get the list of QIDs for a batch tooltip request.
+
+    Arguments:
+    qids - comma separated string of QIDs
+    """
+    return [qid for qid in qids.split(",") if qid][:MAX_TOOLTIP_BATCH_SIZE]
+
+
+def get_tooltips_info(qids):
+    """Get the image and abstract of each given entity as mapping from QID
+    to dictionary.
+
+    Arguments:
+    qids - list of QIDs
+    """
+    return {qid: get_tooltip_info(qid) for qid in qids}
+
+
+def get_tooltips_etag(qids):
+    """Get the ETag of a batch tooltip response. It is derived from the
+    version of the loaded mappings and the requested QIDs.
+
+    Arguments:
+    qids - list of QIDs
+    """
+    qids_hash = hashlib.sha1(",".join(qids).encode("utf8")).hexdigest()
+    return "%s-%s" % (mappings.version, qids_hash[:16])
 
 
 def replace_entity_mentions(question):
@@ -150,36 +712,90 @@ def replace_entity_mentions(question):
     return re.sub(r"\[(.*?)\]", r"\1", question)
 
 
-def get_answers(json_obj):
-    """Get answers from the json_object as list of entity names.
+def get_candidate_answers(json_obj):
+    """Get the answers of each candidate from the json_object as list of
+    [name, MID] lists.
 
     Arguments:
     json_obj - json object returned by the Aqqu API
     """
-    candidates = json_obj["candidates"]
+    return [[[ans["name"], ans.get("mid", "")] for ans in cand["answers"]]
+            for cand in json_obj["candidates"]]
+
+
+def get_top_answers(candidates):
+    """Get the first top_answers answers of the first top_candidates
+    candidates.
+
+    Arguments:
+    candidates - list of lists of [name, MID] lists
+    """
+    if top_candidates:
+        candidates = candidates[:top_candidates]
+    if top_answers:
+        candidates = [cand[:top_answers] for cand in candidates]
+    return candidates
+
+
+def get_answers(candidates):
+    """Enrich the answers of each candidate with Wikipedia information.
+    Each answer is returned as json encoded object with the name, Wikipedia
+    url, image, abstract and MID of the answer entity. Use dump_answers() to
+    get the json string of all answers.
+
+    Arguments:
+    candidates - list of lists of [name, MID] lists
+    """
+    # Use the same version of the mappings for all answers
+    current_mappings = mappings
+    get_entity_fragment = current_mappings.get_entity_fragment
+
+    # Look up the QIDs of all answer entities at once
+    mids = [mid for cand in candidates for _, mid in cand]
+    qids = iter(current_mappings.mid_to_qid.get_many(mids))
+
     new_candidates = []
     for cand in candidates:
-        # Get the names of the answer entities of the candidate
-        cand_answers = cand["answers"]
         answers = []
-        for ans in cand_answers:
-            name = ans["name"]
-            mid = ""
-            if "mid" in ans:
-                mid = ans["mid"]
-            url, image, abstract = "", "", ""
-            if mid in mid_to_qid:
-                qid = mid_to_qid[mid]
-                if qid in qid_to_wikipedia_info:
-                    title, image, abstract = qid_to_wikipedia_info[qid]
-                    url = get_url_from_title(title)
-            answer = {"name": name, "url": url, "image": image,
-                      "abstract": abstract, "mid": mid}
+        for name, mid in cand:
+            answer = '{"name": %s, %s, "mid": %s}' % (
+                dump_json(name), get_entity_fragment(next(qids)),
+                dump_json(mid))
             answers.append(answer)
         new_candidates.append(answers)
     return new_candidates
 
 
+def dump_answers(answers):
+    """Get the json string of the given answers as returned by
+    get_answers().
+
+    Arguments:
+    answers - list of lists of json encoded answers
+    """
+    return "[%s]" % ", ".join("[%s]" % ", ".join(candidate)
+                              for candidate in answers)
+
+
+def get_entity_fragment(qid_to_wikipedia_info, qid):
+    """Get the Wikipedia url, image and abstract of the given entity as
+    json encoded object members. Memoized per version of the mappings by
+    Mappings.get_entity_fragment(), so answers are encoded without looking
+    up and encoding the Wikipedia information of frequent answer entities
+    again.
+
+    Arguments:
+    qid_to_wikipedia_info - the QID to Wikipedia info mapping
+    qid - the QID of the entity or None
+    """
+    url, image, abstract = "", "", ""
+    if qid is not None and qid in qid_to_wikipedia_info:
+        title, image, abstract = qid_to_wikipedia_info[qid]
+        url = get_url_from_title(title)
+    return '"url": %s, "image": %s, "abstract": %s' % (
+        dump_json(url), dump_json(image), dump_json(abstract))
+
+
 def get_interpretation_strings(json_obj):
     """Get interpretation strings from the json_object as list of strings.
 
@@ -248,6 +864,7 @@ def wikipediafy_qac_result(completion, qids):
     completion - the completion string returned by the QAC API
     qids - list of qids of entities in the completion returned by the API
     """
+    qid_to_wikipedia_info = mappings.qid_to_wikipedia_info
     title = ""
     urls = []
     for i, qid in enumerate(qids):
@@ -262,41 +879,84 @@ def wikipediafy_qac_result(completion, qids):
     return completion, urls
 
 
-def get_wikipedia_mapping(input_file):
+def get_wikipedia_mapping(input_file, processes=1):
     """Read the QID to Wikipedia page-title, image and abstract from the given
     input file and return the mapping as dictionary.
 
     Arguments:
     input_file - path to the mappings file
+    processes - number of processes that parse the file
     """
     logger.info("Read wikipedia mapping file %s" % input_file)
-    mapping = dict()
-    with open(input_file, "r", encoding="utf8") as file:
-        for line in file:
-            qid, title, image, abstract = line.split("\t")
-            abstract = abstract.strip()
-            qid = qid.lower()
-            mapping[qid] = (title, image, abstract)
-    return mapping
+    return dict(parse_file(input_file, read_wikipedia_entries, processes))
+
 
+def get_compressed_wikipedia_mapping(input_file):
+    """Read the QID to Wikipedia page-title, image and abstract from the given
+    input file into an in-memory WikiInfoIndex whose abstracts are stored in
+    compressed blocks.
 
-def get_mid_to_qid_mapping(input_file):
+    Arguments:
+    input_file - path to the mappings file
+    """
+    return load_index(input_file, compress=True)
+
+
+def read_wikipedia_entries(file):
+    """Yield the (QID, (title, image, abstract)) entries of the given QID to
+    Wikipedia info mapping file.
+
+    Arguments:
+    file - the opened mappings file or an iterable over its lines
+    """
+    for line in file:
+        qid, title, image, abstract = line.split("\t")
+        abstract = abstract.strip()
+        qid = qid.lower()
+        yield qid, (title, image, abstract)
+
+
+def get_mid_to_qid_mapping(input_file, processes=1):
     """Read the MID to QID mapping from the given input file and return the
-    mapping as dictionary.
+    mapping as compact MidToQidTable.
 
     Arguments:
     input_file - path to the mappings file
+    processes - number of processes that parse the file
     """
     logger.info("Read MID to QID file %s" % input_file)
-    mapping = dict()
-    with open(input_file, "r", encoding="utf8") as file:
-        for line in file:
-            mid, qid = line.split("\t")
-            qid = qid.strip().lower()
-            mapping[mid] = qid
+    # The pairs are encoded as integers while parsing, so that only compact
+    # arrays are passed between the processes
+    chunks = parse_file(input_file, encode_mid_qid_pairs, processes)
+    mapping = MidToQidTable.from_encoded(chunks)
+    logger.info("MID to QID table has %d entries and uses %.1f MB"
+                % (len(mapping), mapping.nbytes / 1024 ** 2))
     return mapping
 
 
+def read_mid_qid_pairs(file):
+    """Yield the (MID, QID) pairs of the given MID to QID mapping file.
+
+    Arguments:
+    file - the opened mappings file or an iterable over its lines
+    """
+    for line in file:
+        mid, qid = line.split("\t")
+        qid = qid.strip().lower()
+        yield mid, qid
+
+
+def encode_mid_qid_pairs(file):
+    """Return a list with the encoded (MID, QID) pairs of the given MID to QID
+    mapping file, see mid_qid_table.encode_pairs().
+
+    Arguments:
+    file - the opened mappings file or an iterable over its lines
+    """
+    return [encode_pairs(read_mid_qid_pairs(file))]
+
+
+@functools.lru_cache(maxsize=ENTITY_CACHE_SIZE)
 def get_url_from_title(title):
     """Get the Wikipedia page url for an entity with the given title
 
@@ -307,23 +967,579 @@ def get_url_from_title(title):
     return "https://en.wikipedia.org/wiki/" + title
 
 
-if __name__ == "__main__":
-    # Parse command line arguments
+def dump_json(obj):
+    """Serialize the given object to a json string. Uses orjson if it is
+    installed, which is considerably faster than the json module.
+
+    Arguments:
+    obj - the object to serialize
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf8")
+    return json.dumps(obj)
+
+
+def load_json(data):
+    """Parse the given json string or bytes. Uses orjson if it is installed.
+
+    Arguments:
+    data - the json string or bytes
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def observe_upstream_stage(backend):
+    """Get a function that records the connect and wait times of requests
+    to the given backend in the stage histogram, see ConnectionPool.
+
+    Arguments:
+    backend - name of the backend, "aqqu" or "qac"
+    """
+    def observe(stage, seconds):
+        stage_duration.observe(seconds, stage="%s_%s" % (backend, stage))
+    return observe
+
+
+def collect_mapping_sizes():
+    """Get the number of entries of each mapping for the metrics.
+    """
+    if mappings is None:
+        return []
+    return [(("qid_to_wikipedia_info",), len(mappings.qid_to_wikipedia_info)),
+            (("mid_to_qid",), len(mappings.mid_to_qid))]
+
+
+def collect_cache_stats(stat):
+    """Get the given statistic of each cache for the metrics.
+
+    Arguments:
+    stat - name of the statistic as returned by LRUCache.stats()
+    """
+    return [((name,), cache.stats()[stat])
+            for name, cache in (("qac", qac_cache), ("answer", answer_cache))
+            if cache is not None]
+
+
+def collect_cache_requests():
+    """Get the number of cache lookups by cache and result for the metrics.
+    """
+    samples = []
+    for stat, result in (("hits", "hit"), ("stale_hits", "stale_hit"),
+                         ("misses", "miss")):
+        for (name,), value in collect_cache_stats(stat):
+            samples.append(((name, result), value))
+    return samples
+
+
+def get_backends():
+    """Get the backend clients that have been set up as (name, backend)
+    tuples.
+    """
+    return [(name, backend) for name, backend
+            in (("aqqu", aqqu_backend), ("qac", qac_backend))
+            if backend is not None]
+
+
+def collect_pool_stats():
+    """Get the number of open and idle backend connections summed over the
+    replicas of each backend for the metrics.
+    """
+    samples = []
+    for name, backend in get_backends():
+        for state in ("idle", "open"):
+            total = sum(replica_stats.get(state, 0)
+                        for replica_stats in backend.stats().values())
+            samples.append(((name, state), total))
+    return samples
+
+
+def collect_replica_stats(stat):
+    """Get the given stat of each backend replica for the metrics.
+
+    Arguments:
+    stat - "outstanding", "failures" or "circuit_open", see
+           ReplicaSet.stats()
+    """
+    samples = []
+    for name, backend in get_backends():
+        for address, replica_stats in sorted(backend.stats().items()):
+            samples.append(((name, address), replica_stats[stat]))
+    return samples
+
+
+def collect_backend_retries():
+    """Get the number of hedged and failover requests per backend for the
+    metrics.
+    """
+    samples = []
+    for name, backend in get_backends():
+        for reason, value in sorted(backend.retries.items()):
+            samples.append(((name, reason), value))
+    return samples
+
+
+def collect_admission_stats():
+    """Get the number of admitted and waiting QAC requests for the metrics.
+    """
+    if qac_admission is None:
+        return []
+    stats = qac_admission.stats()
+    return [(("active",), stats["active"]), (("waiting",), stats["waiting"])]
+
+
+def get_argument_parser():
+    """Get the command line argument parser shared by the server entry
+    points.
+    """
     default_path = "/nfs/students/natalie-prange/wikidata_mappings/"
     parser = argparse.ArgumentParser()
     parser.add_argument("port",
                         help="Specify port on which to run the server")
     parser.add_argument("-d", "--data", default=default_path,
                         help="Specify path on which to look for data files")
+    parser.add_argument("--mmap", action="store_true",
+                        help="Memory-map the index file"
+                             " qid_to_wikipedia_info.idx (see"
+                             " wiki_info_index.py) instead of reading"
+                             " qid_to_wikipedia_info.tsv into memory")
+    parser.add_argument("--compress-abstracts", action="store_true",
+                        help="Keep the abstracts of"
+                             " qid_to_wikipedia_info.tsv in compressed"
+                             " blocks in memory that are decompressed on"
+                             " access. Has no effect with --mmap, which"
+                             " uses the index as built.")
+    parser.add_argument("--snapshot",
+                        help="Load the mappings from the given snapshot file."
+                             " The snapshot is built on the first start and"
+                             " rebuilt whenever the mapping files change.")
+    parser.add_argument("--load-processes", type=int, default=1,
+                        help="Number of processes that parse each mapping"
+                             " file when the mappings are (re)loaded.")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="Number of worker processes. With more than one"
+                             " worker, the mappings are loaded once and"
+                             " shared with the forked workers. Send SIGHUP"
+                             " to restart the workers gracefully.")
+    parser.add_argument("--metrics-port", type=int,
+                        help="With more than one worker, worker i also"
+                             " accepts connections on this port + i, so"
+                             " that the /metrics of each worker can be"
+                             " scraped separately. Has no effect with a"
+                             " single worker.")
+    parser.add_argument("--aqqu", default="%s:%d" % (HOSTNAME_AQQU, PORT_AQQU),
+                        help="Comma separated host:port addresses of the"
+                             " Aqqu API replicas")
+    parser.add_argument("--qac", default="%s:%d" % (HOSTNAME_QAC, PORT_QAC),
+                        help="Comma separated host:port addresses of the"
+                             " QAC API replicas")
+    parser.add_argument("--aqqu-deadline", type=float, default=30.0,
+                        help="Maximum time in seconds for an Aqqu request"
+                             " including retries on other replicas")
+    parser.add_argument("--qac-deadline", type=float, default=10.0,
+                        help="Maximum time in seconds for a QAC request"
+                             " including retries on other replicas")
+    parser.add_argument("--aqqu-hedge-delay", type=float,
+                        help="Also send an Aqqu request to a second replica"
+                             " if the first has not answered after this"
+                             " many seconds. Default: never.")
+    parser.add_argument("--qac-hedge-delay", type=float,
+                        help="Also send a QAC request to a second replica"
+                             " if the first has not answered after this"
+                             " many seconds. Default: never.")
+    parser.add_argument("--breaker-failures", type=int, default=5,
+                        help="Number of consecutive failed requests after"
+                             " which a backend replica gets no requests for"
+                             " --breaker-reset seconds")
+    parser.add_argument("--breaker-reset", type=float, default=10.0,
+                        help="Time in seconds after which a failing backend"
+                             " replica gets a trial request")
+    parser.add_argument("--pool-size", type=int, default=10,
+                        help="Maximum number of keep-alive connections per"
+                             " backend replica")
+    parser.add_argument("--connect-timeout", type=float, default=2.0,
+                        help="Timeout in seconds for connecting to a backend")
+    parser.add_argument("--read-timeout", type=float, default=30.0,
+                        help="Timeout in seconds for a backend response")
+    parser.add_argument("--idle-timeout", type=float, default=60.0,
+                        help="Close keep-alive connections that were idle for"
+                             " longer than this many seconds")
+    parser.add_argument("--top-candidates", type=int, default=0,
+                        help="Only return the answers of this many candidates"
+                             " from /result, 0 for all. The client requests"
+                             " further answers when needed.")
+    parser.add_argument("--top-answers", type=int, default=0,
+                        help="Only return this many answers per candidate"
+                             " from /result, 0 for all")
+    parser.add_argument("--qac-concurrency", type=int,
+                        help="Maximum number of concurrent requests to the"
+                             " QAC API. Default: --pool-size times the"
+                             " number of QAC replicas.")
+    parser.add_argument("--qac-queue-time", type=float, default=0.2,
+                        help="Maximum time in seconds a QAC request waits"
+                             " for one of the --qac-concurrency slots."
+                             " Requests that would wait longer are rejected"
+                             " with status 503.")
+    parser.add_argument("--qac-rate", type=float, default=0,
+                        help="Maximum number of QAC requests per second and"
+                             " client address, 0 for no limit. Further"
+                             " requests are rejected with status 429. Behind"
+                             " a reverse proxy, also pass --trusted-proxies,"
+                             " or else all clients share one limit.")
+    parser.add_argument("--qac-burst", type=int, default=40,
+                        help="Maximum number of QAC requests a client may"
+                             " send at once")
+    parser.add_argument("--trusted-proxies", default="",
+                        help="Comma separated addresses or networks of"
+                             " reverse proxies, e.g. 127.0.0.1,10.0.0.0/8."
+                             " For their requests, the QAC rate limit"
+                             " applies to the client address from the"
+                             " X-Forwarded-For header.")
+    parser.add_argument("--qac-fallback",
+                        help="File with popular questions, one per line in"
+                             " the format <completion>TAB<comma separated"
+                             " QIDs>TAB<frequency>. Completions are served"
+                             " from an index over these questions if the"
+                             " QAC API fails or is overloaded.")
+    parser.add_argument("--qac-local-prefix-length", type=int, default=2,
+                        help="Serve completions for prefixes of at most this"
+                             " many characters from the --qac-fallback"
+                             " index without asking the QAC API")
+    parser.add_argument("--qac-cache-size", type=int, default=10000,
+                        help="Maximum number of cached QAC results")
+    parser.add_argument("--qac-cache-bytes", type=int, default=64 * 1024 ** 2,
+                        help="Maximum total size of cached QAC results in"
+                             " bytes")
+    parser.add_argument("--qac-cache-ttl", type=float, default=3600,
+                        help="Time in seconds after which a cached QAC result"
+                             " expires")
+    parser.add_argument("--answer-cache-size", type=int, default=1000,
+                        help="Maximum number of cached Aqqu results")
+    parser.add_argument("--answer-cache-bytes", type=int,
+                        default=256 * 1024 ** 2,
+                        help="Maximum total size of cached Aqqu results in"
+                             " bytes")
+    parser.add_argument("--answer-cache-ttl", type=float, default=600,
+                        help="Time in seconds after which a cached Aqqu result"
+                             " is refreshed")
+    parser.add_argument("--answer-cache-stale-ttl", type=float, default=3600,
+                        help="Time in seconds for which an expired Aqqu result"
+                             " is still served while it is being refreshed")
+    return parser
+
+
+def get_backend_options(args, name):
+    """Get the keyword arguments for a backend client of the given backend
+    from the parsed command line arguments.
+
+    Arguments:
+    args - the parsed command line arguments
+    name - name of the backend, "aqqu" or "qac"
+    """
+    return dict(deadline=getattr(args, name + "_deadline"),
+                hedge_delay=getattr(args, name + "_hedge_delay"),
+                failure_threshold=args.breaker_failures,
+                reset_timeout=args.breaker_reset)
+
+
+class Mappings:
+    """One version of the QID to Wikipedia info and the MID to QID mapping.
+    The module level mappings are replaced as a whole when the mapping files
+    are reloaded, so code that keeps a reference to the current mappings
+    sees a consistent version.
+    """
+
+    def __init__(self, qid_to_wikipedia_info, mid_to_qid, version):
+        """Create a new version of the mappings.
+
+        Arguments:
+        qid_to_wikipedia_info - the QID to Wikipedia info mapping
+        mid_to_qid - the MID to QID mapping
+        version - string that identifies the content of the mapping files
+        """
+        self.qid_to_wikipedia_info = qid_to_wikipedia_info
+        self.mid_to_qid = mid_to_qid
+        self.version = version
+        # Fragments are memoized per version, so a reload never serves
+        # fragments of the previous mappings
+        self.get_entity_fragment = functools.lru_cache(
+            maxsize=ENTITY_CACHE_SIZE)(
+            functools.partial(get_entity_fragment, qid_to_wikipedia_info))
+
+
+def load_mappings(data_path, use_index=False, snapshot_file=None,
+                  processes=1, compress_abstracts=False):
+    """Load the QID to Wikipedia info and the MID to QID mapping from the
+    given data directory into the module level mappings. The previous
+    mappings, if any, are replaced in a single step once the new mappings
+    are loaded.
+
+    Arguments:
+    data_path - path to the data directory with trailing "/"
+    use_index - memory-map the QID to Wikipedia info index file instead of
+                reading the tsv file into memory
+    snapshot_file - if given, load the mappings from this snapshot file
+                    unless the source files changed since it was built. An
+                    outdated or missing snapshot is (re)built.
+    processes - number of processes that parse each mapping file. With
+                compress_abstracts, the QID to Wikipedia info mapping is
+                read by a single process.
+    compress_abstracts - keep the abstracts of the QID to Wikipedia info
+                         mapping in compressed blocks instead of a
+                         dictionary. Has no effect with use_index.
+    """
+    global mappings
+    start = time.time()
+    memory_before = get_memory_usage()
+
+    # Mappings that are read into memory and can be stored in a snapshot, as
+    # (file, function that reads the file)
+    sources = dict()
+    mid_to_qid_file = data_path + "mid_to_qid15_combined.tsv"
+    sources["mid_to_qid"] = (mid_to_qid_file, functools.partial(
+        get_mid_to_qid_mapping, processes=processes))
+    wiki_info_file = data_path + "qid_to_wikipedia_info.tsv"
+    wiki_info_index_file = data_path + "qid_to_wikipedia_info.idx"
+    if use_index:
+        compress_abstracts = False
+    elif compress_abstracts:
+        sources["qid_to_wikipedia_info"] = (wiki_info_file,
+                                            get_compressed_wikipedia_mapping)
+    else:
+        sources["qid_to_wikipedia_info"] = (wiki_info_file, functools.partial(
+            get_wikipedia_mapping, processes=processes))
+
+    source_files = [file for file, _ in sources.values()]
+    fingerprint = get_source_fingerprint(
+        source_files, mappings=sorted(sources),
+        compress_abstracts=compress_abstracts)
+    # The version identifies the content of the mapping files
+    version = get_source_fingerprint(
+        [mid_to_qid_file, wiki_info_index_file if use_index
+         else wiki_info_file])[:16]
+
+    loaded = None
+    if snapshot_file:
+        loaded = read_snapshot(snapshot_file, fingerprint)
+    if loaded is None:
+        loaded = {name: read_mapping(file)
+                  for name, (file, read_mapping) in sources.items()}
+        if snapshot_file:
+            write_snapshot(snapshot_file, fingerprint, loaded)
+    else:
+        logger.info("Read mappings from snapshot %s" % snapshot_file)
+
+    if use_index:
+        logger.info("Map wikipedia index file %s" % wiki_info_index_file)
+        loaded["qid_to_wikipedia_info"] = WikiInfoIndex(wiki_info_index_file)
+    mappings = Mappings(loaded["qid_to_wikipedia_info"],
+                        loaded["mid_to_qid"], version)
+    del loaded
 
-    args = parser.parse_args()
+    memory_after = get_memory_usage()
+    if memory_before is None or memory_after is None:
+        logger.info("Loaded mappings in %.1fs" % (time.time() - start))
+    else:
+        logger.info("Loaded mappings in %.1fs, memory usage changed by"
+                    " %+.1f MB" % (time.time() - start,
+                                   (memory_after - memory_before) / 1e6))
+
+
+def reload_mappings(data_path, use_index=False, snapshot_file=None,
+                    processes=1, compress_abstracts=False):
+    """Reload the mappings in a background thread, see load_mappings().
+    Requests are served with the previous mappings until the new mappings
+    are loaded. Afterwards the cached results, which were computed with the
+    previous mappings, are cleared. Does nothing if a reload is already in
+    progress.
+
+    Arguments:
+    data_path - path to the data directory with trailing "/"
+    use_index - see load_mappings()
+    snapshot_file - see load_mappings()
+    processes - see load_mappings()
+    compress_abstracts - see load_mappings()
+    """
+    def reload():
+        try:
+            logger.info("Reload mappings")
+            load_mappings(data_path, use_index, snapshot_file, processes,
+                          compress_abstracts)
+            qac_cache.clear()
+            answer_cache.clear()
+        except Exception:
+            logger.exception("Reloading the mappings failed, keep serving"
+                             " the previous mappings")
+        finally:
+            reload_lock.release()
+
+    if not reload_lock.acquire(blocking=False):
+        logger.warning("Ignore reload, the mappings are already being"
+                       " reloaded")
+        return
+    threading.Thread(target=reload, daemon=True).start()
+
+
+def get_memory_usage():
+    """Get the resident memory of the process in bytes or None if it can not
+    be determined.
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            resident_pages = int(file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def create_caches(args):
+    """Create the module level caches with the sizes given on the command
+    line.
+
+    Arguments:
+    args - the parsed command line arguments
+    """
+    global qac_cache, answer_cache
+    qac_cache = LRUCache(max_entries=args.qac_cache_size,
+                         max_bytes=args.qac_cache_bytes,
+                         ttl=args.qac_cache_ttl)
+    answer_cache = LRUCache(max_entries=args.answer_cache_size,
+                            max_bytes=args.answer_cache_bytes,
+                            ttl=args.answer_cache_ttl,
+                            stale_ttl=args.answer_cache_stale_ttl)
+
+
+def create_qac_limits(args, admission_class=AdmissionController):
+    """Create the module level QAC admission controller and rate limiter
+    with the limits given on the command line.
+
+    Arguments:
+    args - the parsed command line arguments
+    admission_class - the admission controller class to use, e.g.
+                      AsyncAdmissionController
+    """
+    global qac_admission, qac_rate_limiter, trusted_proxies
+    concurrency = args.qac_concurrency
+    if concurrency is None:
+        concurrency = args.pool_size * len(parse_addresses(args.qac))
+    qac_admission = admission_class(concurrency, args.qac_queue_time)
+    qac_rate_limiter = RateLimiter(args.qac_rate, args.qac_burst)
+    trusted_proxies = [ipaddress.ip_network(proxy.strip(), strict=False)
+                       for proxy in args.trusted_proxies.split(",")
+                       if proxy.strip()]
+    if args.qac_rate > 0 and not trusted_proxies:
+        logger.warning("QAC requests are rate limited per peer address. If"
+                       " the server is behind a reverse proxy, pass it with"
+                       " --trusted-proxies.")
+
+
+def load_qac_fallback(args):
+    """Build the module level fallback completion index from the popular
+    questions file given on the command line, if any.
+
+    Arguments:
+    args - the parsed command line arguments
+    """
+    global qac_fallback_index, qac_local_prefix_length
+    if args.qac_fallback:
+        qac_fallback_index = CompletionIndex.from_file(args.qac_fallback)
+        qac_local_prefix_length = args.qac_local_prefix_length
+
+
+def serve_prefork_worker(socks, worker):
+    """Serve requests on the given listening sockets in a worker process of
+    the pre-fork server. On SIGTERM, stop accepting new connections and give
+    requests in flight some time to finish. The metrics of the worker are
+    labeled with its number.
+
+    Arguments:
+    socks - the listening socket shared by all workers and optionally the
+            listening socket of this worker
+    worker - the number of the worker
+    """
+    metrics_registry.set_constant_labels(worker=worker)
+    servers = []
+    for sock in socks:
+        host, port = sock.getsockname()[:2]
+        servers.append(make_server(host, port, app, threaded=True,
+                                   fd=sock.fileno()))
+        logger.info("Worker %d serving on port %d" % (os.getpid(), port))
+
+    def shutdown(signum, frame):
+        for server in servers:
+            threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    for server in servers[1:]:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    servers[0].serve_forever()
+
+    deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread():
+            thread.join(max(0, deadline - time.monotonic()))
+    for server in servers:
+        server.server_close()
+
+
+def create_worker_sockets(args):
+    """Create the listening sockets of the workers on the consecutive ports
+    from --metrics-port on. Return None if no metrics port is given.
+
+    Arguments:
+    args - the parsed command line arguments
+    """
+    if args.metrics_port is None:
+        return None
+    return [create_listening_socket("::", args.metrics_port + i)
+            for i in range(args.workers)]
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = get_argument_parser().parse_args()
     port = args.port
     data_path = args.data.rstrip("/") + "/"
 
     # Load data
-    wiki_info_file = data_path + "qid_to_wikipedia_info.tsv"
-    qid_to_wikipedia_info = get_wikipedia_mapping(wiki_info_file)
-    mid_to_qid_file = data_path + "mid_to_qid15_combined.tsv"
-    mid_to_qid = get_mid_to_qid_mapping(mid_to_qid_file)
+    load_mappings(data_path, args.mmap, args.snapshot, args.load_processes,
+                  args.compress_abstracts)
+    create_caches(args)
+    create_qac_limits(args)
+    load_qac_fallback(args)
+    top_candidates = args.top_candidates
+    top_answers = args.top_answers
+
+    # Set up the backend clients with a pool of keep-alive connections per
+    # replica
+    def create_pool_factory(name):
+        return lambda host, port: ConnectionPool(
+            host, port, size=args.pool_size,
+            connect_timeout=args.connect_timeout,
+            read_timeout=args.read_timeout, idle_timeout=args.idle_timeout,
+            observe=observe_upstream_stage(name))
 
-    app.run(threaded=True, host="::", port=port, debug=False)
+    aqqu_backend = Backend("aqqu", parse_addresses(args.aqqu),
+                           create_pool_factory("aqqu"),
+                           **get_backend_options(args, "aqqu"))
+    qac_backend = Backend("qac", parse_addresses(args.qac),
+                          create_pool_factory("qac"),
+                          **get_backend_options(args, "qac"))
+
+    if args.workers > 1:
+        # Share the loaded mappings with forked worker processes. On
+        # SIGUSR1, the master reloads the mappings and restarts the workers.
+        sock = create_listening_socket("::", port)
+        PreforkServer(sock, args.workers, serve_prefork_worker,
+                      reload_data=lambda: load_mappings(
+                          data_path, args.mmap, args.snapshot,
+                          args.load_processes,
+                          args.compress_abstracts),
+                      worker_socks=create_worker_sockets(args)).run()
+    else:
+        # Reload the mappings on SIGUSR1
+        signal.signal(signal.SIGUSR1, lambda signum, frame: reload_mappings(
+            data_path, args.mmap, args.snapshot, args.load_processes,
+            args.compress_abstracts))
+        app.run(threaded=True, host="::", port=port, debug=False)
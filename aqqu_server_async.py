@@ -0,0 +1,570 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+import os
+import time
+import asyncio
+import signal
+import hashlib
+import logging
+import functools
+
+import aiohttp
+import jinja2
+from aiohttp import web
+
+import aqqu_server
+from prefork import PreforkServer, create_listening_socket
+from backends import AsyncBackend, parse_addresses
+from connection_pool import ServerError
+from admission import AsyncAdmissionController, OverloadedError
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from coalescing import (AsyncSingleFlight, SupersessionTracker,
+                        SupersededError)
+from aqqu_server import (get_aqqu_path, get_qac_path, get_question_urls,
+                         get_tooltip_info, get_tooltip_qids,
+                         get_tooltips_info, get_tooltips_etag,
+                         get_answer_cache_key,
+                         get_aqqu_result_size, process_aqqu_response,
+                         process_qac_response, get_answers_page,
+                         request_count, request_duration, stage_duration,
+                         upstream_errors, qac_rejected, metrics_registry,
+                         get_result_json, get_error_result, dump_json,
+                         load_json, is_short_prefix, get_local_completions,
+                         get_client_address)
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Errors of an upstream request that are treated like a socket.error in the
+# threaded server
+UPSTREAM_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError, OSError)
+
+# Interval in seconds in which idle QAC WebSockets are pinged so that proxies
+# do not close them
+WEBSOCKET_HEARTBEAT = 30
+
+# Identical QAC requests in flight are merged into a single upstream request
+# and requests superseded by a newer request of the same client are dropped
+qac_flight = AsyncSingleFlight()
+qac_tracker = SupersessionTracker(event_factory=asyncio.Event)
+
+jinja_env = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.join(BASE_DIR, "templates")),
+    autoescape=jinja2.select_autoescape(["html"]))
+
+
+async def fetch(session, host, port, path, backend):
+    """Send a GET request to the given backend replica and return the
+    response body as bytes. Raises a ServerError if the replica answers with
+    a server error status. The connect and wait times are recorded in the
+    stage histogram.
+
+    Arguments:
+    session - the aiohttp client session
+    host - hostname of the backend
+    port - port of the backend
+    path - the request path including the query string
+    backend - name of the backend for the metrics, "aqqu" or "qac"
+    """
+    url = "http://%s:%d%s" % (host, port, path)
+    # Filled by the trace callbacks of the session, see create_app()
+    trace_ctx = dict()
+    start = time.monotonic()
+    async with session.get(url, trace_request_ctx=trace_ctx) as response:
+        body = await response.read()
+        status = response.status
+    connected = trace_ctx.get("connected", start)
+    stage_duration.observe(connected - start, stage=backend + "_connect")
+    stage_duration.observe(time.monotonic() - connected,
+                           stage=backend + "_wait")
+    if status >= 500:
+        raise ServerError("%s:%d answered with status %d"
+                          % (host, port, status))
+    return body
+
+
+async def request_backend(app, backend, path):
+    """Send a GET request to a replica of the given backend and return the
+    response body as bytes.
+
+    Arguments:
+    app - the aiohttp application
+    backend - name of the backend, "aqqu" or "qac"
+    path - the request path including the query string
+    """
+    client = getattr(aqqu_server, backend + "_backend")
+    send = functools.partial(fetch, app["session"], backend=backend)
+    try:
+        return await client.request(send, path)
+    except UPSTREAM_ERRORS:
+        upstream_errors.inc(backend=backend)
+        raise
+
+
+async def get_aqqu_result(app, question, qids):
+    """Get the result for the given question as returned by
+    process_aqqu_response(), see aqqu_server.get_aqqu_result(). Stale
+    cached results are refreshed in a background task.
+
+    Arguments:
+    app - the aiohttp application
+    question - the question string as entered by the user
+    qids - comma separated string of the qids in the question
+    """
+    answer_cache = aqqu_server.answer_cache
+    key = get_answer_cache_key(question, qids)
+    result, is_stale = answer_cache.get_stale(key)
+    if result is None:
+        result = await request_aqqu_result(app, question)
+        answer_cache.put(key, result, get_aqqu_result_size(result))
+    elif is_stale and answer_cache.begin_refresh(key):
+        task = asyncio.ensure_future(refresh_aqqu_result(app, question, key))
+        # Keep a reference to the task until it is done
+        app["background_tasks"].add(task)
+        task.add_done_callback(app["background_tasks"].discard)
+    return result
+
+
+async def request_aqqu_result(app, question):
+    """Send the given question to the Aqqu API and return the result as
+    returned by process_aqqu_response().
+
+    Arguments:
+    app - the aiohttp application
+    question - the question string as entered by the user
+    """
+    response = await request_backend(app, "aqqu", get_aqqu_path(question))
+    return process_aqqu_response(response)
+
+
+async def refresh_aqqu_result(app, question, key):
+    """Request the result for the given question from the Aqqu API and
+    update the stale answer cache entry with the given key.
+
+    Arguments:
+    app - the aiohttp application
+    question - the question string as entered by the user
+    key - the answer cache key of the question
+    """
+    answer_cache = aqqu_server.answer_cache
+    try:
+        result = await request_aqqu_result(app, question)
+        answer_cache.put(key, result, get_aqqu_result_size(result))
+    except Exception:
+        logger.exception("Refreshing cached answers for '%s' failed"
+                         % question)
+        answer_cache.end_refresh(key)
+
+
+async def request_qac_result(app, question_prefix):
+    """Send the given question prefix to the QAC API, add the wikified
+    completions to the response and cache the result.
+
+    Arguments:
+    app - the aiohttp application
+    question_prefix - the question prefix as entered by the user
+    """
+    async with aqqu_server.qac_admission.admit():
+        response = await request_backend(app, "qac",
+                                         get_qac_path(question_prefix))
+    result = process_qac_response(response)
+    aqqu_server.qac_cache.put(question_prefix, result, len(response))
+    return result
+
+
+def render_html(**context):
+    """Render the index page with the given template variables.
+    """
+    with stage_duration.time(stage="render"):
+        html = jinja_env.get_template("index.html").render(**context)
+    return web.Response(text=html, content_type="text/html")
+
+
+async def home(request):
+    question = request.query.get("q")
+    if question:
+        # Retrieve qids in the question
+        qids = request.query.get("qids")
+        # Retrieve Wikipedia urls of entities in the question
+        urls = get_question_urls(qids)
+
+        # Return the page right away. The client requests the answers from
+        # the /result route.
+        return render_html(question=question,
+                           qids=qids,
+                           urls=dump_json(urls))
+
+    return render_html()
+
+
+async def result(request):
+    """Get the interpretations and answers for the given question as json,
+    see aqqu_server.result().
+    """
+    question = request.query.get("q")
+    qids = request.query.get("qids", "")
+    if not question:
+        return web.Response(text=get_result_json(get_error_result(
+            "No question given")), status=400,
+            content_type="application/json")
+
+    # Forward question to Aqqu API unless the answers are cached
+    try:
+        aqqu_result = await get_aqqu_result(request.app, question, qids)
+    except UPSTREAM_ERRORS:
+        logger.error("Connection to Aqqu API could not be established")
+        response = web.Response(text=get_result_json(get_error_result(
+            "No connection to Aqqu API")), content_type="application/json")
+        response.headers["Cache-Control"] = "no-store"
+        return response
+
+    body = get_result_json(aqqu_result)
+    etag = hashlib.sha1(body.encode("utf8")).hexdigest()
+    if etag in {e.value for e in request.if_none_match or ()}:
+        response = web.Response(status=304)
+    else:
+        response = web.Response(text=body, content_type="application/json")
+    response.etag = etag
+    response.headers["Cache-Control"] = ("public, max-age=%d"
+                                         % aqqu_server.answer_cache.ttl)
+    return response
+
+
+def get_int_query(request, name, default):
+    """Get the integer query parameter with the given name or the default if
+    it is missing or not an integer, as request.args.get(name, default,
+    type=int) in Flask.
+
+    Arguments:
+    request - the aiohttp request
+    name - name of the query parameter
+    default - the default value
+    """
+    try:
+        return int(request.query.get(name, default))
+    except ValueError:
+        return default
+
+
+async def answers(request):
+    """Get a page of the answers of a candidate for the given question, see
+    aqqu_server.answers().
+    """
+    question = request.query.get("q")
+    qids = request.query.get("qids", "")
+    candidate = get_int_query(request, "candidate", 0)
+    start = get_int_query(request, "start", 0)
+    size = get_int_query(request, "size", aqqu_server.MAX_ANSWERS_PAGE_SIZE)
+
+    result = "[]"
+    if question:
+        try:
+            aqqu_result = await get_aqqu_result(request.app, question, qids)
+            result = get_answers_page(aqqu_result, candidate, start, size)
+        except UPSTREAM_ERRORS:
+            logger.error("Connection to Aqqu API could not be established")
+    return web.Response(text=result, content_type="application/json")
+
+
+async def qac(request):
+    """Get completion predictions for the current question prefix.
+    """
+    question_prefix = request.query.get("q")
+    timestamp = request.query.get("t")
+
+    # The rate limit applies per client address. Requests without client id
+    # are never superseded, see aqqu_server.qac().
+    client = get_client_address(request.remote,
+                                request.headers.get("X-Forwarded-For"))
+    if not aqqu_server.qac_rate_limiter.allow(client):
+        return get_qac_rejection("rate_limit", 429)
+    client_id = request.query.get("c")
+    if client_id:
+        superseded = qac_tracker.register(client_id, timestamp)
+    else:
+        superseded = asyncio.Event()
+
+    try:
+        result = await get_qac_completions(request.app, question_prefix,
+                                           timestamp, superseded)
+    except OverloadedError:
+        return get_qac_rejection("overload", 503)
+    return web.Response(text=dump_json(result), content_type="text/html")
+
+
+def get_qac_rejection(reason, status):
+    """Get the response for a rejected QAC request, see
+    aqqu_server.get_qac_rejection().
+    """
+    logger.info("Reject QAC request (%s)" % reason)
+    qac_rejected.inc(reason=reason)
+    return web.Response(text=dump_json([]), status=status,
+                        content_type="text/html",
+                        headers={"Retry-After":
+                                 str(aqqu_server.QAC_RETRY_AFTER)})
+
+
+async def qac_websocket(request):
+    """Send completion predictions over a WebSocket that stays open while
+    the user types. The client sends a message {"q": <prefix>, "t": <time
+    stamp>} for each new question prefix. Only the latest prefix of the
+    session is answered: a prefix received while the completions of an
+    earlier prefix are still being computed supersedes the earlier prefix.
+    Prefixes that are rejected by the rate limit or the admission control
+    are not answered. If getting the completions fails otherwise, the
+    answer is {"error": "internal", "timestamp": <time stamp>}, upon which
+    the client requests the completions via HTTP.
+    """
+    ws = web.WebSocketResponse(heartbeat=WEBSOCKET_HEARTBEAT)
+    await ws.prepare(request)
+    # The prefixes count towards the rate limit of the client address
+    client = get_client_address(request.remote,
+                                request.headers.get("X-Forwarded-For"))
+
+    # The latest (question prefix, time stamp) that is not answered yet and
+    # the event that supersedes the prefix currently being answered
+    latest = None
+    has_latest = asyncio.Event()
+    superseded = asyncio.Event()
+
+    async def send_completions():
+        nonlocal latest, superseded
+        while True:
+            await has_latest.wait()
+            has_latest.clear()
+            (question_prefix, timestamp), latest = latest, None
+            superseded = asyncio.Event()
+            if not aqqu_server.qac_rate_limiter.allow(client):
+                qac_rejected.inc(reason="rate_limit")
+                continue
+            try:
+                result = await get_qac_completions(
+                    request.app, question_prefix, timestamp, superseded)
+                text = dump_json(result) if result else None
+            except OverloadedError:
+                qac_rejected.inc(reason="overload")
+                continue
+            except Exception:
+                # Keep the session alive and let the client request the
+                # completions for this prefix via HTTP instead
+                logger.exception("Could not get completions for '%s'"
+                                 % question_prefix)
+                text = dump_json({"error": "internal",
+                                  "timestamp": timestamp})
+            if text and not ws.closed:
+                try:
+                    await ws.send_str(text)
+                except ConnectionResetError:
+                    return
+
+    sender = asyncio.ensure_future(send_completions())
+    try:
+        async for message in ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                continue
+            try:
+                data = load_json(message.data)
+                latest = (str(data["q"]), data.get("t"))
+            except (ValueError, TypeError, KeyError):
+                logger.warning("Ignore invalid QAC WebSocket message")
+                continue
+            superseded.set()
+            has_latest.set()
+    finally:
+        sender.cancel()
+    return ws
+
+
+async def get_qac_completions(app, question_prefix, timestamp, superseded):
+    """Get the wikified completions for the given question prefix with the
+    given time stamp added. Return an empty list if the request has been
+    superseded or the QAC API can not be reached and the local completion
+    index has no completions. Raises OverloadedError if the request is shed
+    by the admission control and the local index has no completions.
+
+    Arguments:
+    app - the aiohttp application
+    question_prefix - the question prefix as entered by the user
+    timestamp - the time stamp the client attached to the request
+    superseded - event that is set once the request is superseded
+    """
+    result = []
+    try:
+        cached = aqqu_server.qac_cache.get(question_prefix)
+        if cached is None and is_short_prefix(question_prefix):
+            cached = get_local_completions(question_prefix, "short_prefix")
+        if cached is None:
+            cached = await qac_flight.do(
+                question_prefix,
+                lambda: request_qac_result(app, question_prefix),
+                abandon=superseded)
+        result = dict(cached, timestamp=timestamp)
+    except SupersededError:
+        # The upstream request has been cancelled unless someone else is
+        # waiting for its result. The client discards the empty result.
+        logger.info("Drop superseded QAC request for '%s'" % question_prefix)
+    except OverloadedError:
+        cached = get_local_completions(question_prefix, "overload")
+        if cached is None:
+            raise
+        result = dict(cached, timestamp=timestamp)
+    except UPSTREAM_ERRORS:
+        logger.error("Connection to QAC API could not be established")
+        cached = get_local_completions(question_prefix, "error")
+        if cached is not None:
+            result = dict(cached, timestamp=timestamp)
+    return result
+
+
+async def tooltip(request):
+    """Get the Wikipedia information for the given entity.
+    """
+    qid = request.query.get("qid")
+    return web.Response(text=dump_json(get_tooltip_info(qid)),
+                        content_type="text/html")
+
+
+async def tooltips(request):
+    """Get the Wikipedia information for all given entities at once, see
+    aqqu_server.tooltips().
+    """
+    qids = get_tooltip_qids(request.query.get("qids", ""))
+    etag = get_tooltips_etag(qids)
+    if etag in {e.value for e in request.if_none_match or ()}:
+        response = web.Response(status=304)
+    else:
+        response = web.Response(text=dump_json(get_tooltips_info(qids)),
+                                content_type="application/json")
+    response.etag = etag
+    response.headers["Cache-Control"] = ("public, max-age=%d"
+                                         % aqqu_server.TOOLTIP_MAX_AGE)
+    return response
+
+
+async def metrics(request):
+    """Get the metrics of this process in the Prometheus text format.
+    """
+    return web.Response(body=metrics_registry.render().encode("utf8"),
+                        headers={"Content-Type": METRICS_CONTENT_TYPE})
+
+
+@web.middleware
+async def count_request(request, handler):
+    """Record the number and duration of requests per route and status.
+    """
+    start = time.monotonic()
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else "other"
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        request_count.inc(route=route, status=status)
+        request_duration.observe(time.monotonic() - start, route=route)
+
+
+async def on_connection_ready(session, trace_config_ctx, params):
+    """Remember when a backend request got its connection, see fetch().
+    """
+    if trace_config_ctx.trace_request_ctx is not None:
+        trace_config_ctx.trace_request_ctx["connected"] = time.monotonic()
+
+
+def create_app(pool_size=10, connect_timeout=2.0, read_timeout=30.0,
+               idle_timeout=60.0):
+    """Create the aiohttp application. The mappings in aqqu_server must be
+    loaded before the application serves requests.
+
+    Arguments:
+    pool_size - maximum number of keep-alive connections per backend
+    connect_timeout - timeout in seconds for connecting to a backend
+    read_timeout - timeout in seconds for a backend response
+    idle_timeout - close keep-alive connections idle for longer than this
+    """
+    async def client_session(app):
+        connector = aiohttp.TCPConnector(limit_per_host=pool_size,
+                                         keepalive_timeout=idle_timeout)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                        sock_read=read_timeout)
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_connection_ready)
+        trace_config.on_connection_reuseconn.append(on_connection_ready)
+        app["session"] = aiohttp.ClientSession(connector=connector,
+                                               timeout=timeout,
+                                               trace_configs=[trace_config])
+        yield
+        await app["session"].close()
+
+    app = web.Application(middlewares=[count_request])
+    app["background_tasks"] = set()
+    app.cleanup_ctx.append(client_session)
+    app.router.add_get("/", home)
+    app.router.add_get("/result", result)
+    app.router.add_get("/answers", answers)
+    app.router.add_get("/qac", qac)
+    app.router.add_get("/qac/ws", qac_websocket)
+    app.router.add_get("/tooltip", tooltip)
+    app.router.add_get("/tooltips", tooltips)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_static("/static", os.path.join(BASE_DIR, "static"))
+    return app
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    args = aqqu_server.get_argument_parser().parse_args()
+    data_path = args.data.rstrip("/") + "/"
+
+    # Load data
+    aqqu_server.load_mappings(data_path, args.mmap, args.snapshot,
+                              args.load_processes, args.compress_abstracts)
+    aqqu_server.create_caches(args)
+    aqqu_server.create_qac_limits(args, AsyncAdmissionController)
+    aqqu_server.load_qac_fallback(args)
+    aqqu_server.top_candidates = args.top_candidates
+    aqqu_server.top_answers = args.top_answers
+    aqqu_server.aqqu_backend = AsyncBackend(
+        "aqqu", parse_addresses(args.aqqu),
+        **aqqu_server.get_backend_options(args, "aqqu"))
+    aqqu_server.qac_backend = AsyncBackend(
+        "qac", parse_addresses(args.qac),
+        **aqqu_server.get_backend_options(args, "qac"))
+
+    app = create_app(pool_size=args.pool_size,
+                     connect_timeout=args.connect_timeout,
+                     read_timeout=args.read_timeout,
+                     idle_timeout=args.idle_timeout)
+    if args.workers > 1:
+        # Share the loaded mappings with forked worker processes. On
+        # SIGUSR1, the master reloads the mappings and restarts the workers.
+        # The metrics of each worker are labeled with its number
+        def serve_worker(socks, worker):
+            metrics_registry.set_constant_labels(worker=worker)
+            web.run_app(app, sock=socks)
+
+        sock = create_listening_socket("::", args.port)
+        PreforkServer(sock, args.workers, serve_worker,
+                      reload_data=lambda: aqqu_server.load_mappings(
+                          data_path, args.mmap, args.snapshot,
+                          args.load_processes, args.compress_abstracts),
+                      worker_socks=aqqu_server.create_worker_sockets(
+                          args)).run()
+    else:
+        # Reload the mappings on SIGUSR1
+        async def handle_reload_signal(app):
+            asyncio.get_event_loop().add_signal_handler(
+                signal.SIGUSR1, aqqu_server.reload_mappings, data_path,
+                args.mmap, args.snapshot, args.load_processes,
+                args.compress_abstracts)
+
+        app.on_startup.append(handle_reload_signal)
+        # A socket bound by run_app(host="::") does not accept IPv4
+        # connections
+        web.run_app(app, sock=create_listening_socket("::", args.port))
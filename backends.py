@@ -0,0 +1,399 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import time
+import random
+import socket
+import asyncio
+import logging
+import threading
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+
+class NoReplicaError(ConnectionError):
+    """Raised when no replica of a backend accepts requests because the
+    circuits of all replicas are open.
+    """
+    pass
+
+
+def parse_addresses(addresses):
+    """Split the given comma separated "host:port" addresses into a list of
+    (host, port) tuples.
+
+    Arguments:
+    addresses - the addresses, e.g. "host1:8300,host2:8300"
+    """
+    result = []
+    for address in addresses.split(","):
+        host, _, port = address.strip().rpartition(":")
+        result.append((host.strip("[]"), int(port)))
+    return result
+
+
+class CircuitBreaker:
+    """Circuit breaker of a single replica. After failure_threshold
+    consecutive failed requests the circuit opens and the replica gets no
+    requests for reset_timeout seconds. Then a single trial request is let
+    through, which closes the circuit again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0):
+        """Create a new closed circuit breaker.
+
+        Arguments:
+        failure_threshold - number of consecutive failures that open the
+                            circuit
+        reset_timeout - time in seconds after which an open circuit lets a
+                        trial request through
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        """Return whether a request may be sent to the replica. For an open
+        circuit, only one trial request is allowed after the reset timeout.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            elapsed = time.monotonic() - self._opened_at
+            if self._trial or elapsed < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        """Count a failed request. Opens the circuit after too many
+        consecutive failures or if the trial request failed.
+        """
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+    def cancel_trial(self):
+        """Allow another trial request if the trial request was cancelled
+        before it completed.
+        """
+        with self._lock:
+            self._trial = False
+
+
+class Replica:
+    """One replica of a backend with its circuit breaker and the number of
+    requests currently in flight.
+    """
+
+    def __init__(self, host, port, breaker, pool=None):
+        self.host = host
+        self.port = port
+        self.breaker = breaker
+        self.pool = pool
+        self.outstanding = 0
+        self.failures = 0
+
+    @property
+    def address(self):
+        return "%s:%d" % (self.host, self.port)
+
+
+class ReplicaSet:
+    """Base class of the backend clients. Chooses the replica with the
+    fewest outstanding requests among the replicas whose circuit is closed.
+    """
+
+    def __init__(self, name, addresses, deadline=30.0, hedge_delay=None,
+                 failure_threshold=5, reset_timeout=10.0, create_pool=None):
+        """Create a new set of replicas.
+
+        Arguments:
+        name - name of the backend for log messages, e.g. "aqqu"
+        addresses - list of (host, port) tuples of the replicas
+        deadline - maximum time in seconds for a request including retries
+                   and hedged requests
+        hedge_delay - time in seconds after which a request that has not
+                      been answered yet is also sent to a second replica,
+                      None to never send hedged requests
+        failure_threshold - number of consecutive failures after which a
+                            replica gets no requests for a while
+        reset_timeout - time in seconds for which a failing replica gets no
+                        requests
+        create_pool - function that creates the connection pool of a
+                      replica from its host and port, if any
+        """
+        self.name = name
+        self.deadline = deadline
+        self.hedge_delay = hedge_delay
+        self.replicas = []
+        for host, port in addresses:
+            pool = create_pool(host, port) if create_pool else None
+            breaker = CircuitBreaker(failure_threshold, reset_timeout)
+            self.replicas.append(Replica(host, port, breaker, pool))
+        # Number of second attempts per reason, "hedge" or "failover"
+        self.retries = {"hedge": 0, "failover": 0}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """Return the number of outstanding requests, the number of failed
+        requests and whether the circuit is open as dictionary per replica
+        address. Includes the connection pool stats if there are pools.
+        """
+        stats = dict()
+        for replica in self.replicas:
+            stats[replica.address] = {
+                "outstanding": replica.outstanding,
+                "failures": replica.failures,
+                "circuit_open": int(replica.breaker.is_open)}
+            if replica.pool is not None:
+                stats[replica.address].update(replica.pool.stats())
+        return stats
+
+    def _acquire(self, exclude=()):
+        """Choose the replica with the fewest outstanding requests, except
+        for the excluded replicas, whose circuit allows a request and count
+        the request as outstanding. Return None if there is no such replica.
+        """
+        with self._lock:
+            replicas = [r for r in self.replicas if r not in exclude]
+            # Break ties randomly to spread the load evenly
+            random.shuffle(replicas)
+            replicas.sort(key=lambda r: r.outstanding)
+            for replica in replicas:
+                if replica.breaker.allow():
+                    replica.outstanding += 1
+                    return replica
+        return None
+
+    def _release(self, replica, success):
+        """Count the request to the given replica as done and update the
+        circuit breaker of the replica. For success None, the request was
+        cancelled and does not count as success or failure.
+        """
+        with self._lock:
+            replica.outstanding -= 1
+            if success is False:
+                replica.failures += 1
+        if success:
+            replica.breaker.record_success()
+        elif success is False:
+            replica.breaker.record_failure()
+            if replica.breaker.is_open:
+                logger.warning("Circuit of %s replica %s is open"
+                               % (self.name, replica.address))
+        else:
+            replica.breaker.cancel_trial()
+
+    def _acquire_first(self):
+        replica = self._acquire()
+        if replica is None:
+            raise NoReplicaError("No %s replica available" % self.name)
+        return replica
+
+    def _acquire_other(self, tried, reason):
+        """Choose a replica that has not been tried yet for another attempt of
+        a request and return it or None if there is none.
+
+        Arguments:
+        tried - the replicas the request has already been sent to
+        reason - "hedge" if the attempts so far are slow, "failover" if an
+                 attempt failed
+        """
+        replica = self._acquire(exclude=tried)
+        if replica is not None:
+            logger.info("Send %s request to %s replica %s"
+                        % (reason, self.name, replica.address))
+            with self._lock:
+                self.retries[reason] += 1
+            tried.add(replica)
+        return replica
+
+
+class Backend(ReplicaSet):
+    """Client for a backend with several replicas for the threaded server.
+    Each replica has its own pool of keep-alive connections.
+
+    A request is sent to the replica with the fewest outstanding requests.
+    Whenever an attempt fails, the request is sent to a replica that has
+    not been tried yet. If hedge_delay is set and there is no response after
+    hedge_delay seconds, the request is also sent to another replica and
+    the first response is used. The caller waits at most deadline seconds.
+    """
+
+    def __init__(self, name, addresses, create_pool, **kwargs):
+        """Create a new backend client. See ReplicaSet for the arguments.
+        """
+        super().__init__(name, addresses, create_pool=create_pool, **kwargs)
+        # The attempts run in the executor, so that the caller can give up
+        # after the deadline and wait for several attempts at once
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2 * sum(r.pool.size for r in self.replicas),
+            thread_name_prefix=name)
+
+    def request(self, path):
+        """Send a GET request for the given path and return the response body
+        as bytes. Raises an OSError (i.e. socket.error) if no replica
+        answers within the deadline.
+
+        Arguments:
+        path - the request path including the query string
+        """
+        start = time.monotonic()
+        deadline = start + self.deadline
+        hedge_time = None
+        if self.hedge_delay is not None:
+            hedge_time = start + self.hedge_delay
+        first = self._acquire_first()
+        tried = {first}
+        attempts = {self._submit(first, path, deadline)}
+        error = None
+        while attempts:
+            wait_until = deadline
+            if hedge_time is not None:
+                wait_until = min(deadline, hedge_time)
+            done, attempts = concurrent.futures.wait(
+                attempts, timeout=max(0, wait_until - time.monotonic()),
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except OSError as e:
+                    error = e
+
+            now = time.monotonic()
+            if now >= deadline:
+                raise socket.timeout("No response from %s within %.1fs"
+                                     % (self.name, self.deadline))
+            if done:
+                reason = "failover"
+            elif hedge_time is not None and now >= hedge_time:
+                reason = "hedge"
+                hedge_time = None
+            else:
+                continue
+            replica = self._acquire_other(tried, reason)
+            if replica is not None:
+                attempts.add(self._submit(replica, path, deadline))
+        raise error
+
+    def _submit(self, replica, path, deadline):
+        """Send the request to the given replica in the executor and return
+        the future of the response body.
+        """
+        def attempt():
+            success = False
+            try:
+                timeout = max(0.001, deadline - time.monotonic())
+                body = replica.pool.request("GET", path, timeout=timeout)
+                success = True
+                return body
+            finally:
+                self._release(replica, success)
+
+        return self._executor.submit(attempt)
+
+
+class AsyncBackend(ReplicaSet):
+    """Client for a backend with several replicas for the asyncio server,
+    see Backend. The requests are sent by a given coroutine function, e.g.
+    over an aiohttp client session. Attempts that are no longer needed are
+    cancelled.
+    """
+
+    async def request(self, send, path):
+        """Send a GET request for the given path and return the response body
+        as bytes. Raises an OSError or asyncio.TimeoutError if no replica
+        answers within the deadline.
+
+        Arguments:
+        send - coroutine function that is called as send(host, port, path)
+               and returns the response body of a replica
+        path - the request path including the query string
+        """
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        deadline = start + self.deadline
+        hedge_time = None
+        if self.hedge_delay is not None:
+            hedge_time = start + self.hedge_delay
+        first = self._acquire_first()
+        tried = {first}
+        attempts = {self._start(send, first, path, deadline)}
+        error = None
+        try:
+            while attempts:
+                # Each attempt ends by the deadline, so only wait for the time
+                # of the hedged request
+                timeout = None
+                if hedge_time is not None:
+                    timeout = max(0, hedge_time - loop.time())
+                done, attempts = await asyncio.wait(
+                    attempts, timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED)
+                # Retrieve the exceptions of all finished attempts
+                errors = [task.exception() for task in done]
+                for task, task_error in zip(done, errors):
+                    if task_error is None:
+                        return task.result()
+                    error = task_error
+
+                if loop.time() >= deadline:
+                    hedge_time = None
+                    continue
+                if done:
+                    reason = "failover"
+                elif hedge_time is not None and loop.time() >= hedge_time:
+                    reason = "hedge"
+                    hedge_time = None
+                else:
+                    continue
+                replica = self._acquire_other(tried, reason)
+                if replica is not None:
+                    attempts.add(self._start(send, replica, path, deadline))
+            raise error
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    def _start(self, send, replica, path, deadline):
+        """Start sending the request to the given replica in a task and
+        return the task.
+        """
+        return asyncio.ensure_future(self._attempt(send, replica, path,
+                                                   deadline))
+
+    async def _attempt(self, send, replica, path, deadline):
+        """Send the request to the given replica and return the response
+        body. Raises asyncio.TimeoutError if there is no response by the
+        deadline.
+        """
+        success = False
+        try:
+            timeout = deadline - asyncio.get_event_loop().time()
+            body = await asyncio.wait_for(
+                send(replica.host, replica.port, path), timeout)
+            success = True
+            return body
+        except asyncio.CancelledError:
+            success = None
+            raise
+        finally:
+            self._release(replica, success)
@@ -0,0 +1,180 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import os
+import random
+import argparse
+
+# Characters of a Freebase MID after the "m." prefix
+MID_ALPHABET = "0123456789bcdfghjklmnpqrstvwxyz"
+
+# Words from which titles and abstracts are built
+WORDS = ("river", "city", "album", "film", "band", "island", "league",
+         "novel", "station", "church", "mountain", "county", "school",
+         "football", "player", "american", "german", "song", "district",
+         "national", "party", "university", "railway", "village", "museum",
+         "history", "series", "castle", "lake", "war", "battle", "king",
+         "season", "award", "company", "language", "airport", "bridge",
+         "the", "of", "and", "in", "is", "a", "was", "by", "from", "with")
+
+# Suffixes that make some titles look like disambiguated Wikipedia titles
+TITLE_SUFFIXES = ("", "", "", " (film)", " (album)", " (band)", " (novel)")
+
+# Question templates of the popular questions, %s is an entity mention
+QUESTION_TEMPLATES = ("who directed [%s] ", "where was [%s] born ",
+                      "what is the capital of [%s] ", "who wrote [%s] ",
+                      "which band released [%s] ", "who is married to [%s] ",
+                      "in which country is [%s] ", "who won [%s] ",
+                      "what language is spoken in [%s] ",
+                      "when was [%s] founded ")
+
+
+def get_mid(i):
+    """Get the synthetic Freebase MID with the given number, e.g. "m.01".
+
+    Arguments:
+    i - the number of the MID
+    """
+    digits = ""
+    while True:
+        i, rest = divmod(i, len(MID_ALPHABET))
+        digits = MID_ALPHABET[rest] + digits
+        if i == 0:
+            return "m.0" + digits
+
+
+def get_qid(i):
+    """Get the synthetic Wikidata QID of the entity with the given number.
+
+    Arguments:
+    i - the number of the entity
+    """
+    return "Q%d" % (i + 1)
+
+
+def get_title(rand, i):
+    """Get a random Wikipedia title for the entity with the given number.
+    The number makes titles unique.
+
+    Arguments:
+    rand - the random number generator
+    i - the number of the entity
+    """
+    words = [rand.choice(WORDS).capitalize()
+             for _ in range(rand.randint(1, 3))]
+    return "%s %d%s" % (" ".join(words), i, rand.choice(TITLE_SUFFIXES))
+
+
+def get_abstract(rand, title, num_words):
+    """Get a random abstract for the entity with the given title.
+
+    Arguments:
+    rand - the random number generator
+    title - the Wikipedia title of the entity
+    num_words - the average number of words of the abstract
+    """
+    length = rand.randint(num_words // 2, num_words * 3 // 2)
+    words = " ".join(rand.choice(WORDS) for _ in range(length))
+    return "%s is a %s." % (title, words)
+
+
+def write_wikipedia_mapping(output_file, rand, num_entities, abstract_words,
+                            image_ratio):
+    """Write a synthetic QID to Wikipedia info mapping in the format of
+    qid_to_wikipedia_info.tsv.
+
+    Arguments:
+    output_file - path to the output file
+    rand - the random number generator
+    num_entities - number of entities
+    abstract_words - the average number of words per abstract
+    image_ratio - the fraction of entities with an image
+    """
+    with open(output_file, "w", encoding="utf8") as file:
+        for i in range(num_entities):
+            title = get_title(rand, i)
+            image = ""
+            if rand.random() < image_ratio:
+                image = ("https://upload.wikimedia.org/wikipedia/commons/"
+                         "%x/%s.jpg" % (i % 16, title.replace(" ", "_")))
+            abstract = get_abstract(rand, title, abstract_words)
+            file.write("%s\t%s\t%s\t%s\n" % (get_qid(i), title, image,
+                                            abstract))
+
+
+def write_mid_to_qid_mapping(output_file, num_entities, num_mids):
+    """Write a synthetic MID to QID mapping in the format of
+    mid_to_qid15_combined.tsv. The first num_entities MIDs map to different
+    entities, further MIDs map to already used entities.
+
+    Arguments:
+    output_file - path to the output file
+    num_entities - number of entities
+    num_mids - number of MIDs
+    """
+    with open(output_file, "w", encoding="utf8") as file:
+        for i in range(num_mids):
+            file.write("%s\t%s\n" % (get_mid(i), get_qid(i % num_entities)))
+
+
+def write_popular_questions(output_file, rand, num_entities, num_questions):
+    """Write a synthetic popular questions file for the --qac-fallback
+    option of the server. Question frequencies follow a power law.
+
+    Arguments:
+    output_file - path to the output file
+    rand - the random number generator
+    num_entities - number of entities
+    num_questions - number of questions
+    """
+    with open(output_file, "w", encoding="utf8") as file:
+        for i in range(num_questions):
+            entity = rand.randrange(num_entities)
+            name = "%s %d" % (rand.choice(WORDS).capitalize(), entity)
+            question = rand.choice(QUESTION_TEMPLATES) % name
+            frequency = int(1000000 / (i + 1))
+            file.write("%s\t%s\t%d\n" % (question, get_qid(entity),
+                                          frequency))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic mapping files for benchmarking the"
+                    " server.")
+    parser.add_argument("output",
+                        help="Directory in which to write"
+                             " qid_to_wikipedia_info.tsv and"
+                             " mid_to_qid15_combined.tsv")
+    parser.add_argument("-n", "--entities", type=int, default=1000000,
+                        help="Number of entities with Wikipedia info")
+    parser.add_argument("-m", "--mids", type=int, default=0,
+                        help="Number of MIDs, at least the number of"
+                             " entities. Default: twice the number of"
+                             " entities.")
+    parser.add_argument("--abstract-words", type=int, default=60,
+                        help="Average number of words per abstract")
+    parser.add_argument("--image-ratio", type=float, default=0.4,
+                        help="Fraction of entities with an image")
+    parser.add_argument("-q", "--questions", type=int, default=0,
+                        help="Also write this many popular questions to"
+                             " popular_questions.tsv")
+    parser.add_argument("--seed", type=int, default=42,
+                        help="Seed of the random number generator")
+    args = parser.parse_args()
+
+    num_mids = max(args.mids or 2 * args.entities, args.entities)
+    os.makedirs(args.output, exist_ok=True)
+    write_wikipedia_mapping(
+        os.path.join(args.output, "qid_to_wikipedia_info.tsv"),
+        random.Random(args.seed), args.entities, args.abstract_words,
+        args.image_ratio)
+    write_mid_to_qid_mapping(
+        os.path.join(args.output, "mid_to_qid15_combined.tsv"),
+        args.entities, num_mids)
+    if args.questions:
+        write_popular_questions(
+            os.path.join(args.output, "popular_questions.tsv"),
+            random.Random(args.seed), args.entities, args.questions)
+    print("Wrote %d entities and %d MIDs to %s"
+          % (args.entities, num_mids, args.output))
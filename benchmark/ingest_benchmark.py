@@ -0,0 +1,110 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+from urllib import parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+import aqqu_server  # noqa: E402
+import get_wiki_info_mapping  # noqa: E402
+
+
+def write_raw_mappings(wiki_info_file, output_dir):
+    """Write a qid-to-title and a qid-to-abstract file in the format of the
+    SPARQL query results for the entries of the given Wikipedia info file.
+    Return the paths of the two files.
+
+    Arguments:
+    wiki_info_file - path to a qid_to_wikipedia_info.tsv file
+    output_dir - directory to which to write the files
+    """
+    title_file = os.path.join(output_dir, "qid_to_title.tsv")
+    abstract_file = os.path.join(output_dir, "qid_to_abstract.tsv")
+    with open(wiki_info_file, "r", encoding="utf8") as file, \
+            open(title_file, "w", encoding="utf8") as titles, \
+            open(abstract_file, "w", encoding="utf8") as abstracts:
+        for line in file:
+            qid, title, _, abstract = line.rstrip("\n").split("\t")
+            qid_url = "<http://www.wikidata.org/entity/%s>" % qid
+            title = parse.quote(title.replace(" ", "_"))
+            titles.write("%s\t<https://en.wikipedia.org/wiki/%s>\n"
+                         % (qid_url, title))
+            abstract = abstract.replace(" ", " @ ", 3).replace('"', '\\"')
+            abstracts.write('%s\t"@ %s @"@en\n' % (qid_url, abstract))
+    return title_file, abstract_file
+
+
+def count_lines(input_file):
+    with open(input_file, "rb") as file:
+        return sum(1 for _ in file)
+
+
+def run(name, input_file, parse, processes_list):
+    """Parse the given file with each number of processes and print the
+    throughput. Checks that the results do not depend on the number of
+    processes.
+
+    Arguments:
+    name - name of the parser in the report
+    input_file - path to the file
+    parse - function that is called as parse(input_file, processes) and
+            returns the parsed mapping
+    processes_list - the numbers of processes
+    """
+    num_lines = count_lines(input_file)
+    expected = None
+    base_time = None
+    for processes in processes_list:
+        start = time.perf_counter()
+        result = parse(input_file, processes)
+        seconds = time.perf_counter() - start
+        if expected is None:
+            expected = result
+            base_time = seconds
+        elif result != expected:
+            print("%s: result with %d processes differs" % (name, processes))
+        print("%-18s %9d %10d %8.2f %12.0f %7.2f"
+              % (name, processes, num_lines, seconds, num_lines / seconds,
+                 base_time / seconds))
+        del result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure how many lines per second the mapping parsers"
+                    " of the server and of get_wiki_info_mapping.py read"
+                    " with an increasing number of processes.")
+    parser.add_argument("data",
+                        help="Directory with the mappings written by"
+                             " generate_mappings.py")
+    parser.add_argument("-p", "--processes", default="1,2,4,8",
+                        help="Comma separated numbers of processes")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    processes_list = [int(p) for p in args.processes.split(",")]
+    wiki_info_file = os.path.join(args.data, "qid_to_wikipedia_info.tsv")
+    mid_to_qid_file = os.path.join(args.data, "mid_to_qid15_combined.tsv")
+
+    print("%-18s %9s %10s %8s %12s %7s" % ("parser", "processes", "lines",
+                                           "seconds", "lines/s", "speedup"))
+    run("server wiki info", wiki_info_file,
+        aqqu_server.get_wikipedia_mapping, processes_list)
+    run("server mid to qid", mid_to_qid_file,
+        lambda file, processes: aqqu_server.get_mid_to_qid_mapping(
+            file, processes).__getstate__(), processes_list)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        title_file, abstract_file = write_raw_mappings(wiki_info_file,
+                                                       tmp_dir)
+        run("builder titles", title_file,
+            get_wiki_info_mapping.get_qid_to_wikititle_dict, processes_list)
+        run("builder abstracts", abstract_file,
+            get_wiki_info_mapping.get_qid_to_abstract_dict, processes_list)
@@ -0,0 +1,223 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+from urllib.parse import urlparse, urlencode
+
+# Questions that are typed if no question file is given
+DEFAULT_QUESTIONS = (
+    "who directed the film",
+    "where was the president born",
+    "what is the capital of",
+    "who wrote the novel",
+    "which band released the album",
+    "who is married to",
+    "in which country is the city",
+    "which team does the player play for",
+    "what language is spoken in",
+    "who won the award",
+)
+
+# Request types in the order in which they are reported
+REQUEST_TYPES = ("qac", "tooltips", "page", "result")
+
+
+class Statistics:
+    """Latencies and errors of the requests per request type.
+    """
+
+    def __init__(self):
+        self.latencies = {request_type: [] for request_type in REQUEST_TYPES}
+        self.errors = {request_type: 0 for request_type in REQUEST_TYPES}
+        self._lock = threading.Lock()
+
+    def add(self, request_type, latency, error):
+        """Add the latency in seconds of a request of the given type.
+        """
+        with self._lock:
+            self.latencies[request_type].append(latency)
+            if error:
+                self.errors[request_type] += 1
+
+
+def get_percentile(sorted_values, percentile):
+    """Get the given percentile of the given sorted values.
+
+    Arguments:
+    sorted_values - the values in ascending order
+    percentile - the percentile between 0 and 100
+    """
+    if not sorted_values:
+        return 0.0
+    i = int(round(percentile / 100 * (len(sorted_values) - 1)))
+    return sorted_values[i]
+
+
+class VirtualUser:
+    """A user that types questions into the frontend, one request to /qac per
+    keystroke, fetches the tooltips of the completions and then submits the
+    question like the browser does. Uses one keep-alive connection.
+    """
+
+    def __init__(self, user_id, url, questions, stats, typing_delay,
+                 think_time):
+        """Create a new virtual user.
+
+        Arguments:
+        user_id - number of the user, used as client id for /qac
+        url - base url of the server
+        questions - the questions to type
+        stats - the Statistics to add the request latencies to
+        typing_delay - time in seconds between two keystrokes
+        think_time - time in seconds between two questions
+        """
+        parsed_url = urlparse(url)
+        self.host = parsed_url.hostname
+        self.port = parsed_url.port or 80
+        self.base_path = parsed_url.path.rstrip("/") + "/"
+        self.client_id = "load-test-%d" % user_id
+        self.questions = questions
+        self.stats = stats
+        self.typing_delay = typing_delay
+        self.think_time = think_time
+        self.random = random.Random(user_id)
+        self.connection = None
+        self.known_qids = set()
+
+    def request(self, request_type, path, params):
+        """Send a GET request to the server, record its latency and return the
+        response body or None if the request failed.
+        """
+        path = self.base_path + path + "?" + urlencode(params)
+        start = time.monotonic()
+        body = None
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=60)
+            self.connection.request("GET", path)
+            response = self.connection.getresponse()
+            body = response.read()
+            if response.status not in (200, 304):
+                body = None
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+        self.stats.add(request_type, time.monotonic() - start, body is None)
+        return body
+
+    def type_question(self, question):
+        """Type the given question and return the last completion result.
+        """
+        completions = []
+        for i in range(1, len(question) + 1):
+            body = self.request("qac", "qac", {"q": question[:i],
+                                               "t": time.time(),
+                                               "c": self.client_id})
+            if body:
+                result = json.loads(body)
+                if result:
+                    completions = result["results"]
+                    self.fetch_tooltips(completions)
+            time.sleep(self.typing_delay)
+        return completions
+
+    def fetch_tooltips(self, completions):
+        """Fetch the tooltips of the QIDs of the given completions that were
+        not fetched before.
+        """
+        qids = [qid for completion in completions
+                for qid in completion["qids"] if qid not in self.known_qids]
+        if qids:
+            self.known_qids.update(qids)
+            self.request("tooltips", "tooltips", {"qids": ",".join(qids)})
+
+    def submit_question(self, completions, question):
+        """Submit the first completion or, if there is none, the question.
+        """
+        qids = ""
+        if completions:
+            question = completions[0]["completion"].strip()
+            qids = ",".join(completions[0]["qids"])
+        params = {"q": question, "qids": qids}
+        self.request("page", "", params)
+        self.request("result", "result", params)
+
+    def run(self, end_time):
+        """Type and submit questions until the given time.
+        """
+        while time.monotonic() < end_time:
+            question = self.random.choice(self.questions)
+            completions = self.type_question(question)
+            self.submit_question(completions, question)
+            time.sleep(self.think_time)
+
+
+def print_report(stats, duration):
+    """Print the throughput and latency percentiles per request type.
+    """
+    print("%-10s %8s %7s %9s %9s %9s %9s"
+          % ("type", "requests", "errors", "req/s", "p50 ms", "p95 ms",
+             "p99 ms"))
+    all_latencies = []
+    for request_type in REQUEST_TYPES + ("all",):
+        if request_type == "all":
+            latencies = sorted(all_latencies)
+            errors = sum(stats.errors.values())
+        else:
+            latencies = sorted(stats.latencies[request_type])
+            errors = stats.errors[request_type]
+            all_latencies.extend(latencies)
+        print("%-10s %8d %7d %9.1f %9.1f %9.1f %9.1f"
+              % (request_type, len(latencies), errors,
+                 len(latencies) / duration,
+                 get_percentile(latencies, 50) * 1000,
+                 get_percentile(latencies, 95) * 1000,
+                 get_percentile(latencies, 99) * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Simulate users that type and submit questions and"
+                    " report the throughput and latency of the server.")
+    parser.add_argument("url", nargs="?", default="http://localhost:8080/",
+                        help="Base url of the server")
+    parser.add_argument("-u", "--users", type=int, default=10,
+                        help="Number of concurrent users")
+    parser.add_argument("-t", "--duration", type=float, default=60,
+                        help="Duration of the test in seconds")
+    parser.add_argument("-q", "--questions",
+                        help="File with one question per line to type."
+                             " Default: a few built-in questions.")
+    parser.add_argument("--typing-delay", type=float, default=0.1,
+                        help="Time in seconds between two keystrokes")
+    parser.add_argument("--think-time", type=float, default=1.0,
+                        help="Time in seconds between two questions of a"
+                             " user")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, "r", encoding="utf8") as file:
+            questions = [line.strip() for line in file if line.strip()]
+
+    stats = Statistics()
+    start = time.monotonic()
+    end_time = start + args.duration
+    threads = []
+    for user_id in range(args.users):
+        user = VirtualUser(user_id, args.url, questions, stats,
+                           args.typing_delay, args.think_time)
+        thread = threading.Thread(target=user.run, args=(end_time,),
+                                  daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    print_report(stats, time.monotonic() - start)
@@ -0,0 +1,186 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from generate_mappings import WORDS, get_mid, get_qid
+
+# Freebase relations from which the relation matches are chosen
+RELATIONS = ("film.film.directed_by", "film.performance.actor",
+             "people.person.place_of_birth", "people.person.spouse_s",
+             "location.location.containedby", "music.album.artist",
+             "sports.sports_team.roster", "book.written_work.author",
+             "government.government_position_held.office_holder")
+
+
+def get_latency(latency, jitter):
+    """Get a random latency in seconds that deviates at most by the given
+    fraction from the given average latency.
+
+    Arguments:
+    latency - the average latency in seconds
+    jitter - the maximum deviation as fraction of the latency
+    """
+    return max(0.0, latency * (1 + jitter * random.uniform(-1, 1)))
+
+
+def get_random(query):
+    """Get a random number generator that is seeded with the given query,
+    such that the same query always gets the same result.
+
+    Arguments:
+    query - the query string
+    """
+    return random.Random(zlib.crc32(query.encode("utf8")))
+
+
+def get_entity(rand, num_mids):
+    """Get the MID and name of a random entity.
+
+    Arguments:
+    rand - the random number generator
+    num_mids - number of MIDs in the generated mappings
+    """
+    i = rand.randrange(num_mids)
+    return get_mid(i), "%s %d" % (rand.choice(WORDS).capitalize(), i)
+
+
+def get_aqqu_result(question, args):
+    """Get a synthetic result of the Aqqu API for the given question.
+
+    Arguments:
+    question - the question
+    args - the parsed command line arguments
+    """
+    rand = get_random(question)
+    identified_entities = []
+    candidates = []
+    for _ in range(rand.randint(1, args.candidates)):
+        entity_matches = []
+        for _ in range(rand.randint(1, 2)):
+            mid, name = get_entity(rand, args.mids)
+            entity_matches.append({"mid": mid})
+            identified_entities.append({"entity": {"mid": mid,
+                                                   "name": name}})
+        relation_matches = [{"relations": rand.sample(RELATIONS,
+                                                      rand.randint(1, 2))}]
+        # Most candidates have few answers, some have very many
+        num_answers = min(int(rand.paretovariate(1.2)), args.answers)
+        answers = []
+        for _ in range(num_answers):
+            mid, name = get_entity(rand, args.mids)
+            answers.append({"name": name, "mid": mid})
+        candidates.append({"entity_matches": entity_matches,
+                           "relation_matches": relation_matches,
+                           "answers": answers})
+    return {"candidates": candidates,
+            "parsed_query": {"identified_entities": identified_entities}}
+
+
+def get_qac_result(prefix, args):
+    """Get a synthetic result of the QAC API for the given question prefix.
+    Each completion ends with an entity mention in square brackets.
+
+    Arguments:
+    prefix - the question prefix
+    args - the parsed command line arguments
+    """
+    rand = get_random(prefix)
+    results = []
+    for _ in range(args.completions):
+        i = rand.randrange(args.mids)
+        alias = "%s %d" % (rand.choice(WORDS).capitalize(), i)
+        completion = "%s [%s] " % (prefix.rstrip(), alias)
+        results.append({"completion": completion,
+                        "qids": [get_qid(i % args.entities).lower()],
+                        "matched_alias": alias})
+    return {"results": results}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answer GET requests like /?q=<query> with the result of the server's
+    get_result function after the server's latency.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query).get("q", [""])[0]
+        time.sleep(get_latency(self.server.latency, self.server.jitter))
+        body = json.dumps(self.server.get_result(query)).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(port, get_result, latency, jitter):
+    """Start a stub server on the given port in a background thread and
+    return it.
+
+    Arguments:
+    port - the port to listen on
+    get_result - function that returns the result object for a query
+    latency - the average latency in seconds
+    jitter - the maximum deviation of the latency as fraction of it
+    """
+    server = ThreadingHTTPServer(("", port), StubHandler)
+    server.daemon_threads = True
+    server.get_result = get_result
+    server.latency = latency
+    server.jitter = jitter
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run stub servers for the Aqqu and the QAC API that"
+                    " return synthetic results for the mappings of"
+                    " generate_mappings.py.")
+    parser.add_argument("--aqqu-port", type=int, default=8300,
+                        help="Port of the stub Aqqu API")
+    parser.add_argument("--qac-port", type=int, default=8181,
+                        help="Port of the stub QAC API")
+    parser.add_argument("--aqqu-latency", type=float, default=0.5,
+                        help="Average latency of the Aqqu API in seconds")
+    parser.add_argument("--qac-latency", type=float, default=0.05,
+                        help="Average latency of the QAC API in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5,
+                        help="Maximum deviation of the latency as fraction"
+                             " of the average latency")
+    parser.add_argument("-n", "--entities", type=int, default=1000000,
+                        help="Number of entities of the generated mappings")
+    parser.add_argument("-m", "--mids", type=int, default=0,
+                        help="Number of MIDs of the generated mappings."
+                             " Default: twice the number of entities.")
+    parser.add_argument("--candidates", type=int, default=30,
+                        help="Maximum number of Aqqu candidates per question")
+    parser.add_argument("--answers", type=int, default=5000,
+                        help="Maximum number of answers per Aqqu candidate")
+    parser.add_argument("--completions", type=int, default=10,
+                        help="Number of QAC completions per prefix")
+    args = parser.parse_args()
+    args.mids = max(args.mids or 2 * args.entities, args.entities)
+
+    start_stub_server(args.aqqu_port, lambda q: get_aqqu_result(q, args),
+                      args.aqqu_latency, args.jitter)
+    start_stub_server(args.qac_port, lambda q: get_qac_result(q, args),
+                      args.qac_latency, args.jitter)
+    print("Stub Aqqu API on port %d, stub QAC API on port %d"
+          % (args.aqqu_port, args.qac_port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
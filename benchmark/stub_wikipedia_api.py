@@ -0,0 +1,106 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs, quote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from stub_backends import get_latency
+
+
+def get_pageimages_result(titles, img_size, image_ratio):
+    """Get a synthetic result of the pageimages query of the Wikipedia API
+    in format version 2 for the given titles.
+
+    Arguments:
+    titles - list of page titles
+    img_size - the requested thumbnail width
+    image_ratio - fraction of pages that have an image
+    """
+    pages = []
+    for title in titles:
+        page = {"title": title}
+        # Whether a page has an image only depends on its title
+        if zlib.crc32(title.encode("utf8")) % 1000 < image_ratio * 1000:
+            page["thumbnail"] = {
+                "source": "https://upload.wikimedia.org/wikipedia/commons/"
+                          "thumb/%s.jpg/%dpx-%s.jpg"
+                          % (quote(title), img_size, quote(title)),
+                "width": img_size, "height": img_size}
+        pages.append(page)
+    return {"batchcomplete": True, "query": {"pages": pages}}
+
+
+class WikipediaApiHandler(BaseHTTPRequestHandler):
+    """Answer GET requests for the pageimages query of the Wikipedia API
+    after the server's latency. A fraction of the requests is answered with
+    the error status 429 or 503 instead.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        time.sleep(get_latency(self.server.latency, self.server.jitter))
+        if random.random() < self.server.error_rate:
+            status = random.choice((429, 503))
+            body = b"{}"
+        else:
+            status = 200
+            titles = params.get("titles", [""])[0].split("|")
+            img_size = int(params.get("pithumbsize", ["500"])[0])
+            result = get_pageimages_result(titles, img_size,
+                                           self.server.image_ratio)
+            body = json.dumps(result).encode("utf8")
+        with self.server.lock:
+            self.server.num_requests += 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run a stub server for the pageimages query of the"
+                    " Wikipedia API to test get_wiki_image_urls.py.")
+    parser.add_argument("-p", "--port", type=int, default=8400,
+                        help="Port of the stub Wikipedia API. Query it at"
+                             " http://localhost:<port>/w/api.php")
+    parser.add_argument("--latency", type=float, default=0.1,
+                        help="Average latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5,
+                        help="Maximum deviation of the latency as fraction"
+                             " of the average latency")
+    parser.add_argument("--error-rate", type=float, default=0.05,
+                        help="Fraction of requests answered with status 429"
+                             " or 503")
+    parser.add_argument("--image-ratio", type=float, default=0.8,
+                        help="Fraction of pages that have an image")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("", args.port), WikipediaApiHandler)
+    server.daemon_threads = True
+    server.latency = args.latency
+    server.jitter = args.jitter
+    server.error_rate = args.error_rate
+    server.image_ratio = args.image_ratio
+    server.num_requests = 0
+    server.lock = threading.Lock()
+    print("Stub Wikipedia API on port %d" % args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print("Answered %d requests" % server.num_requests)
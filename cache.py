@@ -0,0 +1,170 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread-safe in-process cache with LRU eviction, a time to live for
+    entries and an upper bound on the number of entries and their total
+    size in bytes.
+
+    Optionally, entries can be served for another stale_ttl seconds after
+    they expired (stale-while-revalidate). At most one caller at a time is
+    allowed to refresh a stale entry, see get_stale() and begin_refresh().
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024,
+                 ttl=3600, stale_ttl=0):
+        """Create a new cache.
+
+        Arguments:
+        max_entries - maximum number of entries in the cache
+        max_bytes - maximum total size of the entries in bytes
+        ttl - time in seconds after which an entry expires
+        stale_ttl - time in seconds for which an expired entry can still be
+                    served by get_stale() while it is being refreshed
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.num_bytes = 0
+        # Mapping from key to (value, size, expiration time). The least
+        # recently used entry is the first entry.
+        self._entries = OrderedDict()
+        # Keys of stale entries that are currently being refreshed
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value for the given key or None if the key is not in
+        the cache or its entry expired.
+
+        Arguments:
+        key - the cache key
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires = entry
+            now = time.monotonic()
+            if expires <= now:
+                # Keep entries that can still be served by get_stale()
+                if expires + self.stale_ttl <= now:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_stale(self, key):
+        """Return the value for the given key and whether the value is
+        stale, i.e. expired but still within the stale time to live. Return
+        (None, False) if there is no usable entry for the key.
+
+        Arguments:
+        key - the cache key
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            value, size, expires = entry
+            now = time.monotonic()
+            if expires + self.stale_ttl <= now:
+                self._remove(key)
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            if expires <= now:
+                self.stale_hits += 1
+                return value, True
+            self.hits += 1
+            return value, False
+
+    def begin_refresh(self, key):
+        """Claim the refresh of the entry for the given key. Return False if
+        the entry is already being refreshed by someone else. The refresh
+        ends with a call to put() or end_refresh().
+
+        Arguments:
+        key - the cache key
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key):
+        """Release the refresh claim for the given key without updating the
+        entry, e.g. because the refresh failed.
+
+        Arguments:
+        key - the cache key
+        """
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def put(self, key, value, size):
+        """Add the value for the given key to the cache. Least recently used
+        entries are evicted until the cache is within its bounds again.
+
+        Arguments:
+        key - the cache key
+        value - the value to cache
+        size - (estimated) size of the value in bytes
+        """
+        if size > self.max_bytes or self.max_entries <= 0:
+            self.end_refresh(key)
+            return
+        with self._lock:
+            self._refreshing.discard(key)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.num_bytes += size
+            while (len(self._entries) > self.max_entries
+                   or self.num_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.num_bytes = 0
+
+    def stats(self):
+        """Return the cache statistics as dictionary.
+        """
+        with self._lock:
+            return {"entries": len(self._entries),
+                    "bytes": self.num_bytes,
+                    "hits": self.hits,
+                    "stale_hits": self.stale_hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        """Remove the entry for the given key. Must be called while holding
+        the lock.
+        """
+        _, size, _ = self._entries.pop(key)
+        self.num_bytes -= size
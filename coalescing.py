@@ -0,0 +1,212 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import asyncio
+import threading
+from collections import OrderedDict
+
+# Interval in seconds in which callers waiting for a shared call check
+# whether they have been superseded
+ABANDON_CHECK_INTERVAL = 0.05
+
+
+class SupersededError(Exception):
+    """Raised when a request has been superseded by a newer request of the
+    same client before its result was available.
+    """
+    pass
+
+
+class SupersessionTracker:
+    """Keep track of the latest request time stamp per client. Each request
+    gets an event that is set as soon as a newer request of the same client
+    is registered.
+    """
+
+    def __init__(self, max_clients=100000, event_factory=threading.Event):
+        """Create a new tracker.
+
+        Arguments:
+        max_clients - maximum number of clients to keep track of. The least
+                      recently active clients are forgotten first.
+        event_factory - the event class to use, e.g. asyncio.Event
+        """
+        self.max_clients = max_clients
+        self.event_factory = event_factory
+        self.num_superseded = 0
+        # Mapping from client to (latest time stamp, event of the request)
+        self._latest = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, client, timestamp):
+        """Register a new request of the given client and return an event
+        that is set once the request is superseded by a newer request.
+
+        Arguments:
+        client - an identifier of the client
+        timestamp - the time stamp the client attached to the request
+        """
+        event = self.event_factory()
+        try:
+            timestamp = float(timestamp)
+        except (TypeError, ValueError):
+            # Requests without valid time stamp are never superseded
+            return event
+
+        with self._lock:
+            latest = self._latest.get(client)
+            if latest is not None:
+                latest_timestamp, latest_event = latest
+                if timestamp < latest_timestamp:
+                    # A newer request arrived before this one
+                    self.num_superseded += 1
+                    event.set()
+                    return event
+                self.num_superseded += 1
+                latest_event.set()
+            self._latest[client] = (timestamp, event)
+            self._latest.move_to_end(client)
+            while len(self._latest) > self.max_clients:
+                self._latest.popitem(last=False)
+        return event
+
+
+class _Call:
+    """A call in flight whose result is shared by all callers with the same
+    key.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Merge concurrent calls with the same key into a single call. Callers
+    that arrive while a call for their key is in flight wait for the result
+    of that call instead of starting a new one.
+    """
+
+    def __init__(self):
+        self.num_shared = 0
+        self._calls = dict()
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, abandon=None):
+        """Return the result of fn() or of the call for the same key that is
+        already in flight. Exceptions of the call are raised for all callers.
+
+        Arguments:
+        key - the key identifying the call, e.g. the question prefix
+        fn - function without arguments that performs the call
+        abandon - optional event. If it is set before the result is
+                  available, a SupersededError is raised instead. A call
+                  that is already in flight is not interrupted.
+        """
+        if abandon is not None and abandon.is_set():
+            raise SupersededError()
+
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.num_shared += 1
+
+        if is_leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+
+        # Wait for the result of the call in flight
+        if abandon is None:
+            call.done.wait()
+        else:
+            while not call.done.wait(ABANDON_CHECK_INTERVAL):
+                if abandon.is_set():
+                    raise SupersededError()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class AsyncSingleFlight:
+    """Like SingleFlight, but for coroutines. A shared call is cancelled as
+    soon as all of its callers abandoned it.
+    """
+
+    def __init__(self):
+        self.num_shared = 0
+        # Mapping from key to (task, number of waiting callers)
+        self._calls = dict()
+
+    async def do(self, key, coro_fn, abandon=None):
+        """Return the result of coro_fn() or of the call for the same key
+        that is already in flight.
+
+        Arguments:
+        key - the key identifying the call, e.g. the question prefix
+        coro_fn - coroutine function without arguments that performs the
+                  call
+        abandon - optional asyncio.Event. If it is set before the result is
+                  available, a SupersededError is raised instead.
+        """
+        if abandon is not None and abandon.is_set():
+            raise SupersededError()
+
+        if key in self._calls:
+            task, num_waiting = self._calls[key]
+            self.num_shared += 1
+        else:
+            task, num_waiting = asyncio.ensure_future(coro_fn()), 0
+            task.add_done_callback(lambda t: self._remove(key, t))
+        self._calls[key] = (task, num_waiting + 1)
+
+        try:
+            if abandon is None:
+                return await asyncio.shield(task)
+
+            abandon_task = asyncio.ensure_future(abandon.wait())
+            try:
+                await asyncio.wait({task, abandon_task},
+                                   return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                abandon_task.cancel()
+            if task.done():
+                return task.result()
+            raise SupersededError()
+        except (SupersededError, asyncio.CancelledError):
+            # The caller abandoned the call or was cancelled itself
+            self._leave(key, task)
+            raise
+
+    def _leave(self, key, task):
+        """Stop waiting for the given call. The call is cancelled if nobody
+        else is waiting for it.
+        """
+        if key not in self._calls or self._calls[key][0] is not task:
+            return
+        _, num_waiting = self._calls[key]
+        if num_waiting == 1:
+            task.cancel()
+            del self._calls[key]
+        else:
+            self._calls[key] = (task, num_waiting - 1)
+
+    def _remove(self, key, task):
+        """Remove the given finished call unless it has been replaced by a
+        newer call for the same key.
+        """
+        if key in self._calls and self._calls[key][0] is task:
+            del self._calls[key]
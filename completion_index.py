@@ -0,0 +1,167 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import re
+import heapq
+import bisect
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# Prefix ranges with at most this many entries are scanned for the top
+# completions, the top completions of larger ranges are precomputed
+SCAN_LIMIT = 64
+
+# Largest character, appended to a prefix to find the end of its range
+MAX_CHAR = "\U0010ffff"
+
+
+def get_key(completion):
+    """Get the index key of the given completion, i.e. the lower case
+    completion without entity mention brackets.
+
+    Arguments:
+    completion - the completion, e.g. "who directed [Inception] "
+    """
+    return re.sub(r"[\[\]]", "", completion).lower()
+
+
+class CompletionIndex:
+    """Compact prefix index over popular questions. The questions are kept
+    in arrays sorted by their key, such that the questions starting with a
+    prefix form a contiguous range that is found by binary search. The top
+    completions of large ranges are precomputed.
+    """
+
+    def __init__(self, entries, k=10):
+        """Build the index.
+
+        Arguments:
+        entries - iterable over (completion, list of QIDs, score) tuples.
+                  Completions have entity mentions in square brackets and
+                  one lower case QID per mention.
+        k - number of completions returned per prefix
+        """
+        self.k = k
+        entries = sorted((get_key(completion), completion, qids, score)
+                         for completion, qids, score in entries)
+        self._keys = [entry[0] for entry in entries]
+        self._completions = [entry[1] for entry in entries]
+        self._qids = [entry[2] for entry in entries]
+        self._scores = array("d", (entry[3] for entry in entries))
+
+        # Names of the entities in the completions, to normalize prefixes in
+        # which the client replaced entity mentions by their QIDs
+        self._qid_names = dict()
+        for completion, qids in zip(self._completions, self._qids):
+            mentions = re.findall(r"\[(.*?)\]", completion)
+            for qid, name in zip(qids, mentions):
+                self._qid_names.setdefault(qid, name.lower())
+
+        # Mapping from (start, end) of a prefix range with more than
+        # SCAN_LIMIT entries to the indices of its top completions
+        self._top = dict()
+        if self._keys:
+            self._precompute(0, len(self._keys), 0)
+
+    @classmethod
+    def from_file(cls, input_file, k=10):
+        """Read the index from a file with one popular question per line in
+        the format <completion>TAB<comma separated QIDs>[TAB<frequency>].
+        Without frequencies, earlier questions are ranked higher.
+
+        Arguments:
+        input_file - path to the questions file
+        k - number of completions returned per prefix
+        """
+        logger.info("Read completion index file %s" % input_file)
+        entries = []
+        with open(input_file, "r", encoding="utf8") as file:
+            for i, line in enumerate(file):
+                fields = line.rstrip("\n").split("\t")
+                if not fields[0]:
+                    continue
+                qids = [qid.lower() for qid in fields[1].split(",") if qid] \
+                    if len(fields) > 1 else []
+                score = float(fields[2]) if len(fields) > 2 and fields[2] \
+                    else -i
+                entries.append((fields[0], qids, score))
+        index = cls(entries, k)
+        logger.info("Completion index has %d questions and %d precomputed"
+                    " prefixes" % (len(index), len(index._top)))
+        return index
+
+    def __len__(self):
+        return len(self._keys)
+
+    def complete(self, prefix):
+        """Get the top completions for the given question prefix in the
+        format of the QAC API results, i.e. as list of dictionaries with the
+        keys "completion", "qids" and "matched_alias".
+
+        Arguments:
+        prefix - the question prefix as sent by the client. Entity mentions
+                 may be given by name or by QID, e.g. "[q42]".
+        """
+        key = self._get_prefix_key(prefix)
+        start = bisect.bisect_left(self._keys, key)
+        end = bisect.bisect_left(self._keys, key + MAX_CHAR, start)
+        top = self._top.get((start, end))
+        if top is None:
+            top = self._get_top(range(start, end))
+        return [{"completion": self._completions[i],
+                 "qids": self._qids[i],
+                 "matched_alias": ""} for i in top]
+
+    def _get_prefix_key(self, prefix):
+        """Get the index key of the given prefix. Entity mentions given by
+        QID are replaced by the name of the entity.
+        """
+        def replace_qid(match):
+            qid = match.group(1).lower()
+            return self._qid_names.get(qid, qid)
+
+        prefix = re.sub(r"\[([qQ]\d+)\]", replace_qid, prefix)
+        return get_key(prefix)
+
+    def _get_top(self, indices):
+        """Get the indices of the k best completions among the given ones,
+        best first.
+        """
+        return heapq.nlargest(self.k, indices, key=self._scores.__getitem__)
+
+    def _precompute(self, start, end, depth):
+        """Precompute the top completions of the range of entries between
+        start and end, which share the first depth characters of their key,
+        and of all its sub-ranges with more than SCAN_LIMIT entries. Return
+        the top completions of the range.
+        """
+        if end - start <= SCAN_LIMIT:
+            return self._get_top(range(start, end))
+
+        # All prefixes up to the longest common prefix of the range have the
+        # same range. The keys are sorted, so it is the longest common prefix
+        # of the first and the last key.
+        first, last = self._keys[start], self._keys[end - 1]
+        while (depth < len(first) and depth < len(last)
+               and first[depth] == last[depth]):
+            depth += 1
+
+        # Split the range by the next character. Keys that end at depth come
+        # first and belong to no sub-range.
+        candidates = []
+        i = start
+        while i < end and len(self._keys[i]) == depth:
+            candidates.append(i)
+            i += 1
+        while i < end:
+            prefix = self._keys[i][:depth + 1]
+            j = bisect.bisect_left(self._keys, prefix + MAX_CHAR, i, end)
+            candidates.extend(self._precompute(i, j, depth + 1))
+            i = j
+
+        top = tuple(self._get_top(candidates))
+        self._top[(start, end)] = top
+        return top
@@ -0,0 +1,218 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import time
+import socket
+import logging
+import threading
+import http.client
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Errors that indicate that a reused keep-alive connection has been closed by
+# the server in the meantime. A request that fails with one of these errors
+# on a reused connection is retried once on a fresh connection.
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected,
+                           http.client.BadStatusLine,
+                           http.client.CannotSendRequest,
+                           http.client.ResponseNotReady,
+                           BrokenPipeError,
+                           ConnectionResetError,
+                           ConnectionAbortedError)
+
+
+class ServerError(ConnectionError):
+    """Raised when a backend answers with a server error status (5xx), so
+    that the request counts as failed like an unreachable backend.
+    """
+    pass
+
+
+class ConnectionPool:
+    """A thread-safe pool of persistent HTTP/1.1 connections to a single
+    host. Idle connections are reused for subsequent requests instead of
+    opening a new TCP connection per request.
+    """
+
+    def __init__(self, host, port, size=10, connect_timeout=2.0,
+                 read_timeout=30.0, idle_timeout=60.0, observe=None):
+        """Create a new connection pool.
+
+        Arguments:
+        host - hostname of the backend
+        port - port of the backend
+        size - maximum number of simultaneously open connections
+        connect_timeout - timeout in seconds for establishing a connection
+                          and for waiting for a free connection
+        read_timeout - timeout in seconds for waiting for a response
+        idle_timeout - idle connections older than this (in seconds) are
+                       closed instead of being reused
+        observe - function that is called as observe(stage, seconds) with
+                  the time of the stage "connect", i.e. getting a free or
+                  new connection, and the stage "wait", i.e. sending the
+                  request and reading the response
+        """
+        self.host = host
+        self.port = port
+        self.size = size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.observe = observe
+        # Idle connections as (connection, time of last use) tuples. New
+        # idle connections are appended on the right, i.e. the oldest
+        # connections are on the left.
+        self._idle = deque()
+        self._num_open = 0
+        self._cond = threading.Condition()
+
+    def request(self, method, path, timeout=None):
+        """Send a request over a pooled connection and return the response
+        body as bytes. Raises an OSError (i.e. socket.error) if the backend
+        can not be reached or does not answer in time and a ServerError if
+        it answers with a server error status.
+
+        Arguments:
+        method - the HTTP method, e.g. "GET"
+        path - the request path including the query string
+        timeout - timeout in seconds for waiting for the response of this
+                  request instead of the read timeout
+        """
+        start = time.monotonic()
+        conn, reused = self._acquire()
+        connected = time.monotonic()
+        try:
+            try:
+                status, body, will_close = self._send(conn, method, path,
+                                                      timeout)
+            except STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # The server closed the idle connection. Retry once on a
+                # fresh connection.
+                logger.debug("Reconnect stale connection to %s:%d"
+                             % (self.host, self.port))
+                conn.close()
+                conn = self._connect()
+                status, body, will_close = self._send(conn, method, path,
+                                                      timeout)
+        except http.client.HTTPException as e:
+            self._discard(conn)
+            raise ConnectionError("Invalid response from %s:%d: %r"
+                                  % (self.host, self.port, e)) from e
+        except BaseException:
+            self._discard(conn)
+            raise
+
+        if will_close:
+            self._discard(conn)
+        else:
+            self._release(conn)
+        if self.observe is not None:
+            self.observe("connect", connected - start)
+            self.observe("wait", time.monotonic() - connected)
+        if status >= 500:
+            raise ServerError("%s:%d answered with status %d"
+                              % (self.host, self.port, status))
+        return body
+
+    def close(self):
+        """Close all idle connections of the pool.
+        """
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                conn.close()
+                self._num_open -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        """Return the number of open and idle connections as dictionary.
+        """
+        with self._cond:
+            return {"open": self._num_open, "idle": len(self._idle)}
+
+    def _send(self, conn, method, path, timeout):
+        """Send the request over the given connection and read the complete
+        response. Return the status, the body and whether the connection must
+        be closed.
+        """
+        if conn.sock is None:
+            self._open_socket(conn)
+        conn.sock.settimeout(self.read_timeout if timeout is None else timeout)
+        conn.request(method, path)
+        response = conn.getresponse()
+        body = response.read()
+        return response.status, body, response.will_close
+
+    def _acquire(self):
+        """Get an idle connection from the pool or open a new one. Return the
+        connection and whether it is a reused connection.
+        """
+        deadline = time.monotonic() + self.connect_timeout
+        with self._cond:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    conn, _ = self._idle.pop()
+                    return conn, True
+                if self._num_open < self.size:
+                    self._num_open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout("No free connection to %s:%d"
+                                         % (self.host, self.port))
+                self._cond.wait(remaining)
+
+        # Connect outside of the lock so that other threads are not blocked
+        try:
+            return self._connect(), False
+        except BaseException:
+            with self._cond:
+                self._num_open -= 1
+                self._cond.notify()
+            raise
+
+    def _connect(self):
+        """Open a new connection to the backend.
+        """
+        conn = http.client.HTTPConnection(self.host, self.port,
+                                          timeout=self.connect_timeout)
+        self._open_socket(conn)
+        return conn
+
+    def _open_socket(self, conn):
+        """Connect the given connection and switch its socket to the read
+        timeout.
+        """
+        conn.timeout = self.connect_timeout
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+
+    def _release(self, conn):
+        """Put the given connection back into the pool.
+        """
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, conn):
+        """Close the given connection and free its slot in the pool.
+        """
+        conn.close()
+        with self._cond:
+            self._num_open -= 1
+            self._cond.notify()
+
+    def _evict_idle(self):
+        """Close idle connections that exceeded the idle timeout. Must be
+        called while holding the lock.
+        """
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            conn.close()
+            self._num_open -= 1
@@ -5,10 +5,11 @@
 import requests
 import logging
 import time
+import random
+import sqlite3
 import argparse
-from urllib import parse
-from operator import itemgetter
-from collections import defaultdict
+import threading
+import concurrent.futures
 
 
 # Set up the logger
@@ -16,6 +17,132 @@ logging.basicConfig(format='%(asctime)s: %(message)s',
                     datefmt="%H:%M:%S", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+WIKIPEDIA_API_URL = "https://en.wikipedia.org/w/api.php"
+USER_AGENT = "aqqu-frontend-image-fetcher (ad-freiburg/aqqu-frontend)"
+
+# Response status codes after which a request is retried
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Maximum time in seconds to wait before retrying a request
+MAX_BACKOFF = 60
+
+# Number of batches submitted ahead per thread
+BATCHES_AHEAD = 2
+
+# Seconds per day
+DAY = 24 * 60 * 60
+
+
+class RateLimiter:
+    """Limit the rate of requests of all threads to a number of requests per
+    second.
+    """
+
+    def __init__(self, rate):
+        """Create a new rate limiter.
+
+        Arguments:
+        rate - maximum number of requests per second, 0 for no limit
+        """
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next request may be sent.
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            send_time = max(now, self._next_time)
+            self._next_time = send_time + self.interval
+        time.sleep(send_time - now)
+
+
+def create_session(max_connections):
+    """Create a requests session that keeps up to the given number of
+    connections alive.
+
+    Arguments:
+    max_connections - maximum number of connections in the session's pool
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=max_connections)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+def get_backoff(trial, retry_after=None):
+    """Get the time in seconds to wait before the given retry of a request,
+    i.e. an exponentially growing random time or the time the server asked
+    for.
+
+    Arguments:
+    trial - the number of the failed trial, starting at 1
+    retry_after - value of the Retry-After header of the response, if any
+    """
+    if retry_after is not None and retry_after.isdigit():
+        return min(int(retry_after), MAX_BACKOFF)
+    return random.uniform(0, min(MAX_BACKOFF, 2 ** trial))
+
+
+class TitleCache:
+    """Persistent mapping from Wikipedia page title to thumbnail url in an
+    SQLite database. Entries store when they were retrieved, such that they
+    can expire. Stored results are committed right away, so an interrupted
+    run loses no results.
+    """
+
+    def __init__(self, path):
+        """Open the cache file or create it if it does not exist.
+
+        Arguments:
+        path - path to the cache file
+        """
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS thumbnails ("
+                         "title TEXT PRIMARY KEY, url TEXT NOT NULL, "
+                         "retrieved REAL NOT NULL)")
+
+    def __len__(self):
+        query = "SELECT COUNT(*) FROM thumbnails"
+        return self._db.execute(query).fetchone()[0]
+
+    def get(self, title, min_time=0):
+        """Return the thumbnail url of the given title, an empty string if
+        the page has no image or None if the title is not cached or was
+        retrieved before min_time.
+
+        Arguments:
+        title - the Wikipedia page title
+        min_time - minimum retrieval time as Unix timestamp
+        """
+        row = self._db.execute("SELECT url FROM thumbnails WHERE title = ?"
+                               " AND retrieved >= ?",
+                               (title, min_time)).fetchone()
+        return row[0] if row else None
+
+    def put(self, urls):
+        """Store the given (title, thumbnail url) pairs.
+
+        Arguments:
+        urls - list of (title, thumbnail url) tuples
+        """
+        now = time.time()
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO thumbnails"
+                                 " VALUES (?, ?, ?)",
+                                 [(title, url, now) for title, url in urls])
+
+    def close(self):
+        self._db.close()
+
 
 def read_qid_title_list(input_file):
     """Read the QID to Wikipedia page-title from the given input file and
@@ -33,34 +160,49 @@ def read_qid_title_list(input_file):
     return lst
 
 
-def retrieve_wiki_image_url(batch, img_size=500):
-    """Retrieve an image for the given titles using the Wikipedia API
+def retrieve_wiki_image_url(batch, session, rate_limiter, img_size=500,
+                            api_url=WIKIPEDIA_API_URL, max_trials=10):
+    """Retrieve an image for the given titles using the Wikipedia API.
+    Return the (title, image url) pairs and the titles for which no result
+    could be retrieved.
 
     Arguments:
-    batch - mapping from Wikipedia page title to list of QIDs
+    batch - list of Wikipedia page titles
+    session - the requests session
+    rate_limiter - the RateLimiter shared by all requests
+    img_size - width of the thumbnails in pixels
+    api_url - url of the Wikipedia API
+    max_trials - maximum number of trials of the request
     """
     # Prepare request
-    titles_str = "|".join(batch.keys())
-    host = "https://en.wikipedia.org/w/api.php"
+    titles_str = "|".join(batch)
     data = {"action": "query", "prop": "pageimages", "titles": titles_str,
             "pithumbsize": img_size, "format": "json", "formatversion": 2}
 
-    # Try to send request to API
-    counter = 0
-    while True:
-        counter += 1
+    # Try to send request to API. Retry after network errors and responses
+    # that indicate a temporary problem.
+    response = None
+    for trial in range(1, max_trials + 1):
+        rate_limiter.wait()
+        retry_after = None
         try:
-            response = requests.get(host, params=data)
-            break
-        except requests.exceptions.RequestException:
-            time.sleep(2*counter)
-            if counter % 100 == 1:
-                logger.warning("Cannot reach host. Trial no %d" % counter)
+            response = session.get(api_url, params=data, timeout=30)
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+            retry_after = response.headers.get("Retry-After")
+            logger.warning("Got status %d from API. Trial no %d"
+                           % (response.status_code, trial))
+        except requests.exceptions.RequestException as e:
+            logger.warning("Cannot reach host: %s. Trial no %d" % (e, trial))
+        response = None
+        if trial < max_trials:
+            time.sleep(get_backoff(trial, retry_after))
 
     # Process server response
     if response:
         response = response.json()
         results = response["query"]["pages"]
+        missing = set(batch)
         urls = []
         errors = []
         for res in results:
@@ -68,80 +210,138 @@ def retrieve_wiki_image_url(batch, img_size=500):
             thumbnail = ""
             if "thumbnail" in res:
                 thumbnail = res["thumbnail"]["source"]
-            # Retrieve QID for result title and add QID + image url to result
+            # Add title + image url to result
             title = res["title"]
-            if title in batch:
-                for qid in batch[title]:
-                    urls.append((qid, thumbnail))
-                del batch[title]
+            if title in missing:
+                urls.append((title, thumbnail))
+                missing.remove(title)
             else:
                 logger.warning("Result title could not be mapped to query: %s"
                                % title)
                 errors.append(title)
-        if len(batch) > 0:
+        if len(missing) > 0:
             logger.warning("Not all query titles could be mapped to result: %s"
-                           % batch.items())
-            errors += batch.keys()
+                           % missing)
+            errors += missing
         return urls, errors
 
-    return [], []
+    logger.error("Giving up on batch starting with title %s" % batch[0])
+    return [], list(batch)
 
 
-def write_qid_to_image_mapping(lst, outfile, batch_size=20):
-    """For each QID-title pair in the given list, retrieve the Wikipedia image
-    url and write the QID to url mapping to the output file.
+def get_titles_to_retrieve(lst, cache, max_age):
+    """Return the titles in the given list that are not in the cache or
+    whose cache entry is older than max_age days, in the order of the list.
 
     Arguments:
     lst - a list containing tuples (QID, title)
-    outfile - the output file for the mapping
+    cache - the TitleCache
+    max_age - maximum age of cache entries in days
     """
-    error_file_name = outfile[:outfile.rfind(".") + 1] + "err"
-    error_file = open(error_file_name, "w", encoding="utf8")
-    logger.info("Query Wikipedia API")
-    logger.info("Write resulting qid to image url mapping to %s" % outfile)
-    with open(outfile, "w", encoding="utf8") as file:
-        start = time.time()
-        batch = defaultdict(list)
-        counter = 0
-        for qid, title in lst:
-            batch[title].append(qid)
+    min_time = time.time() - max_age * DAY
+    titles = []
+    seen = set()
+    for _, title in lst:
+        if title not in seen and cache.get(title, min_time) is None:
+            titles.append(title)
+            seen.add(title)
+    return titles
 
-            # If batch is full, retrieve Wikipedia image url for each element
-            if len(batch) == batch_size:
-                urls, errors = retrieve_wiki_image_url(batch)
 
-                # Log errors in separate error file
-                for e in errors:
-                    error_file.write("%s\n" % e)
+def retrieve_wiki_image_urls(titles, cache, batch_size=20, concurrency=8,
+                             rate=50, api_url=WIKIPEDIA_API_URL,
+                             max_trials=10):
+    """Retrieve the Wikipedia image urls of the given titles and store them
+    in the cache as soon as a batch is done. Up to concurrency batches are
+    requested at once. Return the titles for which no url could be
+    retrieved.
 
-                # Write each QID and url in the batch to the output file
-                for q, url in urls:
-                    file.write("%s\t%s\n" % (q, url))
+    Arguments:
+    titles - list of Wikipedia page titles
+    cache - the TitleCache
+    batch_size - the number of titles per request
+    concurrency - maximum number of requests in flight
+    rate - maximum number of requests per second, 0 for no limit
+    api_url - url of the Wikipedia API
+    max_trials - maximum number of trials per request
+    """
+    session = create_session(concurrency)
+    rate_limiter = RateLimiter(rate)
+    logger.info("Query Wikipedia API for %d titles with %d requests in"
+                " flight" % (len(titles), concurrency))
+    batches = (titles[i:i + batch_size]
+               for i in range(0, len(titles), batch_size))
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        start = time.time()
+        counter = 0
+        pending = set()
+        while True:
+            for batch in batches:
+                pending.add(executor.submit(
+                    retrieve_wiki_image_url, batch, session, rate_limiter,
+                    api_url=api_url, max_trials=max_trials))
+                if len(pending) >= BATCHES_AHEAD * concurrency:
+                    break
+            if not pending:
+                break
 
-                # Reset batch
-                batch = defaultdict(list)
+            # Store the results of the finished batches
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                urls, batch_errors = future.result()
+                cache.put(urls)
+                errors += batch_errors
+                new_counter = counter + len(urls) + len(batch_errors)
+                if new_counter // 1000 > counter // 1000:
+                    logger.info("Processed %d titles in %fs" %
+                                (new_counter, time.time() - start))
+                counter = new_counter
+    return errors
 
-            counter += 1
-            if counter % 1000 == 0:
-                logger.info("Processed %d qids in %fs" %
-                            (counter, time.time() - start))
 
-        # Retrieve urls for batch remainder
-        if len(batch) > 0:
-            urls, errors = retrieve_wiki_image_url(batch)
+def write_qid_to_image_mapping(lst, outfile, cache_file=None, max_age=30,
+                               **kwargs):
+    """For each QID-title pair in the given list, retrieve the Wikipedia image
+    url and write the QID to url mapping to the output file in the order of
+    the list. Only titles that are not in the cache or whose cache entry has
+    expired are retrieved.
 
-            # Log errors in separate error file
-            for e in errors:
-                error_file.write("%s\n" % e)
+    Arguments:
+    lst - a list containing tuples (QID, title)
+    outfile - the output file for the mapping
+    cache_file - the title to image url cache file. Default: the output file
+                 with extension .sqlite
+    max_age - maximum age of cache entries in days
+    kwargs - arguments of retrieve_wiki_image_urls()
+    """
+    base_name = outfile[:outfile.rfind(".") + 1]
+    if cache_file is None:
+        cache_file = base_name + "sqlite"
+    logger.info("Open image url cache %s" % cache_file)
+    cache = TitleCache(cache_file)
+    logger.info("Image url cache has %d titles" % len(cache))
+    titles = get_titles_to_retrieve(lst, cache, max_age)
+    errors = retrieve_wiki_image_urls(titles, cache, **kwargs)
 
-            # Write each QID and url in the batch to the output file
-            for q, url in urls:
-                file.write("%s\t%s\n" % (q, url))
+    # Log errors in separate error file
+    with open(base_name + "err", "w", encoding="utf8") as error_file:
+        for e in errors:
+            error_file.write("%s\n" % e)
 
+    # Write each QID and url to the output file. For titles that could not
+    # be retrieved again, an expired url is better than none.
+    logger.info("Write resulting qid to image url mapping to %s" % outfile)
+    with open(outfile, "w", encoding="utf8") as file:
+        for qid, title in lst:
+            url = cache.get(title)
+            if url is not None:
+                file.write("%s\t%s\n" % (qid, url))
+    cache.close()
     logger.info("Done.")
 
 
-
 if __name__ == "__main__":
     default_infile = "/nfs/students/natalie-prange/wikidata_mappings/qid_to_wikipedia_info.tsv"
     parser = argparse.ArgumentParser()
@@ -149,10 +349,37 @@ if __name__ == "__main__":
                         help="File to which to write the results.")
     parser.add_argument("-i", "--input", default=default_infile,
                         help="QID to (title, image, abstract) mapping file.")
+    parser.add_argument("-c", "--concurrency", type=int, default=8,
+                        help="Maximum number of requests in flight.")
+    parser.add_argument("-r", "--rate", type=float, default=50,
+                        help="Maximum number of requests per second, 0 for"
+                             " no limit.")
+    parser.add_argument("-b", "--batch-size", type=int, default=20,
+                        help="Number of titles per request.")
+    parser.add_argument("--max-trials", type=int, default=10,
+                        help="Maximum number of trials per request. Titles"
+                             " of failed requests are written to the error"
+                             " file.")
+    parser.add_argument("--cache",
+                        help="Title to image url cache file. Only titles"
+                             " that are not in the cache are retrieved, so"
+                             " an interrupted run can be resumed. Default:"
+                             " the output file with extension .sqlite")
+    parser.add_argument("--max-age", type=float, default=30,
+                        help="Cached image urls older than this many days"
+                             " are retrieved again.")
+    parser.add_argument("--api-url", default=WIKIPEDIA_API_URL,
+                        help="Url of the Wikipedia API, e.g. of a local stub"
+                             " for testing.")
 
     args = parser.parse_args()
     infile = args.input
     outfile = args.output
 
     qid_title_list = read_qid_title_list(infile)
-    write_qid_to_image_mapping(qid_title_list, outfile)
+    write_qid_to_image_mapping(qid_title_list, outfile,
+                               cache_file=args.cache, max_age=args.max_age,
+                               batch_size=args.batch_size,
+                               concurrency=args.concurrency, rate=args.rate,
+                               api_url=args.api_url,
+                               max_trials=args.max_trials)
@@ -2,10 +2,16 @@
 # Author: Natalie Prange <prange@informatik.uni-freiburg.de>
 
 
+import os
 import re
+import sys
+import heapq
 import logging
 import argparse
+import tempfile
+import itertools
 from urllib import parse
+from tsv_ingest import parse_file
 
 
 # Set up the logger
@@ -13,6 +19,18 @@ logging.basicConfig(format='%(asctime)s: %(message)s',
                     datefmt="%H:%M:%S", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Maximum number of sorted runs that are merged at once
+MAX_MERGE_RUNS = 128
+
+# Estimated memory in bytes of a record in a sort chunk besides its strings
+RECORD_OVERHEAD = 64
+
+QID_URL_PREFIX = "<http://www.wikidata.org/entity/"
+QID_URL_RE = re.compile(r"<http://www.wikidata.org/entity/(Q[0-9]+)>")
+WIKI_URL_PREFIX = "<https://en.wikipedia.org/wiki/"
+WIKI_URL_RE = re.compile(r"<https://en\.wikipedia\.org/wiki/(.*?)>")
+SPACES_RE = re.compile(r" ( )+")
+
 
 def get_mapping_tuples(input_file, max_splits=-1):
     """Reads the input file and yields each line as a tuple of the
@@ -33,7 +51,14 @@ def get_qid_from_url(url):
     Arguments:
     url - the QID url
     """
-    return re.sub(r"<http://www.wikidata.org/entity/(Q[0-9]+)>", r"\1", url)
+    # Slice urls that consist of a single QID url, which is much faster than
+    # the regular expression
+    if url.startswith(QID_URL_PREFIX) and url.endswith(">"):
+        qid = url[len(QID_URL_PREFIX):-1]
+        digits = qid[1:]
+        if qid[:1] == "Q" and digits.isascii() and digits.isdigit():
+            return qid
+    return QID_URL_RE.sub(r"\1", url)
 
 
 def get_wikititle_from_url(url):
@@ -42,7 +67,11 @@ def get_wikititle_from_url(url):
     Arguments:
     url - the Wikipedia page url
     """
-    title = re.sub(r"<https://en\.wikipedia\.org/wiki/(.*?)>", r"\1", url)
+    if (url.startswith(WIKI_URL_PREFIX)
+            and url.find(">", len(WIKI_URL_PREFIX)) == len(url) - 1):
+        title = url[len(WIKI_URL_PREFIX):-1]
+    else:
+        title = WIKI_URL_RE.sub(r"\1", url)
     title = parse.unquote(title)
     title = title.replace("_", " ")
     return title
@@ -57,43 +86,113 @@ def clean_abstract_string(abstract):
     Arguments:
     abstract - the abstract string
     """
-    abstract = re.sub(r'^"@ ', '', abstract)
+    if abstract.startswith('"@ '):
+        abstract = abstract[3:]
     abstract = abstract.replace('"@en', "")
     abstract = abstract.replace('@', '')
-    abstract = re.sub(r' ( )+', ' ', abstract)
+    if "  " in abstract:
+        abstract = SPACES_RE.sub(" ", abstract)
     abstract = abstract.replace('\\"', '"')
     abstract = abstract.replace('\t', ' ')
     return abstract
 
 
-def get_qid_to_wikititle_dict(input_file):
+def parse_wikititle_lines(lines):
+    """Yields the (QID, Wikipedia title) pair of each of the given lines of
+    a qid-to-title mapping file. QID-urls are replaced by <QID>, title-urls
+    by <title>.
+
+    Arguments:
+    lines - iterable over the lines
+    """
+    for line in lines:
+        qid_url, wiki_url = line.strip("\n").split("\t")
+        yield get_qid_from_url(qid_url), get_wikititle_from_url(wiki_url)
+
+
+def parse_image_lines(lines):
+    """Yields the (QID, Wikidata image) pair of each of the given lines of a
+    qid-to-image mapping file. QID-urls are replaced by <QID>.
+
+    Arguments:
+    lines - iterable over the lines
+    """
+    for line in lines:
+        qid_url, image_url = line.strip("\n").split("\t")
+        yield get_qid_from_url(qid_url), image_url.strip("<>")
+
+
+def parse_abstract_lines(lines):
+    """Yields the (QID, Wikipedia abstract) pair of each of the given lines
+    of a qid-to-abstract mapping file. QID-urls are replaced by <QID>.
+
+    Arguments:
+    lines - iterable over the lines
+    """
+    for line in lines:
+        qid_url, abstract = line.strip("\n").split("\t", 1)
+        yield get_qid_from_url(qid_url), clean_abstract_string(abstract)
+
+
+def get_qid_wikititle_tuples(input_file, processes=1):
+    """Yields the (QID, Wikipedia title) pairs in the input file.
+    QID-urls are replaced by <QID>, title-urls by <title>.
+
+    Arguments:
+    input_file - the path to the input file
+    processes - number of processes that parse the file
+    """
+    return parse_file(input_file, parse_wikititle_lines, processes)
+
+
+def get_qid_image_tuples(input_file, processes=1):
+    """Yields the (QID, Wikidata image) pairs in the input file. QID-urls are
+    replaced by <QID>.
+
+    Arguments:
+    input_file - the path to the input file
+    processes - number of processes that parse the file
+    """
+    return parse_file(input_file, parse_image_lines, processes)
+
+
+def get_qid_abstract_tuples(input_file, processes=1):
+    """Yields the (QID, Wikipedia abstract) pairs in the input file. QID-urls
+    are replaced by <QID>.
+
+    Arguments:
+    input_file - the path to the input file
+    processes - number of processes that parse the file
+    """
+    return parse_file(input_file, parse_abstract_lines, processes)
+
+
+def get_qid_to_wikititle_dict(input_file, processes=1):
     """Returns a mapping from QIDs to Wikipedia titles as given in the input
     file. QID-urls are replaced by <QID>, title-urls by <title>.
 
     Arguments:
     input_file - the path to the input file
+    processes - number of processes that parse the file
     """
     logger.info("Building qid-to-title mapping from file %s" % input_file)
     qid_to_wikititle = dict()
-    for qid_url, wiki_url in get_mapping_tuples(input_file):
-        qid = get_qid_from_url(qid_url)
-        wikiname = get_wikititle_from_url(wiki_url)
+    for qid, wikiname in get_qid_wikititle_tuples(input_file, processes):
         qid_to_wikititle[qid] = wikiname
     return qid_to_wikititle
 
 
-def get_qid_to_image_dict(input_file):
+def get_qid_to_image_dict(input_file, processes=1):
     """Returns a mapping from QIDs to Wikidata images as given in the input
     file. QID-urls are replaced by <QID>.
 
     Arguments:
     input_file - the path to the input file
+    processes - number of processes that parse the file
     """    
     logger.info("Building qid-to-image mapping from file %s" % input_file)
     qid_to_image = dict()
-    for qid_url, image_url in get_mapping_tuples(input_file):
-        qid = get_qid_from_url(qid_url)
-        image_url = image_url.strip("<>")
+    for qid, image_url in get_qid_image_tuples(input_file, processes):
         # Image file may contain several images per QID (via property P18,
         # P109, P14, ...) --> only take the first one
         if qid not in qid_to_image:
@@ -101,18 +200,17 @@ def get_qid_to_image_dict(input_file):
     return qid_to_image
 
 
-def get_qid_to_abstract_dict(input_file):
+def get_qid_to_abstract_dict(input_file, processes=1):
     """Returns a mapping from QIDs to Wikipedia abstract as given in the input
     file. QID-urls are replaced by <QID>.
 
     Arguments:
     input_file - the path to the input file
+    processes - number of processes that parse the file
     """
     logger.info("Building qid-to-abstract mapping from file %s" % input_file)
     qid_to_abstract = dict()
-    for qid_url, abstract in get_mapping_tuples(input_file, 1):
-        qid = get_qid_from_url(qid_url)
-        abstract = clean_abstract_string(abstract)
+    for qid, abstract in get_qid_abstract_tuples(input_file, processes):
         qid_to_abstract[qid] = abstract
     return qid_to_abstract
 
@@ -150,10 +248,13 @@ def write_qid_to_wiki_info(output_file, qid_to_wiki_info):
     Arguments:
     output_file - path to the output file
     qid_to_wiki_info - mapping from QID to (<title>, <image>, <abstract>) tuple
+                       or iterable over (QID, tuple) pairs
     """
     logger.info("Writing qid-to-wiki-info mapping to file %s" % output_file)
+    if isinstance(qid_to_wiki_info, dict):
+        qid_to_wiki_info = qid_to_wiki_info.items()
     with open(output_file, "w", encoding="utf8") as outfile:
-        for qid, tupl in qid_to_wiki_info.items():
+        for qid, tupl in qid_to_wiki_info:
             title, image, abstract = tupl
             outfile.write("%s\t%s\t%s\t%s\n" % (qid, title, image, abstract))
 
@@ -172,6 +273,153 @@ def combine_mappings(mapping1, mapping2):
     return mapping1
 
 
+def write_run(records, tmp_dir):
+    """Write the given (QID, value) pairs to a new temporary file in the given
+    directory and return its path.
+    """
+    fd, path = tempfile.mkstemp(suffix=".tsv", dir=tmp_dir)
+    with open(fd, "w", encoding="utf8") as file:
+        for qid, value in records:
+            file.write("%s\t%s\n" % (qid, value))
+    return path
+
+
+def read_run(path):
+    """Yield the (QID, value) pairs of a file written by write_run() and
+    delete the file afterwards.
+    """
+    try:
+        for qid, value in get_mapping_tuples(path, 1):
+            yield qid, value
+    finally:
+        os.remove(path)
+
+
+def merge_runs(paths):
+    """Merge the given sorted runs into a single sorted iterator over (QID,
+    value) pairs. Pairs with the same QID keep the order of the runs.
+    """
+    return heapq.merge(*(read_run(path) for path in paths),
+                       key=lambda record: record[0])
+
+
+def sort_by_qid(records, tmp_dir, memory_budget, keep_last_chunk=True):
+    """Sort the given (QID, value) pairs by QID with an external merge sort
+    and return an iterator over the sorted pairs. Pairs with the same QID
+    keep their order.
+
+    Arguments:
+    records - iterable over (QID, value) tuples
+    tmp_dir - directory for the sorted runs
+    memory_budget - maximum size in bytes of the pairs kept in memory
+    keep_last_chunk - whether the pairs may be kept in memory if they all
+                      fit into the memory budget. Pass False if more pairs
+                      are read into memory before the result is consumed.
+    """
+    # Write sorted chunks of at most memory_budget bytes as runs. Python's
+    # sort is stable, so pairs with the same QID keep their order.
+    paths = []
+    chunk = []
+    chunk_size = 0
+    for record in records:
+        chunk.append(record)
+        chunk_size += (sys.getsizeof(record[0]) + sys.getsizeof(record[1])
+                       + RECORD_OVERHEAD)
+        if chunk_size >= memory_budget:
+            chunk.sort(key=lambda record: record[0])
+            paths.append(write_run(chunk, tmp_dir))
+            chunk = []
+            chunk_size = 0
+    chunk.sort(key=lambda record: record[0])
+    if len(paths) == 0 and keep_last_chunk:
+        return iter(chunk)
+    paths.append(write_run(chunk, tmp_dir))
+    del chunk
+
+    # Merge groups of runs until few enough are left to merge them at once
+    while len(paths) > MAX_MERGE_RUNS:
+        paths = [write_run(merge_runs(paths[i:i + MAX_MERGE_RUNS]), tmp_dir)
+                 for i in range(0, len(paths), MAX_MERGE_RUNS)]
+    logger.info("Merging %d sorted runs" % len(paths))
+    return merge_runs(paths)
+
+
+def get_unique(sorted_records, keep_first, source):
+    """Yield one (QID, source, value) tuple per QID from the given pairs
+    sorted by QID, with the value of either the first or the last pair.
+
+    Arguments:
+    sorted_records - iterable over (QID, value) tuples sorted by QID
+    keep_first - whether to keep the first or the last pair of a QID
+    source - number of the mapping the pairs belong to
+    """
+    for qid, group in itertools.groupby(sorted_records,
+                                        key=lambda record: record[0]):
+        value = next(group)[1]
+        if not keep_first:
+            for _, value in group:
+                pass
+        yield qid, source, value
+
+
+def get_qid_to_wiki_info_tuples(title_file, image_file, abstract_file,
+                                combine_file=None, tmp_dir=None,
+                                memory_budget=1 << 30, processes=1):
+    """Yield the (QID, title, image, abstract) tuples of the combined
+    mapping sorted by QID. Each input file is sorted by QID with an
+    external merge sort and the sorted mappings are then merged, so only
+    memory_budget bytes of the mappings are kept in memory at once. The
+    result is the same as that of get_qid_to_wiki_info_dict() and
+    combine_mappings().
+
+    Arguments:
+    title_file - path to the qid-to-title mapping file
+    image_file - path to the qid-to-image mapping file
+    abstract_file - path to the qid-to-abstract mapping file
+    combine_file - path to the preferred QID to Wikipedia image mapping
+                   file, if any
+    tmp_dir - directory for temporary files
+    memory_budget - maximum size in bytes of the mappings kept in memory
+    processes - number of processes that parse the files
+    """
+    # As for the dictionaries, the last title, abstract and Wikipedia image
+    # and the first Wikidata image of a QID are used
+    sources = [
+        (title_file, get_qid_wikititle_tuples(title_file, processes), False),
+        (image_file, get_qid_image_tuples(image_file, processes), True),
+        (abstract_file, get_qid_abstract_tuples(abstract_file, processes),
+         False)]
+    if combine_file:
+        sources.append((combine_file, get_mapping_tuples(combine_file),
+                        False))
+
+    streams = []
+    for i, (input_file, tuples, keep_first) in enumerate(sources):
+        logger.info("Sorting mapping file %s" % input_file)
+        # Only the last mapping may stay in memory, the chunks of the other
+        # mappings would add up while the later mappings are sorted
+        records = sort_by_qid(tuples, tmp_dir, memory_budget,
+                              keep_last_chunk=i == len(sources) - 1)
+        streams.append(get_unique(records, keep_first, i))
+
+    logger.info("Merging mappings to qid-to-wiki-info mapping.")
+    merged = heapq.merge(*streams)
+    for qid, group in itertools.groupby(merged, key=lambda entry: entry[0]):
+        values = [None] * len(sources)
+        for _, i, value in group:
+            values[i] = value
+        title, image, abstract = values[:3]
+        if combine_file:
+            # The Wikipedia image is preferred, see combine_mappings()
+            wikidata_image = image
+            image = values[3]
+            if wikidata_image and not image:
+                image = wikidata_image
+        if title is None and image is None and abstract is None:
+            continue
+        yield qid, (title or "", image or "", abstract or "")
+
+
 if __name__ == "__main__":
     default_output = "/nfs/students/natalie-prange/wikidata_mappings/qid_to_wikipedia_info.tsv"
     default_title_file = "/nfs/students/natalie-prange/wikidata_mappings/qid_to_title.tsv"
@@ -190,24 +438,43 @@ if __name__ == "__main__":
                         help="File that contains the qid-to-abstract mapping.")
     parser.add_argument("-i", "--image-file", default=default_image_file,
                         help="File that contains the qid-to-image mapping.")
+    parser.add_argument("-m", "--memory-budget", type=int,
+                        help="Sort the mapping files by QID in chunks of at"
+                             " most this many MB and merge them instead of"
+                             " reading them into memory. The output is"
+                             " sorted by QID.")
+    parser.add_argument("--tmp-dir",
+                        help="Directory for the sorted chunks.")
+    parser.add_argument("-p", "--processes", type=int, default=1,
+                        help="Number of processes that parse the mapping"
+                             " files.")
 
     args = parser.parse_args()
     combine = args.combine
+    processes = args.processes
     output = args.output_file
     title_file = args.title_file
     abstract_file = args.abstract_file
     image_file = args.image_file
 
-    wikititle_dict = get_qid_to_wikititle_dict(title_file)
-    image_dict = get_qid_to_image_dict(image_file)
-
-    # Combine two QID to image mappings into one if option was specified
-    if combine:
-        wikipedia_image_mapping = dict()
-        for qid, img_url in get_mapping_tuples(combine):
-            wikipedia_image_mapping[qid] = img_url
-        image_dict = combine_mappings(wikipedia_image_mapping, image_dict)
-
-    abstract_dict = get_qid_to_abstract_dict(abstract_file)
-    wiki_info_dict = get_qid_to_wiki_info_dict(wikititle_dict, image_dict, abstract_dict)
-    write_qid_to_wiki_info(output, wiki_info_dict)
+    if args.memory_budget:
+        wiki_info_tuples = get_qid_to_wiki_info_tuples(
+            title_file, image_file, abstract_file, combine, args.tmp_dir,
+            args.memory_budget * 1024 * 1024, processes)
+        write_qid_to_wiki_info(output, wiki_info_tuples)
+    else:
+        wikititle_dict = get_qid_to_wikititle_dict(title_file, processes)
+        image_dict = get_qid_to_image_dict(image_file, processes)
+
+        # Combine two QID to image mappings into one if option was specified
+        if combine:
+            wikipedia_image_mapping = dict()
+            for qid, img_url in get_mapping_tuples(combine):
+                wikipedia_image_mapping[qid] = img_url
+            image_dict = combine_mappings(wikipedia_image_mapping,
+                                          image_dict)
+
+        abstract_dict = get_qid_to_abstract_dict(abstract_file, processes)
+        wiki_info_dict = get_qid_to_wiki_info_dict(wikititle_dict, image_dict,
+                                                   abstract_dict)
+        write_qid_to_wiki_info(output, wiki_info_dict)
@@ -0,0 +1,110 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import os
+import json
+import zlib
+import pickle
+import struct
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Layout of a snapshot file:
+#   magic | format version | length of the fingerprint | fingerprint |
+#   crc32 of the payload | pickled payload
+# The format version must be increased whenever the layout or the pickled
+# classes change incompatibly.
+MAGIC = b"AQQUSNAP"
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct("<8sII")
+CHECKSUM = struct.Struct("<I")
+
+
+def get_source_fingerprint(source_files, **params):
+    """Get a fingerprint of the given source files from their paths, sizes
+    and modification times. A snapshot is only valid for the fingerprint it
+    was built with.
+
+    Arguments:
+    source_files - paths of the files the mappings are built from
+    params - further parameters the mappings depend on
+    """
+    sources = []
+    for path in source_files:
+        stat = os.stat(path)
+        sources.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+    description = json.dumps({"sources": sources, "params": params},
+                             sort_keys=True)
+    return hashlib.sha256(description.encode("utf8")).hexdigest()
+
+
+def read_snapshot(snapshot_file, fingerprint):
+    """Read the mappings from the given snapshot file. Return None if the
+    file does not exist, has another format version, was built from other
+    source files, is corrupt or can not be unpickled.
+
+    Arguments:
+    snapshot_file - path to the snapshot file
+    fingerprint - the fingerprint of the current source files
+    """
+    try:
+        with open(snapshot_file, "rb") as file:
+            header = file.read(HEADER.size)
+            magic, version, fingerprint_len = HEADER.unpack(header)
+            if magic != MAGIC or version != SNAPSHOT_VERSION:
+                logger.info("Snapshot %s has an outdated format"
+                            % snapshot_file)
+                return None
+            if file.read(fingerprint_len).decode("ascii") != fingerprint:
+                logger.info("Snapshot %s is outdated" % snapshot_file)
+                return None
+            checksum, = CHECKSUM.unpack(file.read(CHECKSUM.size))
+            payload = file.read()
+    except FileNotFoundError:
+        logger.info("No snapshot %s found" % snapshot_file)
+        return None
+    except (OSError, struct.error, UnicodeDecodeError) as e:
+        logger.warning("Could not read snapshot %s: %s" % (snapshot_file, e))
+        return None
+
+    if zlib.crc32(payload) != checksum:
+        logger.warning("Snapshot %s is corrupt" % snapshot_file)
+        return None
+    try:
+        return pickle.loads(payload)
+    except Exception as e:
+        # Unpickling fails with all kinds of errors, e.g. an AttributeError
+        # if a pickled class was renamed without increasing the version
+        logger.warning("Could not unpickle snapshot %s: %r"
+                       % (snapshot_file, e))
+        return None
+
+
+def write_snapshot(snapshot_file, fingerprint, mappings):
+    """Write the given mappings to the snapshot file. The file is replaced
+    atomically, so concurrently starting servers never read a partial
+    snapshot.
+
+    Arguments:
+    snapshot_file - path to the snapshot file
+    fingerprint - the fingerprint of the source files of the mappings
+    mappings - dictionary from mapping name to picklable mapping
+    """
+    logger.info("Write snapshot %s" % snapshot_file)
+    payload = pickle.dumps(mappings, protocol=pickle.HIGHEST_PROTOCOL)
+    fingerprint = fingerprint.encode("ascii")
+    tmp_file = "%s.%d.tmp" % (snapshot_file, os.getpid())
+    try:
+        with open(tmp_file, "wb") as file:
+            file.write(HEADER.pack(MAGIC, SNAPSHOT_VERSION, len(fingerprint)))
+            file.write(fingerprint)
+            file.write(CHECKSUM.pack(zlib.crc32(payload)))
+            file.write(payload)
+        os.replace(tmp_file, snapshot_file)
+    except OSError as e:
+        logger.warning("Could not write snapshot %s: %s" % (snapshot_file, e))
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
@@ -0,0 +1,251 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(names, values, extra=""):
+    """Format the given label names and values as in the Prometheus text
+    format, e.g. '{route="/qac",status="200"}'.
+
+    Arguments:
+    names - the label names
+    values - the label values in the same order
+    extra - an already formatted label to append, e.g. 'le="0.5"'
+    """
+    labels = ['%s="%s"' % (name, str(value).replace("\\", "\\\\")
+                           .replace('"', '\\"').replace("\n", "\\n"))
+              for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{%s}" % ",".join(labels) if labels else ""
+
+
+def format_value(value):
+    """Format the given sample value as in the Prometheus text format.
+    """
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base class of a metric with a fixed set of label names. Samples are
+    kept per combination of label values.
+    """
+    type = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        """Create a new metric.
+
+        Arguments:
+        name - the metric name
+        help - description of the metric
+        labels - the label names
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Labels with the same value for all samples, see
+        # Registry.set_constant_labels()
+        self.constant_labels = dict()
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels):
+        """Get the values of the given label keyword arguments in the order
+        of the label names.
+        """
+        if set(labels) != set(self.labels):
+            raise ValueError("Metric %s expects the labels %s"
+                             % (self.name, ", ".join(self.labels)))
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def format_labels(self, values, extra=""):
+        """Format the constant labels and the labels with the given values,
+        see format_labels().
+        """
+        return format_labels(tuple(self.constant_labels) + self.labels,
+                             tuple(self.constant_labels.values()) + values,
+                             extra)
+
+    def render(self):
+        """Get the metric in the Prometheus text format.
+        """
+        lines = ["# HELP %s %s" % (self.name, self.help),
+                 "# TYPE %s %s" % (self.name, self.type)]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+    def samples(self):
+        """Get the sample lines of the metric.
+        """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """A counter that only goes up, e.g. the number of requests.
+    """
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = dict()
+
+    def inc(self, amount=1, **labels):
+        """Increase the counter for the given label values.
+        """
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return ["%s%s %s" % (self.name, self.format_labels(key),
+                             format_value(value))
+                for key, value in values]
+
+
+class Histogram(Metric):
+    """A histogram of observed values, e.g. request latencies in seconds.
+    """
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        """Create a new histogram.
+
+        Arguments:
+        name - the metric name
+        help - description of the metric
+        labels - the label names
+        buckets - sorted upper bounds of the buckets
+        """
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # Mapping from label values to [bucket counts, sum, count]. The
+        # counts are not cumulative, the last count is for +Inf.
+        self._values = dict()
+
+    def observe(self, value, **labels):
+        """Add an observed value for the given label values.
+        """
+        key = self._label_values(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1),
+                                             0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the time in seconds the with block takes for the given
+        label values.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total, count))
+                            for key, (counts, total, count)
+                            in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),),
+                                           counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % format_value(bound)
+                lines.append("%s_bucket%s %d" % (
+                    self.name, self.format_labels(key, le), cumulative))
+            labels = self.format_labels(key)
+            lines.append("%s_sum%s %s" % (self.name, labels,
+                                          format_value(total)))
+            lines.append("%s_count%s %d" % (self.name, labels, count))
+        return lines
+
+
+class CallbackMetric(Metric):
+    """A metric whose samples are collected when the metrics are rendered,
+    e.g. the current size of a cache.
+    """
+
+    def __init__(self, name, help, type, labels, collect):
+        """Create a new callback metric.
+
+        Arguments:
+        name - the metric name
+        help - description of the metric
+        type - "gauge" or "counter"
+        labels - the label names
+        collect - function that returns a list of (label values, value)
+                  tuples
+        """
+        super().__init__(name, help, labels)
+        self.type = type
+        self.collect = collect
+
+    def samples(self):
+        return ["%s%s %s" % (self.name, self.format_labels(tuple(key)),
+                             format_value(value))
+                for key, value in self.collect()]
+
+
+class Registry:
+    """A collection of metrics that can be rendered in the Prometheus text
+    format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._constant_labels = dict()
+
+    def register(self, metric):
+        """Add the given metric to the registry and return it.
+        """
+        metric.constant_labels = self._constant_labels
+        self._metrics.append(metric)
+        return metric
+
+    def set_constant_labels(self, **labels):
+        """Add the given labels to all samples of the registered metrics,
+        e.g. worker="2" to tell the samples of the worker processes apart.
+        Constant labels come before the labels of the metric.
+        """
+        self._constant_labels.update(
+            (name, str(value)) for name, value in labels.items())
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, type, labels, collect):
+        return self.register(CallbackMetric(name, help, type, labels,
+                                            collect))
+
+    def render(self):
+        """Get all metrics in the Prometheus text format.
+        """
+        return "".join(metric.render() + "\n" for metric in self._metrics)
@@ -0,0 +1,275 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import sys
+import bisect
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Characters of a Freebase MID after the "m." or "g." prefix
+MID_ALPHABET = "0123456789bcdfghjklmnpqrstvwxyz_"
+MID_CHAR_CODES = {c: i + 1 for i, c in enumerate(MID_ALPHABET)}
+MID_PREFIX_CODES = {"m.": 1, "g.": 2}
+MID_BASE = len(MID_ALPHABET) + 1
+# Longest MID suffix whose code still fits into an unsigned 64 bit integer
+MAX_MID_SUFFIX_LENGTH = 12
+
+
+def encode_mid(mid):
+    """Encode a Freebase MID like "m.0abc1" as integer or return None if the
+    MID can not be encoded. Different MIDs get different codes.
+
+    Arguments:
+    mid - the MID string
+    """
+    prefix_code = MID_PREFIX_CODES.get(mid[:2])
+    if prefix_code is None or not 0 < len(mid) - 2 <= MAX_MID_SUFFIX_LENGTH:
+        return None
+    code = prefix_code
+    for c in mid[2:]:
+        char_code = MID_CHAR_CODES.get(c)
+        if char_code is None:
+            return None
+        code = code * MID_BASE + char_code
+    return code
+
+
+def encode_qid(qid):
+    """Encode a lower case QID like "q42" as integer or return None if the
+    QID can not be encoded, i.e. "q%d" % encode_qid(qid) == qid.
+
+    Arguments:
+    qid - the QID string
+    """
+    digits = qid[1:]
+    if (qid[:1] == "q" and digits.isascii() and digits.isdigit()
+            and digits[0] != "0"):
+        return int(digits)
+    return None
+
+
+def encode_pairs(pairs):
+    """Encode the given (MID, QID) pairs as integers. Return an array of the
+    MID codes and an array of the QID codes of the pairs that can be
+    encoded, and a list of the other pairs as (position, MID, QID) tuples.
+    The position of a pair is the number of encodable pairs before it.
+
+    Arguments:
+    pairs - iterable over (MID, QID) tuples
+    """
+    mids = array("Q")
+    qids = array("Q")
+    overflow = []
+    for mid, qid in pairs:
+        mid_code = encode_mid(mid)
+        qid_code = encode_qid(qid)
+        if mid_code is None or qid_code is None:
+            overflow.append((len(mids), mid, qid))
+        else:
+            mids.append(mid_code)
+            qids.append(qid_code)
+    return mids, qids, overflow
+
+
+def sort_pairs_numpy(mids, qids, qid_type, overridden):
+    """Sort the given parallel arrays of MID and QID codes by MID with NumPy
+    and keep only the last pair of each MID that is not overridden. Return
+    the sorted MID array and the QID array of the given type. Unlike
+    sorting a list of positions, this needs no Python object per pair.
+
+    Arguments:
+    mids - array of MID codes
+    qids - array of QID codes
+    qid_type - type code of the returned QID array
+    overridden - set of MID codes to leave out
+    """
+    np_mids = numpy.frombuffer(mids, dtype=numpy.uint64)
+    # The sort is stable, so for duplicate MIDs the last pair is the last in
+    # its run
+    order = numpy.argsort(np_mids, kind="stable")
+    sorted_mids = np_mids[order]
+    keep = numpy.ones(len(sorted_mids), dtype=bool)
+    keep[:-1] = sorted_mids[1:] != sorted_mids[:-1]
+    if overridden:
+        keep &= ~numpy.isin(sorted_mids, numpy.fromiter(
+            overridden, dtype=numpy.uint64, count=len(overridden)))
+    order = order[keep]
+    # Copy the results into arrays without intermediate bytes objects
+    result_mids = array("Q")
+    result_mids.frombytes(memoryview(sorted_mids[keep]).cast("B"))
+    del sorted_mids, keep
+    result_qids = array(qid_type)
+    result_qids.frombytes(memoryview(numpy.frombuffer(
+        qids, dtype=numpy.uint64)[order].astype(
+            numpy.dtype(qid_type))).cast("B"))
+    return result_mids, result_qids
+
+
+class MidToQidTable:
+    """Compact MID to QID mapping. MIDs and QIDs are stored as integers in
+    two parallel arrays sorted by MID. Pairs that can not be encoded as
+    integers are kept in a small dictionary. Supports the read-only
+    dictionary operations used by the server plus get_many() for looking up
+    many MIDs at once.
+    """
+
+    def __init__(self, pairs):
+        """Build the table from the given (MID, QID) pairs. As for a
+        dictionary, later pairs win over earlier pairs with the same MID.
+
+        Arguments:
+        pairs - iterable over (MID, QID) tuples
+        """
+        self._build([encode_pairs(pairs)])
+
+    @classmethod
+    def from_encoded(cls, chunks):
+        """Build the table from consecutive chunks of pairs that were
+        encoded with encode_pairs(), e.g. in several processes. The result
+        is the same as for the concatenated pairs.
+
+        Arguments:
+        chunks - iterable over the results of encode_pairs()
+        """
+        table = cls.__new__(cls)
+        table._build(chunks)
+        return table
+
+    def _build(self, chunks):
+        mids = array("Q")
+        qids = array("Q")
+        self._overflow = dict()
+        # Codes of the encodable MIDs in the overflow dictionary
+        overflow_codes = dict()
+        for chunk_mids, chunk_qids, chunk_overflow in chunks:
+            mids.extend(chunk_mids)
+            qids.extend(chunk_qids)
+            # Replay the overflow pairs between the encodable pairs
+            start = 0
+            for position, mid, qid in chunk_overflow + [(len(chunk_mids),
+                                                         None, None)]:
+                # A later encodable pair overrides an overflow pair
+                if overflow_codes and position > start:
+                    codes = set(chunk_mids[start:position])
+                    for code in overflow_codes.keys() & codes:
+                        del self._overflow[overflow_codes.pop(code)]
+                if mid is not None:
+                    self._overflow[mid] = qid
+                    mid_code = encode_mid(mid)
+                    if mid_code is not None:
+                        overflow_codes[mid_code] = mid
+                start = position
+
+        # MIDs whose last pair is in the overflow dictionary
+        overridden = set(overflow_codes)
+        qid_type = "I" if not qids or max(qids) < 2 ** 32 else "Q"
+        if numpy is not None:
+            self._mids, self._qids = sort_pairs_numpy(mids, qids, qid_type,
+                                                      overridden)
+            del mids, qids, overridden
+            self._create_numpy_views()
+            return
+
+        # Sort by MID. The sort is stable, so for duplicate MIDs the last
+        # pair is the last in its run.
+        order = sorted(range(len(mids)), key=mids.__getitem__)
+        self._mids = array("Q")
+        self._qids = array(qid_type)
+        for i in order:
+            if mids[i] in overridden:
+                continue
+            if self._mids and self._mids[-1] == mids[i]:
+                self._qids[-1] = qids[i]
+            else:
+                self._mids.append(mids[i])
+                self._qids.append(qids[i])
+        del order, mids, qids, overridden
+        self._create_numpy_views()
+
+    def __getstate__(self):
+        # The NumPy views are recreated after unpickling
+        return self._mids, self._qids, self._overflow
+
+    def __setstate__(self, state):
+        self._mids, self._qids, self._overflow = state
+        self._create_numpy_views()
+
+    @property
+    def nbytes(self):
+        """Approximate memory footprint of the table in bytes.
+        """
+        overflow_size = sys.getsizeof(self._overflow) + sum(
+            sys.getsizeof(k) + sys.getsizeof(v)
+            for k, v in self._overflow.items())
+        return (self._mids.itemsize * len(self._mids)
+                + self._qids.itemsize * len(self._qids) + overflow_size)
+
+    def __len__(self):
+        return len(self._mids) + len(self._overflow)
+
+    def __contains__(self, mid):
+        return self.get(mid) is not None
+
+    def __getitem__(self, mid):
+        qid = self.get(mid)
+        if qid is None:
+            raise KeyError(mid)
+        return qid
+
+    def get(self, mid, default=None):
+        """Return the QID for the given MID or the default value if the MID
+        is not in the table.
+        """
+        if mid in self._overflow:
+            return self._overflow[mid]
+        code = encode_mid(mid) if isinstance(mid, str) else None
+        if code is None:
+            return default
+        i = bisect.bisect_left(self._mids, code)
+        if i < len(self._mids) and self._mids[i] == code:
+            return "q%d" % self._qids[i]
+        return default
+
+    def get_many(self, mids):
+        """Look up all given MIDs at once. Return a list with the QID of each
+        MID or None for MIDs that are not in the table. Uses a vectorized
+        binary search if NumPy is available.
+
+        Arguments:
+        mids - list of MID strings
+        """
+        if numpy is None or not self._mids:
+            return [self.get(mid) for mid in mids]
+
+        codes = [encode_mid(mid) if isinstance(mid, str) else None
+                 for mid in mids]
+        np_codes = numpy.array([code or 0 for code in codes],
+                               dtype=numpy.uint64)
+        positions = numpy.searchsorted(self._np_mids, np_codes)
+        positions = numpy.minimum(positions, len(self._mids) - 1)
+        found = self._np_mids[positions] == np_codes
+        qids = self._np_qids[positions].tolist()
+
+        result = []
+        for mid, code, is_found, qid in zip(mids, codes, found.tolist(),
+                                            qids):
+            if mid in self._overflow:
+                result.append(self._overflow[mid])
+            elif code is not None and is_found:
+                result.append("q%d" % qid)
+            else:
+                result.append(None)
+        return result
+
+    def _create_numpy_views(self):
+        """Create NumPy views on the arrays for vectorized lookups.
+        """
+        if numpy is not None:
+            self._np_mids = numpy.frombuffer(self._mids, dtype=numpy.uint64)
+            self._np_qids = numpy.frombuffer(
+                self._qids, dtype=numpy.dtype(self._qids.typecode))
@@ -0,0 +1,223 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import os
+import gc
+import time
+import socket
+import signal
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Interval in seconds in which the master checks for exited workers
+POLL_INTERVAL = 0.5
+
+
+def create_listening_socket(host, port, backlog=1024):
+    """Create a socket that listens on the given host and port and can be
+    shared by several worker processes.
+
+    Arguments:
+    host - the host to bind to, e.g. "::"
+    port - the port to bind to
+    backlog - maximum number of pending connections
+    """
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if family == socket.AF_INET6:
+        # Also accept IPv4 connections as app.run(host="::") does
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+    sock.bind((host, int(port)))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class PreforkServer:
+    """Master process that forks a number of worker processes which all
+    accept connections on the same listening socket. Everything the master
+    loaded before starting the workers (e.g. the mappings) is shared with
+    the workers copy-on-write.
+
+    Signals handled by the master:
+    SIGHUP - gracefully restart all workers without reloading the data
+    SIGUSR1 - reload the data in the master and then gracefully restart all
+              workers, if a reload_data function is given
+    SIGTERM, SIGINT - gracefully stop all workers and exit
+    """
+
+    def __init__(self, sock, num_workers, serve_worker, reload_data=None,
+                 worker_socks=None):
+        """Create a new pre-fork server.
+
+        Arguments:
+        sock - the listening socket
+        num_workers - number of worker processes
+        serve_worker - function that is called in each worker process with
+                       the list of listening sockets of the worker and the
+                       number of the worker and serves requests until the
+                       worker receives SIGTERM. The workers are numbered
+                       from 0 to num_workers - 1 and a replaced worker gets
+                       the number of the worker it replaces.
+        reload_data - function that reloads the data shared with the
+                      workers. It is called in a background thread of the
+                      master while the old workers keep serving requests.
+        worker_socks - optional list with a listening socket for each worker
+                       number on which only the worker with that number
+                       accepts connections, in addition to the shared socket
+        """
+        self.sock = sock
+        self.num_workers = num_workers
+        self.serve_worker = serve_worker
+        self.reload_data = reload_data
+        self.worker_socks = worker_socks
+        # Mapping from the process id to the number of each worker
+        self.workers = dict()
+        self._restart = False
+        self._reload = False
+        self._reload_thread = None
+        self._stop = False
+
+    def run(self):
+        """Start the workers and supervise them until the master is stopped.
+        """
+        # Move all objects loaded so far into a permanent generation so that
+        # the garbage collector of the workers does not touch (and thereby
+        # copy) their memory pages
+        gc.freeze()
+
+        signal.signal(signal.SIGHUP, self._handle_restart)
+        signal.signal(signal.SIGUSR1, self._handle_reload)
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+
+        logger.info("Start %d workers" % self.num_workers)
+        self._spawn_workers()
+        while not self._stop:
+            if self._reload:
+                self._reload = False
+                self._start_reload()
+            if self._restart:
+                self._restart = False
+                self.restart_workers()
+            self._reap_workers()
+            time.sleep(POLL_INTERVAL)
+
+        logger.info("Stop workers")
+        self._stop_workers(self.workers)
+        self.sock.close()
+        for sock in self.worker_socks or []:
+            sock.close()
+
+    def restart_workers(self):
+        """Replace all workers by new workers. The old workers finish their
+        requests in flight before they exit.
+        """
+        logger.info("Restart workers")
+        # Freeze objects loaded since the last start, e.g. reloaded data
+        gc.freeze()
+        old_workers = self.workers
+        self.workers = dict()
+        self._spawn_workers()
+        self._stop_workers(old_workers)
+
+    def _start_reload(self):
+        """Reload the data in a background thread and restart the workers
+        once the data is reloaded.
+        """
+        if self.reload_data is None:
+            logger.warning("Ignore reload, no reload function given")
+            return
+        if self._reload_thread is not None and self._reload_thread.is_alive():
+            logger.warning("Ignore reload, the data is already being reloaded")
+            return
+
+        def reload():
+            logger.info("Reload data")
+            try:
+                self.reload_data()
+            except Exception:
+                logger.exception("Reloading the data failed, keep the"
+                                 " current workers")
+                return
+            self._restart = True
+
+        self._reload_thread = threading.Thread(target=reload, daemon=True)
+        self._reload_thread.start()
+
+    def _spawn_workers(self):
+        """Fork workers for all worker numbers without a worker.
+        """
+        numbers = set(self.workers.values())
+        for number in range(self.num_workers):
+            if number in numbers:
+                continue
+            pid = os.fork()
+            if pid == 0:
+                self._run_worker(number)
+            self.workers[pid] = number
+
+    def _run_worker(self, number):
+        """Serve requests in a forked worker process. Never returns.
+
+        Arguments:
+        number - the number of the worker
+        """
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            socks = [self.sock]
+            if self.worker_socks:
+                socks.append(self.worker_socks[number])
+            self.serve_worker(socks, number)
+        except BaseException:
+            logger.exception("Worker %d failed" % os.getpid())
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def _reap_workers(self):
+        """Collect exited worker processes and replace crashed workers.
+        """
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.workers:
+                logger.warning("Worker %d exited unexpectedly with status %d"
+                               % (pid, status))
+                del self.workers[pid]
+                self._spawn_workers()
+
+    def _stop_workers(self, workers):
+        """Send SIGTERM to the given workers and wait until they exited.
+        """
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+    def _handle_restart(self, signum, frame):
+        self._restart = True
+
+    def _handle_reload(self, signum, frame):
+        self._reload = True
+
+    def _handle_stop(self, signum, frame):
+        self._stop = True
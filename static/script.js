@@ -6,6 +6,8 @@
 var basePath = window.location.pathname.replace(/\/$/, "") + "/";
 
 var URL_PREFIX_QAC = basePath + "qac?q=";
+var URL_QAC_SOCKET = (window.location.protocol == "https:" ? "wss://" : "ws://")
+                     + window.location.host + basePath + "qac/ws";
 var COMPLETION_SELECTED_COLOR = "#C7D3DF";
 
 var selectedButton = 0;
@@ -13,6 +15,16 @@ var lastResultLen = 0;
 var lastMousePositionX = 0;
 var lastMousePositionY = 0;
 var maxTimestamp = 0;
+// Identifies the requests of this page so that the server can drop requests
+// that were superseded by a newer request
+var clientId = Math.random().toString(36).substring(2);
+// WebSocket over which question prefixes are sent and completions received.
+// Completions are requested via HTTP while the socket is not open or if the
+// server does not support WebSockets.
+var qacSocket = null;
+var qacSocketFailed = false;
+// Question prefix and time stamp of the latest request sent over the socket
+var qacSocketRequest = null;
 var showCompletions = true;
 
 // Regexes
@@ -21,15 +33,27 @@ var inputEntityOriginalRegex = /<span class="entity[^>]*data-original="(.*?)"[^>
 var inputEntityQidRegex = /<span class="entity[^>]*data-qid="(.*?)"[^>]*>[^<]*?<\/span>/g
 
 // Mouseover variables
-var URL_PREFIX_TOOLTIP = basePath + "tooltip?qid=";
+var URL_PREFIX_TOOLTIPS = basePath + "tooltips?qids=";
+// Image and abstract of the entities received from the server by QID
+var tooltipInfo = {};
 
 // ---------------------- Aqqu related variables ------------------------------
 var MAX_RESULTS = 10;
 var URL_PREFIX_AQQU = basePath;
+var URL_PREFIX_RESULT = basePath + "result";
+var URL_PREFIX_ANSWERS = basePath + "answers";
 
 var currIndex = -1;
 var numAnswers = 0;
 var currAnswers = [];
+var interpretations = [];
+// Answers of each candidate received so far and the total number of answers
+// of each candidate. The server might only send the answers of the top
+// candidates from /result. The others are requested from /answers.
+var loadedAnswers = [];
+var answerCounts = [];
+// Repeats the last /answers request that failed
+var retryAnswers = null;
 
 // ---------------------- QAC related functions -------------------------------
 /* Remove all tags that are not <span>-tags. Otherwise, tags could be introduced
@@ -325,53 +349,106 @@ function getCompletions() {
     question = getQidQuestion(question, qids);
   }
 
+  // Get completions for the current prefix from the server
+  var timestamp = Date.now();
+  if (qacSocket != null && qacSocket.readyState == WebSocket.OPEN) {
+    qacSocketRequest = {"q": question, "t": timestamp};
+    qacSocket.send(JSON.stringify(qacSocketRequest));
+    return;
+  }
+  openQacSocket();
+  requestCompletions(question, timestamp);
+}
+
+
+/* Get completions for the given question prefix via HTTP */
+function requestCompletions(question, timestamp) {
   // Globally replace whitespaces with %20 otherwise trailing whitespaces are stripped
   question = encodeURI(question);
+  var url = URL_PREFIX_QAC + question + "&t=" + timestamp + "&c=" + clientId;
+  $.getJSON(url, displayCompletions);
+}
 
-  // Get completions for the current prefix from the server
-  var url = URL_PREFIX_QAC + question + "&t=" + Date.now();
-  $.getJSON(url, function(jsonObj) {
-    // Bail early if the result is empty
-    if (jsonObj.length == 0) return;
-
-    var results = jsonObj["results"];
-    var timestamp = jsonObj["timestamp"];
 
-    // Check if a more recent request has been received already
-    if (timestamp < maxTimestamp) {
+/* Open the WebSocket for completions unless it is open already or the server
+ * does not support it */
+function openQacSocket() {
+  if (qacSocket != null || qacSocketFailed || !window.WebSocket) return;
+  var socket = new WebSocket(URL_QAC_SOCKET);
+  var opened = false;
+  socket.onopen = function() {
+    opened = true;
+  };
+  socket.onmessage = function(event) {
+    var jsonObj = JSON.parse(event.data);
+    if ("error" in jsonObj) {
+      // The server could not answer the latest prefix over the socket
+      if (qacSocketRequest != null && jsonObj["timestamp"] == qacSocketRequest["t"]) {
+        requestCompletions(qacSocketRequest["q"], qacSocketRequest["t"]);
+      }
       return;
     }
-    maxTimestamp = timestamp;
-
-    // Remove old completion buttons
-    removeCompletionButtons(results.length);
-
-    // Add the new buttons displaying the results sent by the server.
-    for (i=0; i < results.length; i++) {
-      var completion = results[i]["completion"];
-      var wiki_completion = results[i]["wikified_completion"];
-      var alias = results[i]["matched_alias"];
-      var qids = results[i]["qids"];
-      var urls = results[i]["urls"];
-      var buttonHtml = addAlias(wiki_completion, alias);
-      buttonHtml = putTextIntoSpans(buttonHtml);
-      $("<button/>", {
-        class: "comp_buttons",
-        id: "button" + i,
-        onClick: "handleCompletionButtonClick(this.id)",
-        onmousemove: "handleMouseOver(this.id, event)",
-        html: buttonHtml,
-      }).appendTo("#completions");
-
-      $("#button"+i).data("qids", qids);
-      $("#button"+i).data("urls", urls);
-      $("#button"+i).data("original", completion);
-      $("#button"+i).css("background-color", "white");
-    }
+    displayCompletions(jsonObj);
+  };
+  socket.onclose = function() {
+    // Fall back to HTTP for good if the socket could never be opened.
+    // Otherwise reconnect with the next request.
+    if (!opened) qacSocketFailed = true;
+    qacSocket = null;
+  };
+  qacSocket = socket;
+}
 
-    // Set the color of the first button to "selected"
-    $("#button0").css("background-color", COMPLETION_SELECTED_COLOR);
-  })
+
+/* Display the completions received from the server */
+function displayCompletions(jsonObj) {
+  // Bail early if the result is empty
+  if (jsonObj.length == 0) return;
+
+  var results = jsonObj["results"];
+  var timestamp = jsonObj["timestamp"];
+
+  // Check if a more recent request has been received already
+  if (timestamp < maxTimestamp) {
+    return;
+  }
+  maxTimestamp = timestamp;
+
+  // Remove old completion buttons
+  removeCompletionButtons(results.length);
+
+  // Add the new buttons displaying the results sent by the server.
+  for (i=0; i < results.length; i++) {
+    var completion = results[i]["completion"];
+    var wiki_completion = results[i]["wikified_completion"];
+    var alias = results[i]["matched_alias"];
+    var qids = results[i]["qids"];
+    var urls = results[i]["urls"];
+    var buttonHtml = addAlias(wiki_completion, alias);
+    buttonHtml = putTextIntoSpans(buttonHtml);
+    $("<button/>", {
+      class: "comp_buttons",
+      id: "button" + i,
+      onClick: "handleCompletionButtonClick(this.id)",
+      onmousemove: "handleMouseOver(this.id, event)",
+      html: buttonHtml,
+    }).appendTo("#completions");
+
+    $("#button"+i).data("qids", qids);
+    $("#button"+i).data("urls", urls);
+    $("#button"+i).data("original", completion);
+    $("#button"+i).css("background-color", "white");
+  }
+
+  // Set the color of the first button to "selected"
+  $("#button0").css("background-color", COMPLETION_SELECTED_COLOR);
+
+  // Fetch the tooltips for all entities in the completions at once
+  var completionQids = [];
+  for (result of results) {
+    completionQids = completionQids.concat(result["qids"]);
+  }
+  prefetchTooltips(completionQids);
 }
 
 
@@ -479,17 +556,42 @@ function showTooltip(el, event) {
 }
 
 
-/* Get abstract and image url for the given QID from server */
-function createTooltip(qid) {
-  var url = URL_PREFIX_TOOLTIP + qid;
+/* Get abstract and image url for all given QIDs that were not received yet
+ * from the server in a single request. Call the callback once the information
+ * for all QIDs is available. */
+function prefetchTooltips(qids, callback) {
+  var missingQids = [];
+  for (qid of qids) {
+    if (qid != "" && !(qid in tooltipInfo) && !missingQids.includes(qid)) {
+      missingQids.push(qid);
+    }
+  }
+  if (missingQids.length == 0) {
+    if (callback) callback();
+    return;
+  }
+
+  // Sort QIDs so that the same set of QIDs always results in the same url
+  // which can be cached by the browser
+  missingQids.sort();
+  var url = URL_PREFIX_TOOLTIPS + missingQids.join(",");
   $.getJSON(url, function(jsonObj) {
-    // Bail early if the result is empty
-    if (jsonObj.length == 0) return;
+    for (qid in jsonObj) {
+      tooltipInfo[qid] = jsonObj[qid];
+    }
+    if (callback) callback();
+  });
+}
+
 
-    // Get necessary information for tooltip from json response
-    var image = jsonObj["image"];
-    var abstract = jsonObj["abstract"];
-    createTooltipNode(qid, image, abstract, ".question");
+/* Create the tooltip for the given QID with abstract and image url from the
+ * server */
+function createTooltip(qid) {
+  prefetchTooltips([qid], function() {
+    // Get necessary information for tooltip
+    var info = tooltipInfo[qid];
+    if (info === undefined) return;
+    createTooltipNode(qid, info["image"], info["abstract"], ".question");
   });
 }
 
@@ -579,11 +681,28 @@ function hideTooltip(el) {
 
 // ---------------------- AQQU related functions ------------------------------
 
-/* Display the results returned by the Aqqu API */
-function displayAqquResults() {
-  var result = $(".answers").attr("data")
-  if (result) {
-    numAnswers = jQuery.parseJSON(result).length;
+/* Request the results of the Aqqu API for the question in the page url */
+function loadAqquResults() {
+  var question = new URLSearchParams(window.location.search);
+  var params = {q: question.get("q"), qids: question.get("qids") || ""};
+  $.getJSON(URL_PREFIX_RESULT, params, displayAqquResults)
+    .fail(function() {
+      displayAqquResults({"error": "No connection to the server"});
+    });
+}
+
+
+/* Display the interpretations and answers received from the server */
+function displayAqquResults(result) {
+  if (result["error"]) {
+    $("#result_message").text(result["error"]);
+  } else {
+    $("#result_message").css("display", "none");
+    $("#result_answers").css("display", "block");
+    interpretations = result["interpretations"];
+    loadedAnswers = result["answers"];
+    answerCounts = result["answer_counts"];
+    numAnswers = answerCounts.length;
 
     if (moveIndex(0) == true) {
       $("#caption").css("display", "block");
@@ -592,10 +711,10 @@ function displayAqquResults() {
       updateNavigationButtons();
       showCurrentResult(true);
     }
-
-    // Re-enable the submit button
-    $("#ask").prop('disabled', false);
   }
+
+  // Re-enable the submit button
+  $("#ask").prop('disabled', false);
 }
 
 
@@ -622,6 +741,9 @@ function showCurrentResult(firstResult) {
     $('body').removeClass("less_results");
     // Hide "no answer for this interpretation"-paragraph
     $("#no_answer").css("display", "none");
+    // Hide the error of a failed answers request of the previous result
+    $("#answer_error").css("display", "none");
+    retryAnswers = null;
     // Remove previous answer paragraphs
     $(".answer_fields").remove();
     $(".answers").find(".tooltip").remove();
@@ -640,21 +762,75 @@ function showCaption(index) {
 }
 
 
+/* Request the next answers of the candidate with the given index from the
+ * server and call the callback once they are received */
+function loadAnswers(index, callback) {
+  var question = new URLSearchParams(window.location.search);
+  var params = {
+    q: question.get("q"),
+    qids: question.get("qids") || "",
+    candidate: index,
+    start: loadedAnswers[index].length
+  };
+  $.getJSON(URL_PREFIX_ANSWERS, params, function(answers) {
+    // Ignore the answers if the user navigated to another question
+    if (answers.length > 0 && params.start == loadedAnswers[index].length) {
+      loadedAnswers[index] = loadedAnswers[index].concat(answers);
+    }
+    callback();
+  })
+    .fail(function() {
+      // Let the user retry unless they navigated to another candidate
+      if (currIndex != index) return;
+      retryAnswers = function() {
+        loadAnswers(index, callback);
+      };
+      $("#answer_error").css("display", "block");
+    });
+}
+
+
+/* Request the answers again after a failed request (handle click on
+ * retry-button) */
+function retryLoadAnswers() {
+  $("#answer_error").css("display", "none");
+  if (retryAnswers != null) {
+    var retry = retryAnswers;
+    retryAnswers = null;
+    retry();
+  }
+}
+
+
 /* Show the answer fields for the current index */
 function showAnswers(index) {
-  // Get data from html div
-  var result = $(".answers").attr("data")
-  currAnswers = jQuery.parseJSON(result)[index];
+  while (loadedAnswers.length <= index) {
+    loadedAnswers.push([]);
+  }
+  currAnswers = loadedAnswers[index];
+
+  // Request the first answers if they were not received yet
+  var numShown = Math.min(answerCounts[index], MAX_RESULTS);
+  if (currAnswers.length < numShown) {
+    loadAnswers(index, function() {
+      if (currIndex == index && loadedAnswers[index].length > currAnswers.length) {
+        showAnswers(index);
+      }
+    });
+    return;
+  }
 
   // Show an info message if there are no answers for this interpretation
   if (currAnswers.length == 0) {
     $("#no_answer").css("display","block");
   }
 
+  if (answerCounts[index] > MAX_RESULTS) {
+    $('body').addClass("more_results");
+  }
   for (j = 0; j < currAnswers.length; j++) {
     // Only show up to MAX_RESULTS results per interpretation
     if (j >= MAX_RESULTS ) {
-      $('body').addClass("more_results");
       break;
     }
     
@@ -674,9 +850,6 @@ function showAnswers(index) {
 
 /* Show the interpretation for the current index */
 function showInterpretation(index) {
-  // Get data from html p
-  var result = $("#interpretation").attr("data");
-  var interpretations = jQuery.parseJSON(result);
   var currInterpretation = interpretations[index];
 
   $('#interpretation').text(currInterpretation);
@@ -685,6 +858,18 @@ function showInterpretation(index) {
 
 /* Show more results (handle click on show-more-button) */
 function showMoreResults() {
+  // Request the remaining answers if they were not received yet
+  if (currAnswers.length < answerCounts[currIndex]) {
+    var index = currIndex;
+    loadAnswers(index, function() {
+      if (currIndex == index && loadedAnswers[index].length > currAnswers.length) {
+        currAnswers = loadedAnswers[index];
+        showMoreResults();
+      }
+    });
+    return;
+  }
+
   // Hide the "show_more"- button
   $("body").removeClass("more_results");
 
@@ -967,12 +1152,14 @@ $(document).ready(function(){
   var qidsdata = $("#qids").data("qids");
   $("#qids").val(qidsdata);
   var qids = qidsdata.split(",");
-  // Create tooltip for each QID
-  for (qid of qids) {
-    if (qid != "") {
-      createTooltip(qid);
+  // Create tooltip for each QID with a single request to the server
+  prefetchTooltips(qids, function() {
+    for (qid of qids) {
+      if (qid != "") {
+        createTooltip(qid);
+      }
     }
-  }
+  });
 
   // If a query exists already in the input field, put it into the right format
   var urls = $("#question").data("urls");
@@ -1013,13 +1200,10 @@ $(document).ready(function(){
   // remain disabled even on reload
   $("#ask").prop('disabled', false);
 
-  // Display Aqqu results if the result div exists and is completely loaded
-  var resultDiv = $(".result");
-  resultDiv.ready(function() {
-    if ($.contains(document.body, resultDiv[0])){
-      displayAqquResults();
-    }
-  });
+  // Request the Aqqu results if a question was asked
+  if ($(".result").length > 0) {
+    loadAqquResults();
+  }
 
   // Allow navigation of results with left & right arrow key (only when input
   // field does not have focus)
@@ -0,0 +1,85 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import urllib.request
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+REPO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_PATH)
+
+import aqqu_server  # noqa: E402
+import aqqu_server_async  # noqa: E402
+
+
+@pytest.fixture
+def args():
+    """Set up the module level caches and limits of both servers with the
+    default options and return the parsed options.
+    """
+    args = aqqu_server.get_argument_parser().parse_args(["8182"])
+    aqqu_server.create_caches(args)
+    aqqu_server.create_qac_limits(args)
+    return args
+
+
+def get_async(paths, headers=None):
+    """Send GET requests for the given paths to the async server one after
+    another and return the list of (status, body) tuples.
+
+    Arguments:
+    paths - the request paths
+    headers - optional headers of all requests
+    """
+    async def run():
+        client = TestClient(TestServer(aqqu_server_async.create_app()))
+        await client.start_server()
+        try:
+            responses = []
+            for path in paths:
+                response = await client.get(path, headers=headers)
+                responses.append((response.status, await response.text()))
+            return responses
+        finally:
+            await client.close()
+    return asyncio.run(run())
+
+
+def get_free_ports(num_ports):
+    """Get the first of num_ports consecutive ports that are not in use.
+    """
+    for _ in range(100):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        try:
+            for i in range(num_ports):
+                with socket.socket() as sock:
+                    sock.bind(("127.0.0.1", port + i))
+        except OSError:
+            continue
+        return port
+    raise OSError("No free ports found")
+
+
+def get_metrics(port, host="127.0.0.1", timeout=20):
+    """Get the metrics from the server on the given host and port once the
+    server is up.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            url = "http://%s:%d/metrics" % (host, port)
+            with urllib.request.urlopen(url) as response:
+                return response.read().decode("utf8")
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
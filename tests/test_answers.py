@@ -0,0 +1,47 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import json
+
+import pytest
+
+import aqqu_server
+import aqqu_server_async
+from conftest import get_async
+
+
+def get_answers_page(result, candidate, start, size):
+    return json.dumps([candidate, start, size])
+
+
+async def get_aqqu_result_async(app, question, qids):
+    return None
+
+
+@pytest.fixture
+def aqqu_api(args, monkeypatch):
+    """Replace the Aqqu API of both servers by a fake whose answer pages
+    consist of the requested candidate, start and size.
+    """
+    monkeypatch.setattr(aqqu_server, "get_aqqu_result",
+                        lambda question, qids: None)
+    monkeypatch.setattr(aqqu_server_async, "get_aqqu_result",
+                        get_aqqu_result_async)
+    monkeypatch.setattr(aqqu_server, "get_answers_page", get_answers_page)
+    monkeypatch.setattr(aqqu_server_async, "get_answers_page",
+                        get_answers_page)
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("candidate=2&start=5&size=10", [2, 5, 10]),
+    ("candidate=x&start=5", [0, 5, aqqu_server.MAX_ANSWERS_PAGE_SIZE]),
+    ("candidate=1&start=1.5&size=", [1, 0,
+                                     aqqu_server.MAX_ANSWERS_PAGE_SIZE]),
+])
+def test_both_servers_parse_parameters_alike(aqqu_api, query, expected):
+    path = "/answers?q=who&" + query
+    response = aqqu_server.app.test_client().get(path)
+    assert response.status_code == 200
+    assert json.loads(response.data) == expected
+    assert get_async([path]) == [(200, json.dumps(expected))]
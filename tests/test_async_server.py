@@ -0,0 +1,25 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import os
+import sys
+import subprocess
+
+from conftest import REPO_PATH, get_free_ports, get_metrics
+
+
+def test_server_accepts_ipv4_and_ipv6_connections(tmp_path):
+    (tmp_path / "mid_to_qid15_combined.tsv").write_text("m.0abc\tq42\n")
+    (tmp_path / "qid_to_wikipedia_info.tsv").write_text("q42\tA\tB\tC\n")
+    port = get_free_ports(1)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_PATH, "aqqu_server_async.py"),
+         str(port), "-d", str(tmp_path)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        assert get_metrics(port, "127.0.0.1")
+        assert get_metrics(port, "[::1]")
+    finally:
+        process.terminate()
+        process.wait(10)
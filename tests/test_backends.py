@@ -0,0 +1,215 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+import pytest
+
+import aqqu_server_async
+import backends
+from backends import Backend, AsyncBackend, CircuitBreaker, NoReplicaError
+from connection_pool import ConnectionPool
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answer every GET request with the status and body of the server.
+    """
+    protocol_version = "HTTP/1.1"
+    # Send the headers and the body in one packet
+    wbufsize = 64 * 1024
+
+    def do_GET(self):
+        body = self.server.body
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(status, body):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.status = status
+    server.body = body
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def replicas():
+    """Start a replica that answers with status 500 and a healthy replica.
+    Return their (host, port) addresses.
+    """
+    failing = start_stub(500, b"error")
+    healthy = start_stub(200, b"ok")
+    yield [failing.server_address, healthy.server_address]
+    failing.shutdown()
+    healthy.shutdown()
+
+
+def test_server_errors_fail_over_and_open_the_circuit(replicas):
+    backend = Backend("aqqu", replicas, failure_threshold=3,
+                      create_pool=lambda host, port: ConnectionPool(
+                          host, port, size=2))
+    # Ties between the replicas are broken randomly, so the failing replica
+    # gets enough of these requests to open its circuit
+    for _ in range(50):
+        assert backend.request("/") == b"ok"
+    failing = backend.replicas[0]
+    assert failing.failures == 3
+    assert failing.breaker.is_open
+    assert backend.retries["failover"] == 3
+
+
+def test_server_errors_fail_over_and_open_the_circuit_async(replicas):
+    backend = AsyncBackend("aqqu", replicas, failure_threshold=3)
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            async def send(host, port, path):
+                return await aqqu_server_async.fetch(session, host, port,
+                                                     path, "aqqu")
+            return [await backend.request(send, "/") for _ in range(50)]
+
+    assert asyncio.run(run()) == [b"ok"] * 50
+    failing = backend.replicas[0]
+    assert failing.failures == 3
+    assert failing.breaker.is_open
+    assert backend.retries["failover"] == 3
+
+
+class FakeTime:
+    """Replacement for the time module of the backends with a clock that
+    only moves when told to.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_circuit_opens_and_lets_one_trial_request_through(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(backends, "time", clock)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow() and not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open and not breaker.allow()
+    clock.now += 10
+    # Only one trial request, a cancelled trial allows another one
+    assert breaker.allow() and not breaker.allow()
+    breaker.cancel_trial()
+    assert breaker.allow()
+    # A failed trial opens the circuit again right away
+    breaker.record_failure()
+    assert not breaker.allow()
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open and breaker.allow() and breaker.allow()
+
+
+class SlowFirstReplica:
+    """Fake replicas of which the replica that gets the first request only
+    answers after the given delay. The other replicas answer right away
+    with their address.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.slow = None
+
+    def request(self, host, port):
+        if self.slow is None:
+            self.slow = (host, port)
+        if self.slow == (host, port):
+            time.sleep(self.delay)
+        return ("%s:%d" % (host, port)).encode("utf8")
+
+    async def request_async(self, host, port, path):
+        if self.slow is None:
+            self.slow = (host, port)
+        if self.slow == (host, port):
+            await asyncio.sleep(self.delay)
+        return ("%s:%d" % (host, port)).encode("utf8")
+
+
+class FakePool:
+    size = 1
+
+    def __init__(self, replicas, host, port):
+        self.replicas = replicas
+        self.host = host
+        self.port = port
+
+    def request(self, method, path, timeout):
+        return self.replicas.request(self.host, self.port)
+
+
+ADDRESSES = [("a", 1), ("b", 2)]
+
+
+def test_slow_requests_are_hedged():
+    replicas = SlowFirstReplica(delay=0.5)
+    backend = Backend("aqqu", ADDRESSES, hedge_delay=0.01,
+                      create_pool=lambda host, port: FakePool(
+                          replicas, host, port))
+    start = time.monotonic()
+    body = backend.request("/")
+    assert time.monotonic() - start < 0.4
+    assert body != ("%s:%d" % replicas.slow).encode("utf8")
+    assert backend.retries == {"hedge": 1, "failover": 0}
+
+
+def test_slow_requests_are_hedged_async():
+    replicas = SlowFirstReplica(delay=5)
+    backend = AsyncBackend("aqqu", ADDRESSES, hedge_delay=0.01)
+
+    async def run():
+        body = await backend.request(replicas.request_async, "/")
+        # The slow attempt is cancelled and not counted as failure
+        await asyncio.sleep(0)
+        return body
+
+    assert asyncio.run(run()) != ("%s:%d" % replicas.slow).encode("utf8")
+    assert backend.retries == {"hedge": 1, "failover": 0}
+    assert [r.outstanding for r in backend.replicas] == [0, 0]
+    assert [r.failures for r in backend.replicas] == [0, 0]
+
+
+def test_requests_give_up_after_the_deadline_async():
+    backend = AsyncBackend("aqqu", ADDRESSES, deadline=0.05)
+
+    async def never_answer(host, port, path):
+        await asyncio.sleep(5)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(backend.request(never_answer, "/"))
+    # There is no time left for a failover after the deadline
+    assert sum(r.failures for r in backend.replicas) == 1
+    assert backend.retries == {"hedge": 0, "failover": 0}
+
+
+def test_no_requests_are_sent_while_all_circuits_are_open():
+    backend = AsyncBackend("aqqu", ADDRESSES, failure_threshold=1)
+    for replica in backend.replicas:
+        replica.breaker.record_failure()
+
+    async def send(host, port, path):
+        raise AssertionError("Request sent to %s:%d" % (host, port))
+
+    with pytest.raises(NoReplicaError):
+        asyncio.run(backend.request(send, "/"))
@@ -0,0 +1,175 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+import aqqu_server
+import aqqu_server_async
+import cache
+from cache import LRUCache
+
+
+class FakeTime:
+    """Replacement for the time module of the cache with a clock that only
+    moves when told to.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_time = FakeTime()
+    monkeypatch.setattr(cache, "time", fake_time)
+    return fake_time
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    lru = LRUCache(max_entries=2)
+    lru.put("a", 1, 1)
+    lru.put("b", 2, 1)
+    assert lru.get("a") == 1
+    lru.put("c", 3, 1)
+    assert lru.get("b") is None
+    assert lru.get("a") == 1 and lru.get("c") == 3
+    assert lru.stats()["evictions"] == 1
+
+
+def test_entries_are_evicted_to_stay_within_max_bytes(clock):
+    lru = LRUCache(max_bytes=10)
+    lru.put("a", 1, 4)
+    lru.put("b", 2, 4)
+    lru.put("c", 3, 4)
+    assert lru.get("a") is None
+    assert lru.num_bytes == 8
+    # Values larger than the cache are not cached at all
+    lru.put("d", 4, 11)
+    assert lru.get("d") is None and len(lru) == 2
+
+
+def test_entries_expire_after_ttl(clock):
+    lru = LRUCache(ttl=10)
+    lru.put("a", 1, 1)
+    clock.now += 9.9
+    assert lru.get("a") == 1
+    clock.now += 0.1
+    assert lru.get("a") is None
+    assert len(lru) == 0 and lru.num_bytes == 0
+
+
+def test_put_replaces_an_entry(clock):
+    lru = LRUCache()
+    lru.put("a", 1, 5)
+    lru.put("a", 2, 3)
+    assert lru.get("a") == 2
+    assert len(lru) == 1 and lru.num_bytes == 3
+
+
+def test_expired_entries_are_served_stale_within_stale_ttl(clock):
+    lru = LRUCache(ttl=10, stale_ttl=20)
+    lru.put("a", 1, 1)
+    assert lru.get_stale("a") == (1, False)
+    clock.now += 15
+    # get() only returns fresh entries, but keeps the stale entry
+    assert lru.get("a") is None
+    assert lru.get_stale("a") == (1, True)
+    clock.now += 15
+    assert lru.get_stale("a") == (None, False)
+    assert len(lru) == 0
+
+
+def test_only_one_caller_refreshes_a_stale_entry(clock):
+    lru = LRUCache(ttl=10, stale_ttl=20)
+    lru.put("a", 1, 1)
+    clock.now += 15
+    assert lru.begin_refresh("a")
+    assert not lru.begin_refresh("a")
+    # A failed refresh releases the claim
+    lru.end_refresh("a")
+    assert lru.begin_refresh("a")
+    # A successful refresh releases the claim and updates the entry
+    lru.put("a", 2, 1)
+    assert lru.get_stale("a") == (2, False)
+    assert lru.begin_refresh("a")
+
+
+class FakeAqquApi:
+    """Fake Aqqu API that returns the number of requests so far. Requests
+    after the first only return once the API is released.
+    """
+
+    def __init__(self):
+        self.num_requests = 0
+        self.released = threading.Event()
+
+    def request(self, question):
+        self.num_requests += 1
+        if self.num_requests > 1:
+            self.released.wait(5)
+        return self.num_requests
+
+    async def request_async(self, app, question):
+        self.num_requests += 1
+        if self.num_requests > 1:
+            while not self.released.is_set():
+                await asyncio.sleep(0.01)
+        return self.num_requests
+
+
+@pytest.fixture
+def aqqu_api(args, clock, monkeypatch):
+    """Replace the Aqqu API of both servers by a FakeAqquApi and use an
+    answer cache with a stale time to live.
+    """
+    monkeypatch.setattr(aqqu_server, "answer_cache",
+                        LRUCache(ttl=10, stale_ttl=100))
+    api = FakeAqquApi()
+    monkeypatch.setattr(aqqu_server, "request_aqqu_result", api.request)
+    monkeypatch.setattr(aqqu_server_async, "request_aqqu_result",
+                        api.request_async)
+    monkeypatch.setattr(aqqu_server, "get_aqqu_result_size",
+                        lambda result: 1)
+    monkeypatch.setattr(aqqu_server_async, "get_aqqu_result_size",
+                        lambda result: 1)
+    return api
+
+
+def test_stale_answers_are_returned_while_refreshed(aqqu_api, clock):
+    assert aqqu_server.get_aqqu_result("who", "") == 1
+    clock.now += 15
+    # Both requests get the stale result right away, only one refreshes it
+    assert aqqu_server.get_aqqu_result("who", "") == 1
+    assert aqqu_server.get_aqqu_result("who", "") == 1
+    aqqu_api.released.set()
+    key = aqqu_server.get_answer_cache_key("who", "")
+    deadline = time.monotonic() + 5
+    while (aqqu_server.answer_cache.get(key) is None
+           and time.monotonic() < deadline):
+        time.sleep(0.01)
+    assert aqqu_api.num_requests == 2
+    assert aqqu_server.get_aqqu_result("who", "") == 2
+
+
+def test_stale_answers_are_returned_while_refreshed_async(aqqu_api, clock):
+    async def run():
+        app = {"background_tasks": set()}
+        get = aqqu_server_async.get_aqqu_result
+        assert await get(app, "who", "") == 1
+        clock.now += 15
+        assert await get(app, "who", "") == 1
+        assert await get(app, "who", "") == 1
+        aqqu_api.released.set()
+        await asyncio.gather(*app["background_tasks"])
+        assert aqqu_api.num_requests == 2
+        assert await get(app, "who", "") == 2
+
+    asyncio.run(run())
@@ -0,0 +1,177 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import time
+import asyncio
+import threading
+import concurrent.futures
+
+import pytest
+
+from coalescing import (SingleFlight, AsyncSingleFlight, SupersessionTracker,
+                        SupersededError)
+
+
+def test_newer_request_supersedes_older_request():
+    tracker = SupersessionTracker()
+    first = tracker.register("a", "1")
+    assert not first.is_set()
+    second = tracker.register("a", "2")
+    assert first.is_set() and not second.is_set()
+    # A request that arrives after a newer one is superseded right away
+    assert tracker.register("a", "1.5").is_set()
+    # Other clients and requests without time stamp are not affected
+    assert not tracker.register("b", "1").is_set()
+    assert not tracker.register("a", None).is_set()
+    assert not second.is_set()
+
+
+def test_concurrent_calls_share_one_call():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    with concurrent.futures.ThreadPoolExecutor(3) as executor:
+        leader = executor.submit(flight.do, "key", fn)
+        started.wait(5)
+        followers = [executor.submit(flight.do, "key", fn) for _ in range(2)]
+        while flight.num_shared < 2:
+            time.sleep(0.001)
+        release.set()
+        results = [f.result(5) for f in [leader] + followers]
+    assert results == ["result"] * 3
+    assert len(calls) == 1
+
+
+def test_errors_are_raised_for_all_callers():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fn():
+        started.set()
+        release.wait(5)
+        raise ConnectionError("down")
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(flight.do, "key", fn)
+        started.wait(5)
+        follower = executor.submit(flight.do, "key", fn)
+        while flight.num_shared < 1:
+            time.sleep(0.001)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(ConnectionError):
+                future.result(5)
+
+
+def test_waiting_caller_can_abandon_the_call():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    abandon = threading.Event()
+
+    def fn():
+        started.set()
+        release.wait(5)
+        return "result"
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(flight.do, "key", fn)
+        started.wait(5)
+        follower = executor.submit(flight.do, "key", fn, abandon)
+        abandon.set()
+        with pytest.raises(SupersededError):
+            follower.result(5)
+        # The call itself is not interrupted
+        release.set()
+        assert leader.result(5) == "result"
+    with pytest.raises(SupersededError):
+        flight.do("key", fn, abandon)
+
+
+class SlowCall:
+    """Coroutine function that counts its calls and whether they were
+    cancelled. The calls finish once the call is released.
+    """
+
+    def __init__(self):
+        self.num_calls = 0
+        self.num_cancelled = 0
+        self.released = asyncio.Event()
+
+    async def __call__(self):
+        self.num_calls += 1
+        try:
+            await self.released.wait()
+        except asyncio.CancelledError:
+            self.num_cancelled += 1
+            raise
+        return "result"
+
+
+def test_async_calls_share_one_call():
+    async def run():
+        flight = AsyncSingleFlight()
+        call = SlowCall()
+        callers = [asyncio.ensure_future(flight.do("key", call))
+                   for _ in range(3)]
+        await asyncio.sleep(0)
+        call.released.set()
+        assert await asyncio.gather(*callers) == ["result"] * 3
+        assert call.num_calls == 1 and flight.num_shared == 2
+        assert not flight._calls
+
+    asyncio.run(run())
+
+
+def test_async_call_is_cancelled_once_all_callers_abandoned_it():
+    async def run():
+        flight = AsyncSingleFlight()
+        call = SlowCall()
+        abandon = [asyncio.Event(), asyncio.Event()]
+        callers = [asyncio.ensure_future(flight.do("key", call, event))
+                   for event in abandon]
+        await asyncio.sleep(0)
+        abandon[0].set()
+        with pytest.raises(SupersededError):
+            await callers[0]
+        assert call.num_cancelled == 0
+        abandon[1].set()
+        with pytest.raises(SupersededError):
+            await callers[1]
+        await asyncio.sleep(0)
+        assert call.num_cancelled == 1
+        assert not flight._calls
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_no_longer_counts_as_waiting():
+    async def run():
+        flight = AsyncSingleFlight()
+        call = SlowCall()
+        abandon = asyncio.Event()
+        cancelled = asyncio.ensure_future(flight.do("key", call))
+        caller = asyncio.ensure_future(flight.do("key", call, abandon))
+        await asyncio.sleep(0)
+        # E.g. the client of the first caller disconnected
+        cancelled.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        abandon.set()
+        with pytest.raises(SupersededError):
+            await caller
+        await asyncio.sleep(0)
+        assert call.num_cancelled == 1
+        assert not flight._calls
+
+    asyncio.run(run())
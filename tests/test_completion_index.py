@@ -0,0 +1,53 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import random
+
+from completion_index import CompletionIndex, get_key
+
+
+def get_top_completions(entries, prefix, k):
+    """Get the top k completions for the given prefix by scanning all
+    entries.
+    """
+    matches = [(score, completion) for completion, _, score in entries
+               if get_key(completion).startswith(get_key(prefix))]
+    return [completion for _, completion in sorted(matches, reverse=True)[:k]]
+
+
+def test_completions_match_a_scan_of_all_questions():
+    random.seed(0)
+    words = ["who", "what", "when", "where", "is", "was", "the", "[A]", "a"]
+    # Enough questions with common prefixes for precomputed prefix ranges
+    completions = set()
+    while len(completions) < 2000:
+        completions.add(" ".join(random.choices(words, k=4)))
+    entries = [(completion, ["q1"] if "[" in completion else [],
+                random.random()) for completion in sorted(completions)]
+    index = CompletionIndex(entries, k=5)
+    assert index._top
+    prefixes = ["", "w", "wh", "who ", "who is", "what the a", "whx", "a",
+                "WHO IS [a", "when was the [A] a"]
+    for prefix in prefixes:
+        completions = [result["completion"]
+                       for result in index.complete(prefix)]
+        assert completions == get_top_completions(entries, prefix, 5)
+
+
+def test_entity_mentions_can_be_given_by_qid(tmp_path):
+    path = tmp_path / "popular_questions.tsv"
+    path.write_text("who founded [Apple Inc.]\tQ312\n"
+                    "who is [Angela Merkel]\tq567\n"
+                    "who founded [Apple Inc.] and when\tq312\t\n"
+                    "\n", encoding="utf8")
+    index = CompletionIndex.from_file(str(path))
+    assert len(index) == 3
+    assert index.complete("who [q312]") == []
+    assert index.complete("who founded [q312] a") == [{
+        "completion": "who founded [Apple Inc.] and when",
+        "qids": ["q312"], "matched_alias": ""}]
+    # Without frequencies, earlier questions are ranked higher
+    assert [result["completion"] for result in index.complete("Who ")] == [
+        "who founded [Apple Inc.]", "who is [Angela Merkel]",
+        "who founded [Apple Inc.] and when"]
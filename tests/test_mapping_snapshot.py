@@ -0,0 +1,88 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import zlib
+
+import pytest
+
+import aqqu_server
+import mapping_snapshot
+from mapping_snapshot import (get_source_fingerprint, read_snapshot,
+                              write_snapshot)
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    """Create a data directory with small mapping files and return its path
+    with trailing "/".
+    """
+    (tmp_path / "mid_to_qid15_combined.tsv").write_text(
+        "m.0abc\tQ42\nm.0xyz\tq5\n")
+    (tmp_path / "qid_to_wikipedia_info.tsv").write_text(
+        "q42\tDouglas Adams\tAdams.jpg\tAn English author.\n")
+    return str(tmp_path) + "/"
+
+
+def write_payload(snapshot_file, fingerprint, payload):
+    """Write a snapshot with the given pickled payload and a valid checksum.
+    """
+    fingerprint = fingerprint.encode("ascii")
+    with open(snapshot_file, "wb") as file:
+        file.write(mapping_snapshot.HEADER.pack(
+            mapping_snapshot.MAGIC, mapping_snapshot.SNAPSHOT_VERSION,
+            len(fingerprint)))
+        file.write(fingerprint)
+        file.write(mapping_snapshot.CHECKSUM.pack(zlib.crc32(payload)))
+        file.write(payload)
+
+
+def test_snapshot_is_only_read_with_the_same_fingerprint(data_path):
+    source = data_path + "mid_to_qid15_combined.tsv"
+    snapshot_file = data_path + "mappings.snapshot"
+    fingerprint = get_source_fingerprint([source], processes=1)
+    assert read_snapshot(snapshot_file, fingerprint) is None
+    write_snapshot(snapshot_file, fingerprint, {"a": [1, 2]})
+    assert read_snapshot(snapshot_file, fingerprint) == {"a": [1, 2]}
+    assert get_source_fingerprint([source], processes=2) != fingerprint
+    with open(source, "a") as file:
+        file.write("m.0def\tq6\n")
+    assert read_snapshot(snapshot_file,
+                         get_source_fingerprint([source], processes=1)) is None
+
+
+def test_corrupt_snapshots_are_not_read(data_path):
+    snapshot_file = data_path + "mappings.snapshot"
+    write_snapshot(snapshot_file, "abc", {"a": [1, 2]})
+    with open(snapshot_file, "r+b") as file:
+        file.seek(-1, 2)
+        file.write(b"x")
+    assert read_snapshot(snapshot_file, "abc") is None
+    with open(snapshot_file, "wb") as file:
+        file.write(b"AQQU")
+    assert read_snapshot(snapshot_file, "abc") is None
+
+
+def test_unpicklable_snapshots_are_not_read(data_path):
+    snapshot_file = data_path + "mappings.snapshot"
+    # A class that no longer exists
+    write_payload(snapshot_file, "abc",
+                  b"\x80\x04cmapping_snapshot\nRemovedClass\n)\x81.")
+    assert read_snapshot(snapshot_file, "abc") is None
+    write_payload(snapshot_file, "abc", b"\x80\x04garbage")
+    assert read_snapshot(snapshot_file, "abc") is None
+
+
+def test_unpicklable_snapshot_is_rebuilt(data_path, monkeypatch):
+    monkeypatch.setattr(aqqu_server, "mappings", None)
+    snapshot_file = data_path + "mappings.snapshot"
+    aqqu_server.load_mappings(data_path, snapshot_file=snapshot_file)
+    with open(snapshot_file, "rb") as file:
+        header = file.read(mapping_snapshot.HEADER.size)
+        _, _, fingerprint_len = mapping_snapshot.HEADER.unpack(header)
+        fingerprint = file.read(fingerprint_len).decode("ascii")
+    write_payload(snapshot_file, fingerprint, b"\x80\x04garbage")
+
+    aqqu_server.load_mappings(data_path, snapshot_file=snapshot_file)
+    assert aqqu_server.mappings.mid_to_qid["m.0abc"] == "q42"
+    assert read_snapshot(snapshot_file, fingerprint) is not None
@@ -0,0 +1,65 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import pickle
+
+import pytest
+
+import mid_qid_table
+from mid_qid_table import MidToQidTable, encode_pairs, encode_mid
+
+PAIRS = [
+    ("m.0abc", "q42"),
+    ("m.0xyz", "q5"),
+    ("g.11b_", "q4294967296"),
+    ("m.0abc", "q43"),
+    # MIDs or QIDs that can not be encoded
+    ("m.0ABC", "q1"),
+    ("m.0xyz", "Q7"),
+    ("x.123", "q2"),
+    ("m.0def", "q6"),
+    # A later encodable pair overrides an overflow pair and vice versa
+    ("m.0xyz", "q8"),
+    ("m.0def", "q007"),
+]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def sort(request, monkeypatch):
+    """Build the tables with NumPy if it is installed and without."""
+    if request.param == "numpy" and mid_qid_table.numpy is None:
+        pytest.skip("NumPy is not installed")
+    if request.param == "python":
+        monkeypatch.setattr(mid_qid_table, "numpy", None)
+
+
+def assert_same_mapping(table, expected):
+    assert len(table) == len(expected)
+    for mid, qid in expected.items():
+        assert table[mid] == qid
+    assert table.get("m.0missing") is None and "m.0missing" not in table
+    mids = list(expected) + ["m.0missing", "m.", None]
+    assert table.get_many(mids) == [expected.get(mid) for mid in mids]
+
+
+def test_encode_mid():
+    codes = [encode_mid(mid) for mid in ["m.0", "m.00", "g.0", "m._"]]
+    assert len(set(codes)) == 4
+    for mid in ["m.", "m.0A", "x.0", "m." + "0" * 13]:
+        assert encode_mid(mid) is None
+
+
+def test_table_matches_the_dictionary(sort):
+    assert_same_mapping(MidToQidTable(PAIRS), dict(PAIRS))
+
+
+def test_table_from_chunks_matches_the_dictionary(sort):
+    chunks = [encode_pairs(PAIRS[i:i + 3]) for i in range(0, len(PAIRS), 3)]
+    table = MidToQidTable.from_encoded(chunks)
+    assert_same_mapping(table, dict(PAIRS))
+
+
+def test_pickled_table_matches_the_dictionary(sort):
+    table = pickle.loads(pickle.dumps(MidToQidTable(PAIRS)))
+    assert_same_mapping(table, dict(PAIRS))
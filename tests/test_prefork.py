@@ -0,0 +1,56 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+from metrics import Registry
+from conftest import REPO_PATH, get_free_ports, get_metrics
+
+
+def test_constant_labels_are_added_to_all_samples():
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests", ["route"])
+    histogram = registry.histogram("duration_seconds", "Duration",
+                                   buckets=[1.0])
+    registry.callback("entries", "Entries", "gauge", ["cache"],
+                      lambda: [(("qac",), 3)])
+    counter.inc(route="/qac")
+    histogram.observe(0.5)
+    registry.set_constant_labels(worker=2)
+    lines = [line for line in registry.render().splitlines()
+             if not line.startswith("#")]
+    assert lines == [
+        'requests_total{worker="2",route="/qac"} 1',
+        'duration_seconds_bucket{worker="2",le="1"} 1',
+        'duration_seconds_bucket{worker="2",le="+Inf"} 1',
+        'duration_seconds_sum{worker="2"} 0.5',
+        'duration_seconds_count{worker="2"} 1',
+        'entries{worker="2",cache="qac"} 3',
+    ]
+
+
+@pytest.mark.parametrize("server", ["aqqu_server.py",
+                                    "aqqu_server_async.py"])
+def test_workers_serve_their_metrics_on_own_ports(server, tmp_path):
+    (tmp_path / "mid_to_qid15_combined.tsv").write_text("m.0abc\tq42\n")
+    (tmp_path / "qid_to_wikipedia_info.tsv").write_text("q42\tA\tB\tC\n")
+    port = get_free_ports(3)
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_PATH, server), str(port),
+         "-d", str(tmp_path), "-w", "2", "--metrics-port", str(port + 1)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for worker in range(2):
+            get_metrics(port + 1 + worker)
+            metrics = get_metrics(port + 1 + worker)
+            assert ('aqqu_frontend_requests_total{worker="%d",'
+                    'route="/metrics",status="200"} 1' % worker) in metrics
+            assert 'worker="%d"' % (1 - worker) not in metrics
+    finally:
+        process.terminate()
+        process.wait(10)
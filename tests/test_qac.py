@@ -0,0 +1,161 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import json
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import aqqu_server
+import aqqu_server_async
+from conftest import get_async
+
+
+def get_completions(question_prefix):
+    return {"results": [question_prefix]}
+
+
+async def get_completions_async(app, question_prefix):
+    return get_completions(question_prefix)
+
+
+@pytest.fixture
+def qac_api(args, monkeypatch):
+    """Replace the QAC API of both servers by a fake and reset the
+    supersession trackers.
+    """
+    monkeypatch.setattr(aqqu_server, "qac_tracker",
+                        aqqu_server.SupersessionTracker())
+    monkeypatch.setattr(aqqu_server_async, "qac_tracker",
+                        aqqu_server.SupersessionTracker(
+                            event_factory=asyncio.Event))
+    monkeypatch.setattr(aqqu_server, "request_qac_result", get_completions)
+    monkeypatch.setattr(aqqu_server_async, "request_qac_result",
+                        get_completions_async)
+
+
+def test_clients_without_id_do_not_supersede_each_other(qac_api):
+    client = aqqu_server.app.test_client()
+    client.get("/qac?q=abc&t=1000")
+    response = client.get("/qac?q=xyz&t=500")
+    assert json.loads(response.data) == {"results": ["xyz"],
+                                         "timestamp": "500"}
+
+
+def test_clients_without_id_do_not_supersede_each_other_async(qac_api):
+    responses = get_async(["/qac?q=abc&t=1000", "/qac?q=xyz&t=500"])
+    assert json.loads(responses[1][1]) == {"results": ["xyz"],
+                                           "timestamp": "500"}
+
+
+def test_older_request_of_same_client_is_superseded(qac_api):
+    client = aqqu_server.app.test_client()
+    client.get("/qac?q=abc&t=1000&c=1")
+    response = client.get("/qac?q=xyz&t=500&c=1")
+    assert json.loads(response.data) == []
+
+
+@pytest.fixture
+def rate_limit(qac_api, monkeypatch):
+    """Allow each client 3 QAC requests at once and trust the proxy
+    10.0.0.1.
+    """
+    # Restore the trusted proxies of the other tests afterwards
+    monkeypatch.setattr(aqqu_server, "trusted_proxies", [])
+    args = aqqu_server.get_argument_parser().parse_args(
+        ["8182", "--qac-rate", "0.001", "--qac-burst", "3",
+         "--trusted-proxies", "10.0.0.1"])
+    aqqu_server.create_qac_limits(args)
+
+
+def get_statuses(paths, remote_addr="127.0.0.1", forwarded_for=None):
+    client = aqqu_server.app.test_client()
+    headers = {"X-Forwarded-For": forwarded_for} if forwarded_for else {}
+    return [client.get(path, headers=headers,
+                       environ_base={"REMOTE_ADDR": remote_addr}).status_code
+            for path in paths]
+
+
+def test_rotating_client_ids_are_rate_limited(rate_limit):
+    paths = ["/qac?q=abc&t=%d&c=%d" % (i, i) for i in range(5)]
+    assert get_statuses(paths) == [200, 200, 200, 429, 429]
+    # Other addresses have their own limit
+    assert get_statuses(paths[:1], remote_addr="127.0.0.2") == [200]
+
+
+def test_rotating_client_ids_are_rate_limited_async(rate_limit):
+    paths = ["/qac?q=abc&t=%d&c=%d" % (i, i) for i in range(5)]
+    statuses = [status for status, _ in get_async(paths)]
+    assert statuses == [200, 200, 200, 429, 429]
+
+
+def test_forwarded_for_is_only_used_from_trusted_proxies(rate_limit):
+    paths = ["/qac?q=abc&t=%d" % i for i in range(4)]
+    limited = [200, 200, 200, 429]
+    # Clients behind the trusted proxy have their own limit
+    assert get_statuses(paths, "10.0.0.1", "1.2.3.4") == limited
+    assert get_statuses(paths, "10.0.0.1", "9.9.9.9, 1.2.3.5") == limited
+    # Other peers can not choose their address
+    assert get_statuses(paths, "10.0.0.2", "1.2.3.6") == limited
+    assert get_statuses(paths, "10.0.0.2", "1.2.3.7") == [429] * 4
+
+
+def test_clients_behind_a_trusted_proxy_have_own_limits_async(qac_api,
+                                                              monkeypatch):
+    # The test client connects from the loopback address
+    monkeypatch.setattr(aqqu_server, "trusted_proxies", [])
+    args = aqqu_server.get_argument_parser().parse_args(
+        ["8182", "--qac-rate", "0.001", "--qac-burst", "3",
+         "--trusted-proxies", "127.0.0.1,::1"])
+    aqqu_server.create_qac_limits(args)
+    paths = ["/qac?q=abc&t=%d" % i for i in range(4)]
+    statuses = [status for status, _
+                in get_async(paths, {"X-Forwarded-For": "1.2.3.4"})]
+    assert statuses == [200, 200, 200, 429]
+    statuses = [status for status, _
+                in get_async(paths, {"X-Forwarded-For": "1.2.3.5"})]
+    assert statuses == [200, 200, 200, 429]
+
+
+def test_qac_requests_are_not_rate_limited_by_default(qac_api):
+    paths = ["/qac?q=abc&t=%d" % i for i in range(100)]
+    assert get_statuses(paths) == [200] * 100
+    assert [status for status, _ in get_async(paths)] == [200] * 100
+
+
+def test_get_client_address(rate_limit):
+    get = aqqu_server.get_client_address
+    assert get("10.0.0.2", "1.2.3.4") == "10.0.0.2"
+    assert get("10.0.0.1", None) == "10.0.0.1"
+    assert get("10.0.0.1", "1.2.3.4, 10.0.0.1") == "1.2.3.4"
+    assert get("::ffff:10.0.0.1", "1.2.3.4") == "1.2.3.4"
+
+
+def test_websocket_answers_errors_and_keeps_serving(qac_api, monkeypatch):
+    async def get_completions_or_fail(app, question_prefix):
+        if question_prefix == "fail":
+            raise RuntimeError("bug")
+        return get_completions(question_prefix)
+
+    monkeypatch.setattr(aqqu_server_async, "request_qac_result",
+                        get_completions_or_fail)
+
+    async def run():
+        client = TestClient(TestServer(aqqu_server_async.create_app()))
+        await client.start_server()
+        try:
+            ws = await client.ws_connect("/qac/ws")
+            messages = []
+            for question_prefix, timestamp in [("fail", 1), ("abc", 2)]:
+                await ws.send_str(json.dumps({"q": question_prefix,
+                                              "t": timestamp}))
+                messages.append(json.loads(await ws.receive_str(timeout=5)))
+            await ws.close()
+            return messages
+        finally:
+            await client.close()
+
+    assert asyncio.run(run()) == [{"error": "internal", "timestamp": 1},
+                                  {"results": ["abc"], "timestamp": 2}]
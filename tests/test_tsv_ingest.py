@@ -0,0 +1,61 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import pytest
+
+import aqqu_server
+from tsv_ingest import get_chunks, parse_file
+
+
+@pytest.fixture
+def mapping_file(tmp_path):
+    """Write a QID to Wikipedia info file with multi-byte characters, a
+    Windows line ending and a last line without newline.
+    """
+    lines = ["q%d\tTitle %d\t\tÜber %s\n" % (i, i, "ä" * (i % 13))
+             for i in range(200)]
+    lines[50] = lines[50].replace("\n", "\r\n")
+    lines[-1] = lines[-1].rstrip("\n")
+    path = tmp_path / "qid_to_wikipedia_info.tsv"
+    path.write_text("".join(lines), encoding="utf8", newline="")
+    return str(path)
+
+
+def test_chunks_cover_the_file_at_line_boundaries(mapping_file):
+    with open(mapping_file, "rb") as file:
+        data = file.read()
+    chunks = get_chunks(mapping_file, chunk_size=100)
+    assert len(chunks) > 10
+    assert chunks[0][0] == 0 and chunks[-1][1] == len(data)
+    for (_, end), (start, _) in zip(chunks, chunks[1:]):
+        assert end == start and data[end - 1:end] == b"\n"
+    # A chunk that would end right behind a newline ends there
+    first_line_end = data.index(b"\n") + 1
+    assert get_chunks(mapping_file, first_line_end)[0] == (0, first_line_end)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 100, 10 ** 6])
+def test_parallel_parsing_matches_sequential_parsing(mapping_file,
+                                                     chunk_size):
+    expected = list(parse_file(mapping_file,
+                               aqqu_server.read_wikipedia_entries))
+    assert len(expected) == 200
+    result = parse_file(mapping_file, aqqu_server.read_wikipedia_entries,
+                        processes=2, chunk_size=chunk_size)
+    assert list(result) == expected
+
+
+def test_mappings_read_in_parallel_match(mapping_file, tmp_path):
+    assert (aqqu_server.get_wikipedia_mapping(mapping_file, processes=2)
+            == aqqu_server.get_wikipedia_mapping(mapping_file))
+    mid_file = tmp_path / "mid_to_qid.tsv"
+    mid_file.write_text("".join("m.0%x\tQ%d\n" % (i % 150, i)
+                                for i in range(300)) + "m.0ABC\tq1\n")
+    sequential = aqqu_server.get_mid_to_qid_mapping(str(mid_file))
+    parallel = aqqu_server.get_mid_to_qid_mapping(str(mid_file), processes=2)
+    assert len(parallel) == len(sequential) == 151
+    for i in range(150):
+        assert parallel["m.0%x" % i] == sequential["m.0%x" % i] == \
+            "q%d" % (i + 150)
+    assert parallel["m.0ABC"] == "q1"
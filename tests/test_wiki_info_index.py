@@ -0,0 +1,115 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import pickle
+
+import pytest
+
+import aqqu_server
+from wiki_info_index import (WikiInfoIndex, build_index, load_index,
+                             get_numeric_qid)
+
+LINES = [
+    "Q42\tDouglas Adams\tAdams.jpg\tDouglas Adams was an English author.\n",
+    "q1\tUniverse\t\tThe universe is all of space and time.\n",
+    "q5\tHuman\tHuman.png\tHumans are the most common primate. Ümlaut\n",
+    "q42\tDouglas Adams\tDNA.jpg\tThe later line wins.\n",
+    "q007\tInvalid\t\tQIDs with leading zeros are skipped.\n",
+    "m.0abc\tInvalid\t\tOther ids are skipped.\n",
+    "q100\t\t\t\n",
+]
+
+
+@pytest.fixture
+def mapping_file(tmp_path):
+    path = tmp_path / "qid_to_wikipedia_info.tsv"
+    path.write_text("".join(LINES), encoding="utf8")
+    return str(path)
+
+
+def test_get_numeric_qid():
+    assert get_numeric_qid("q42") == 42
+    for qid in ["Q42", "q", "q042", "q4x", "m.0abc", "q٤"]:
+        assert get_numeric_qid(qid) is None
+
+
+def get_expected_mapping(mapping_file):
+    """Get the entries of the mapping dictionary with valid QIDs.
+    """
+    return {qid: info for qid, info
+            in aqqu_server.get_wikipedia_mapping(mapping_file).items()
+            if get_numeric_qid(qid) is not None}
+
+
+def test_index_matches_the_mapping_dictionary(mapping_file, tmp_path):
+    index_file = str(tmp_path / "wiki_info.idx")
+    build_index(mapping_file, index_file)
+    index = WikiInfoIndex(index_file)
+    assert not index.compressed
+    expected = get_expected_mapping(mapping_file)
+    assert len(index) == len(expected) == 4
+    for qid, info in expected.items():
+        assert qid in index
+        assert index[qid] == info
+    assert index["q42"][1] == "DNA.jpg"
+    for qid in ["q2", "q007", "m.0abc", "Q42", None]:
+        assert qid not in index
+        assert index.get(qid) is None
+    with pytest.raises(KeyError):
+        index["q2"]
+    index.close()
+
+
+def test_other_files_are_rejected(mapping_file):
+    with pytest.raises(ValueError):
+        WikiInfoIndex(mapping_file)
+
+
+@pytest.mark.parametrize("block_size", [1, 40, 4096])
+def test_compressed_index_matches_the_mapping_dictionary(mapping_file,
+                                                         tmp_path,
+                                                         block_size):
+    index_file = str(tmp_path / "wiki_info.idx")
+    build_index(mapping_file, index_file, compress=True,
+                block_size=block_size)
+    expected = get_expected_mapping(mapping_file)
+    for index in [WikiInfoIndex(index_file, block_cache_size=1),
+                  load_index(mapping_file, block_size=block_size)]:
+        assert index.compressed and len(index) == len(expected)
+        # Look up the entries twice to use cached and evicted blocks
+        for qid in list(expected) + list(reversed(list(expected))):
+            assert index[qid] == expected[qid]
+        assert index.get("q2") is None
+        index.close()
+
+
+def test_pickled_index_matches_the_mapping_dictionary(mapping_file):
+    expected = get_expected_mapping(mapping_file)
+    for compress in [False, True]:
+        index = pickle.loads(pickle.dumps(load_index(mapping_file,
+                                                     compress)))
+        assert index.compressed == compress
+        assert {qid: index[qid] for qid in expected} == expected
+
+
+def test_empty_compressed_index(tmp_path):
+    path = tmp_path / "qid_to_wikipedia_info.tsv"
+    path.write_text("")
+    index = load_index(str(path))
+    assert len(index) == 0 and "q1" not in index
+
+
+def test_compressed_mapping_is_loaded_from_snapshot(mapping_file, tmp_path,
+                                                    monkeypatch):
+    monkeypatch.setattr(aqqu_server, "mappings", None)
+    (tmp_path / "mid_to_qid15_combined.tsv").write_text("m.0abc\tq42\n")
+    data_path = str(tmp_path) + "/"
+    snapshot_file = data_path + "mappings.snapshot"
+    expected = get_expected_mapping(mapping_file)
+    for _ in range(2):
+        aqqu_server.load_mappings(data_path, snapshot_file=snapshot_file,
+                                  compress_abstracts=True)
+        index = aqqu_server.mappings.qid_to_wikipedia_info
+        assert index.compressed
+        assert {qid: index[qid] for qid in expected} == expected
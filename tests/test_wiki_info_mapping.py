@@ -0,0 +1,134 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import os
+
+import pytest
+
+import get_wiki_info_mapping
+from get_wiki_info_mapping import (sort_by_qid, get_qid_to_wiki_info_tuples,
+                                   get_qid_to_wikititle_dict,
+                                   get_qid_to_image_dict,
+                                   get_qid_to_abstract_dict,
+                                   get_qid_to_wiki_info_dict,
+                                   get_mapping_tuples, combine_mappings)
+
+QID_URL = "<http://www.wikidata.org/entity/%s>"
+
+TITLES = [("Q1", "<https://en.wikipedia.org/wiki/Universe>"),
+          ("Q42", "<https://en.wikipedia.org/wiki/Douglas_Adams>"),
+          ("Q5", "<https://en.wikipedia.org/wiki/Human>"),
+          ("Q42", "<https://en.wikipedia.org/wiki/Douglas_Adams_(writer)>"),
+          ("Q10", "<https://en.wikipedia.org/wiki/%C3%9Cmlaut>")]
+IMAGES = [("Q42", "<http://commons.wikimedia.org/Adams.jpg>"),
+          ("Q42", "<http://commons.wikimedia.org/Second.jpg>"),
+          ("Q7", "<http://commons.wikimedia.org/Seven.jpg>"),
+          ("Q5", "<http://commons.wikimedia.org/Human.jpg>")]
+ABSTRACTS = [("Q5", '"@ Humans are @ primates. @"@en'),
+             ("Q8", '"@ Only an abstract @"@en'),
+             ("Q1", '"@ The universe. @"@en'),
+             ("Q1", '"@ The \\"universe\\" is all of space. @"@en')]
+WIKIPEDIA_IMAGES = [("Q42", "Adams_wikipedia.jpg"), ("Q7", ""),
+                    ("Q9", "Nine.jpg")]
+
+
+@pytest.fixture
+def mapping_files(tmp_path):
+    """Write the title, image, abstract and Wikipedia image mapping files
+    and return their paths.
+    """
+    paths = []
+    for name, lines, qid_url in [("title", TITLES, True),
+                                 ("image", IMAGES, True),
+                                 ("abstract", ABSTRACTS, True),
+                                 ("wiki_image", WIKIPEDIA_IMAGES, False)]:
+        path = tmp_path / ("qid_to_%s.tsv" % name)
+        path.write_text("".join(
+            "%s\t%s\n" % (QID_URL % qid if qid_url else qid, value)
+            for qid, value in lines), encoding="utf8")
+        paths.append(str(path))
+    return paths
+
+
+def get_dict_mapping(title_file, image_file, abstract_file, combine_file):
+    """Get the combined mapping as the script does without memory budget.
+    """
+    image_dict = get_qid_to_image_dict(image_file)
+    if combine_file:
+        wikipedia_image_mapping = dict(get_mapping_tuples(combine_file))
+        image_dict = combine_mappings(wikipedia_image_mapping, image_dict)
+    return get_qid_to_wiki_info_dict(get_qid_to_wikititle_dict(title_file),
+                                     image_dict,
+                                     get_qid_to_abstract_dict(abstract_file))
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """Record the number of pairs written to each sorted run."""
+    sizes = []
+    write_run = get_wiki_info_mapping.write_run
+
+    def write_counted_run(records, tmp_dir):
+        records = list(records)
+        sizes.append(len(records))
+        return write_run(records, tmp_dir)
+
+    monkeypatch.setattr(get_wiki_info_mapping, "write_run", write_counted_run)
+    return sizes
+
+
+def test_external_sort_is_stable(tmp_path, runs, monkeypatch):
+    monkeypatch.setattr(get_wiki_info_mapping, "MAX_MERGE_RUNS", 2)
+    records = [("Q%d" % (i % 7), str(i)) for i in range(50)]
+    result = list(sort_by_qid(iter(records), str(tmp_path), 1000))
+    assert result == sorted(records, key=lambda record: record[0])
+    # The runs were merged in groups and are deleted afterwards
+    assert len(runs) > 5 and sum(runs) > len(records)
+    assert os.listdir(tmp_path) == []
+
+
+def test_small_input_is_sorted_in_memory(tmp_path, runs):
+    records = [("Q2", "a"), ("Q1", "b"), ("Q2", "c")]
+    assert list(sort_by_qid(iter(records), str(tmp_path), 1 << 20)) == [
+        ("Q1", "b"), ("Q2", "a"), ("Q2", "c")]
+    assert runs == []
+    assert list(sort_by_qid(iter(records), str(tmp_path), 1 << 20,
+                            keep_last_chunk=False)) == [
+        ("Q1", "b"), ("Q2", "a"), ("Q2", "c")]
+    assert runs == [3]
+
+
+@pytest.mark.parametrize("combine", [False, True])
+@pytest.mark.parametrize("memory_budget", [1, 1 << 20])
+def test_merged_mapping_matches_the_dict_mapping(mapping_files, tmp_path,
+                                                 runs, combine,
+                                                 memory_budget):
+    title_file, image_file, abstract_file, combine_file = mapping_files
+    if not combine:
+        combine_file = None
+    tmp_dir = tmp_path / "runs"
+    tmp_dir.mkdir()
+    expected = get_dict_mapping(title_file, image_file, abstract_file,
+                                combine_file)
+    result = list(get_qid_to_wiki_info_tuples(
+        title_file, image_file, abstract_file, combine_file, str(tmp_dir),
+        memory_budget))
+    assert result == sorted(expected.items())
+    assert os.listdir(tmp_dir) == []
+
+
+def test_only_the_last_mapping_stays_in_memory(mapping_files, tmp_path,
+                                               runs):
+    # Each mapping fits into the memory budget, but not all of them
+    title_file, image_file, abstract_file, combine_file = mapping_files
+    results = get_qid_to_wiki_info_tuples(
+        title_file, image_file, abstract_file, combine_file, str(tmp_path),
+        memory_budget=1500)
+    next(results)
+    assert runs == [len(TITLES), len(IMAGES), len(ABSTRACTS)]
+    list(results)
+    assert sorted(os.listdir(tmp_path)) == ["qid_to_abstract.tsv",
+                                            "qid_to_image.tsv",
+                                            "qid_to_title.tsv",
+                                            "qid_to_wiki_image.tsv"]
@@ -0,0 +1,97 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import io
+import os
+import concurrent.futures
+from collections import deque
+
+# Size in bytes of the chunks of a file that are parsed at once
+CHUNK_SIZE = 16 * 1024 ** 2
+
+# Number of chunks per process that are parsed ahead of the consumer. Bounds
+# the memory used for parsed chunks that have not been consumed yet.
+CHUNKS_AHEAD = 2
+
+
+def get_chunks(input_file, chunk_size=CHUNK_SIZE):
+    """Split the given file into byte ranges of about chunk_size bytes that
+    start and end at line boundaries. Return the list of (start, end)
+    tuples.
+
+    Arguments:
+    input_file - path to the file
+    chunk_size - the approximate size of a chunk in bytes
+    """
+    size = os.path.getsize(input_file)
+    chunks = []
+    with open(input_file, "rb") as file:
+        start = 0
+        while start < size:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                # Move the end behind the next newline. If the byte before
+                # the end is a newline, the end is already at a line start.
+                file.seek(end - 1)
+                file.readline()
+                end = file.tell()
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def parse_chunk(input_file, start, end, parse_lines):
+    """Parse the lines between the given byte offsets of the given file with
+    parse_lines and return the results as list. The lines are decoded as
+    when reading the file in text mode.
+
+    Arguments:
+    input_file - path to the file
+    start - offset of the first byte of the chunk
+    end - offset after the last byte of the chunk
+    parse_lines - function that gets an iterable over lines and returns an
+                  iterable over the results
+    """
+    with open(input_file, "rb") as file:
+        file.seek(start)
+        data = file.read(end - start)
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding="utf8")
+    return list(parse_lines(lines))
+
+
+def parse_file(input_file, parse_lines, processes=1, chunk_size=CHUNK_SIZE):
+    """Parse the lines of the given file with parse_lines and yield the
+    results in the order of the file. With more than one process, the file
+    is split into chunks at line boundaries which are parsed in a process
+    pool. The result is the same as with a single process.
+
+    Arguments:
+    input_file - path to the file
+    parse_lines - function that gets an iterable over lines and returns an
+                  iterable over the results. With more than one process, it
+                  must be defined at module level and the results must be
+                  picklable.
+    processes - number of processes that parse the file
+    chunk_size - the approximate size of a chunk in bytes
+    """
+    if processes <= 1:
+        with open(input_file, "r", encoding="utf8") as file:
+            yield from parse_lines(file)
+        return
+
+    chunks = iter(get_chunks(input_file, chunk_size))
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        # Futures of the parsed chunks in the order of the file
+        pending = deque()
+        while True:
+            for start, end in chunks:
+                pending.append(executor.submit(parse_chunk, input_file,
+                                               start, end, parse_lines))
+                if len(pending) >= CHUNKS_AHEAD * processes:
+                    break
+            if not pending:
+                break
+            yield from pending.popleft().result()
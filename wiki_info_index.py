@@ -0,0 +1,458 @@
+# Copyright 2020, University of Freiburg
+# Author: Natalie Prange <prangen@informatik.uni-freiburg.de>
+
+
+import io
+import os
+import sys
+import mmap
+import zlib
+import shutil
+import struct
+import bisect
+import logging
+import argparse
+import functools
+import tempfile
+from array import array
+
+# Set up the logger
+logging.basicConfig(format='%(asctime)s : %(message)s', datefmt="%H:%M:%S",
+                    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Layout of the index file (all integers are unsigned 64 bit little endian):
+#   magic | number of entries n | n sorted numeric QIDs |
+#   n + 1 record offsets | records
+# The record of the i-th QID is "<title>\t<image>\t<abstract>" in utf8 and
+# spans the bytes from offset i to offset i + 1 relative to the first record.
+MAGIC = b"AQQUWIX1"
+HEADER = struct.Struct("<8sQ")
+
+# Layout of an index file with compressed abstracts:
+#   magic | number of entries n | number of blocks m | dictionary length d |
+#   position of the block offsets | n sorted numeric QIDs |
+#   n + 1 record offsets | n block numbers | n offsets within the block |
+#   dictionary | records | compressed blocks | padding | m + 1 block offsets
+# Block numbers and offsets within the block are 32 bit. The records are
+# "<title>\t<image>". The abstracts are concatenated in the order of the
+# QIDs and split into blocks which are compressed separately with zlib and
+# the shared dictionary of d bytes. The abstract of the i-th QID starts at
+# its character offset within the decompressed block and ends at the offset
+# of the next QID if that is in the same block or else at the end of the
+# block. Block offsets are relative to the first block.
+COMPRESSED_MAGIC = b"AQQUWIX2"
+COMPRESSED_HEADER = struct.Struct("<8sQQQQ")
+
+# Approximate number of characters of abstracts per compressed block
+BLOCK_SIZE = 4 * 1024
+
+# Maximum size in bytes of the shared dictionary and the number of abstracts
+# from which it is sampled
+DICTIONARY_SIZE = 32 * 1024
+DICTIONARY_SAMPLES = 256
+
+# Number of decompressed blocks that are cached per index
+BLOCK_CACHE_SIZE = 256
+
+
+def get_numeric_qid(qid):
+    """Get the numeric part of a lower case QID like "q42" or None if the
+    given string is not such a QID.
+
+    Arguments:
+    qid - the QID string
+    """
+    digits = qid[1:]
+    if (qid[:1] == "q" and digits.isascii() and digits.isdigit()
+            and digits[0] != "0"):
+        return int(digits)
+    return None
+
+
+class WikiInfoIndex:
+    """Read-only QID to Wikipedia (title, image, abstract) mapping backed by
+    an index file as written by build_index(). Can be used in place of the
+    dictionary returned by get_wikipedia_mapping(). The index file is
+    memory-mapped, so only the pages of the file that are actually accessed
+    are loaded into memory and they are shared between all processes that
+    map the same file. If the abstracts are compressed, only the blocks of
+    the requested abstracts are decompressed and the most recently used
+    blocks are cached.
+    """
+
+    def __init__(self, index_file, block_cache_size=BLOCK_CACHE_SIZE):
+        """Memory-map the given index file.
+
+        Arguments:
+        index_file - path to the index file
+        block_cache_size - number of decompressed blocks that are cached
+        """
+        self.index_file = index_file
+        with open(index_file, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._open(self._mmap, block_cache_size)
+
+    @classmethod
+    def from_buffer(cls, buffer, block_cache_size=BLOCK_CACHE_SIZE):
+        """Create an index from the content of an index file in memory, see
+        load_index().
+
+        Arguments:
+        buffer - the bytes of the index file or a buffer with them
+        block_cache_size - number of decompressed blocks that are cached
+        """
+        index = cls.__new__(cls)
+        index.index_file = None
+        index._mmap = None
+        index._open(buffer, block_cache_size)
+        return index
+
+    def __reduce__(self):
+        # Pickle the content of the index, e.g. for mapping snapshots
+        return (WikiInfoIndex.from_buffer,
+                (bytes(self._buffer), self._block_cache_size))
+
+    def _open(self, buffer, block_cache_size):
+        """Read the header of the index in the given buffer.
+        """
+        name = self.index_file or "Buffer"
+        magic = bytes(buffer[:len(MAGIC)])
+        if magic not in (MAGIC, COMPRESSED_MAGIC):
+            raise ValueError("%s is not a Wikipedia info index file" % name)
+        if sys.byteorder != "little":
+            raise ValueError("Index files can only be read on little endian"
+                             " machines")
+        self._buffer = buffer
+        self._block_cache_size = block_cache_size
+        self._compressed = magic == COMPRESSED_MAGIC
+        if self._compressed:
+            (_, self._size, num_blocks, dictionary_len,
+             block_offsets_start) = COMPRESSED_HEADER.unpack_from(buffer, 0)
+            keys_start = COMPRESSED_HEADER.size
+        else:
+            _, self._size = HEADER.unpack_from(buffer, 0)
+            keys_start = HEADER.size
+        offsets_start = keys_start + 8 * self._size
+        self._records_start = offsets_start + 8 * (self._size + 1)
+        view = memoryview(buffer)
+        self._keys = view[keys_start:offsets_start].cast("Q")
+        self._offsets = view[offsets_start:self._records_start].cast("Q")
+        self._views = [self._keys, self._offsets]
+        if self._compressed:
+            blocks_start = self._records_start
+            self._block_numbers = view[
+                blocks_start:blocks_start + 4 * self._size].cast("I")
+            blocks_start += 4 * self._size
+            self._block_positions = view[
+                blocks_start:blocks_start + 4 * self._size].cast("I")
+            blocks_start += 4 * self._size
+            self._dictionary = bytes(
+                view[blocks_start:blocks_start + dictionary_len])
+            self._records_start = blocks_start + dictionary_len
+            self._blocks_start = (self._records_start
+                                  + self._offsets[self._size])
+            self._block_offsets = view[
+                block_offsets_start:
+                block_offsets_start + 8 * (num_blocks + 1)].cast("Q")
+            self._views += [self._block_numbers, self._block_positions,
+                            self._block_offsets]
+            self._get_block = functools.lru_cache(maxsize=block_cache_size)(
+                self._decompress_block)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, qid):
+        return self._find(qid) is not None
+
+    def __getitem__(self, qid):
+        i = self._find(qid)
+        if i is None:
+            raise KeyError(qid)
+        start = self._records_start + self._offsets[i]
+        end = self._records_start + self._offsets[i + 1]
+        record = str(self._buffer[start:end], "utf8")
+        if not self._compressed:
+            title, image, abstract = record.split("\t")
+            return title, image, abstract
+        title, image = record.split("\t")
+        return title, image, self._get_abstract(i)
+
+    def get(self, qid, default=None):
+        """Return the (title, image, abstract) tuple for the given QID or the
+        default value if the QID is not in the index.
+        """
+        try:
+            return self[qid]
+        except KeyError:
+            return default
+
+    @property
+    def compressed(self):
+        """Whether the abstracts of the index are compressed.
+        """
+        return self._compressed
+
+    def close(self):
+        """Unmap the index file.
+        """
+        if self._compressed:
+            self._get_block.cache_clear()
+        for view in self._views:
+            view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def _find(self, qid):
+        """Return the position of the given QID in the index or None.
+        """
+        if not isinstance(qid, str):
+            return None
+        key = get_numeric_qid(qid)
+        if key is None:
+            return None
+        i = bisect.bisect_left(self._keys, key)
+        if i < self._size and self._keys[i] == key:
+            return i
+        return None
+
+    def _get_abstract(self, i):
+        """Return the abstract of the entry at the given position from its
+        decompressed block.
+        """
+        block = self._block_numbers[i]
+        start = self._block_positions[i]
+        end = None
+        if i + 1 < self._size and self._block_numbers[i + 1] == block:
+            end = self._block_positions[i + 1]
+        return self._get_block(block)[start:end]
+
+    def _decompress_block(self, block):
+        """Decompress the given block of abstracts and return it as string.
+        """
+        start = self._blocks_start + self._block_offsets[block]
+        end = self._blocks_start + self._block_offsets[block + 1]
+        decompressor = zlib.decompressobj(zdict=self._dictionary)
+        data = decompressor.decompress(self._buffer[start:end])
+        return (data + decompressor.flush()).decode("utf8")
+
+
+def get_index_entries(input_file):
+    """Get the sorted numeric QIDs of the given QID to Wikipedia info tsv
+    file and for each the byte offset of its line. As in
+    get_wikipedia_mapping(), QIDs are lower cased and later lines win over
+    earlier lines with the same QID. Return the tuple of the two arrays.
+
+    Arguments:
+    input_file - path to the qid_to_wikipedia_info.tsv file
+    """
+    logger.info("Read wikipedia mapping file %s" % input_file)
+    # Collect (numeric QID << 32 | line number) and the byte offset of each
+    # line. Sorting these integers sorts by QID and keeps the line order for
+    # duplicate QIDs.
+    entries = []
+    line_offsets = array("Q")
+    num_skipped = 0
+    with open(input_file, "rb") as file:
+        offset = 0
+        for line in file:
+            qid = line[:line.find(b"\t")].decode("utf8").lower()
+            key = get_numeric_qid(qid)
+            if key is None:
+                num_skipped += 1
+            else:
+                entries.append(key << 32 | len(line_offsets))
+                line_offsets.append(offset)
+            offset += len(line)
+    if num_skipped:
+        logger.warning("Skipped %d lines without valid QID" % num_skipped)
+    entries.sort()
+
+    # Only keep the last line of each QID
+    keys = array("Q")
+    offsets = array("Q")
+    for entry in entries:
+        key = entry >> 32
+        if keys and keys[-1] == key:
+            offsets[-1] = line_offsets[entry & 0xffffffff]
+        else:
+            keys.append(key)
+            offsets.append(line_offsets[entry & 0xffffffff])
+    return keys, offsets
+
+
+def read_entries(input_file, line_offsets):
+    """Yield the (title, image, abstract) tuples of the lines at the given
+    byte offsets of the given QID to Wikipedia info tsv file.
+
+    Arguments:
+    input_file - path to the qid_to_wikipedia_info.tsv file
+    line_offsets - byte offsets of the lines
+    """
+    with open(input_file, "rb") as file:
+        for line_offset in line_offsets:
+            file.seek(line_offset)
+            _, title, image, abstract = file.readline().decode(
+                "utf8").split("\t")
+            yield title, image, abstract.strip()
+
+
+def get_dictionary(input_file, line_offsets):
+    """Get the shared dictionary for the compression of the abstracts. It
+    consists of the beginnings of evenly spaced abstracts of the file, which
+    share phrases like "is an American".
+
+    Arguments:
+    input_file - path to the qid_to_wikipedia_info.tsv file
+    line_offsets - byte offsets of the lines of the index entries
+    """
+    step = max(1, len(line_offsets) // DICTIONARY_SAMPLES)
+    sample_size = DICTIONARY_SIZE // DICTIONARY_SAMPLES
+    samples = [abstract.encode("utf8")[:sample_size] for _, _, abstract
+               in read_entries(input_file, line_offsets[::step])]
+    # zlib prefers matches near the end of the dictionary
+    return b"".join(reversed(samples))[:DICTIONARY_SIZE]
+
+
+def write_index(input_file, outfile, compress=False, block_size=BLOCK_SIZE):
+    """Write an index for WikiInfoIndex for the given QID to Wikipedia info
+    tsv file to the given file object.
+
+    Arguments:
+    input_file - path to the qid_to_wikipedia_info.tsv file
+    outfile - seekable binary file object to which to write the index
+    compress - whether to store the abstracts in compressed blocks
+    block_size - approximate number of characters of abstracts per block
+    """
+    keys, line_offsets = get_index_entries(input_file)
+    n = len(keys)
+    logger.info("Write index with %d entries" % n)
+    if compress:
+        # Header and arrays are written once the blocks are known
+        outfile.write(bytes(COMPRESSED_HEADER.size))
+        outfile.write(keys.tobytes())
+        offsets_pos = outfile.tell()
+        outfile.write(bytes(8 * (n + 1) + 4 * n + 4 * n))
+        dictionary = get_dictionary(input_file, line_offsets)
+        outfile.write(dictionary)
+        # Copying a compressor is cheaper than loading the dictionary into
+        # a new compressor for each block
+        block_compressor = zlib.compressobj(6, zdict=dictionary)
+    else:
+        outfile.write(HEADER.pack(MAGIC, n))
+        outfile.write(keys.tobytes())
+        # Reserve space for the offsets and write them after the records
+        offsets_pos = outfile.tell()
+        outfile.write(bytes(8 * (n + 1)))
+    del keys
+
+    offsets = array("Q", [0])
+    block_numbers = array("I")
+    block_positions = array("I")
+    block_offsets = array("Q", [0])
+    block = []
+    block_len = 0
+    with tempfile.TemporaryFile() as block_file:
+        def write_block():
+            compressor = block_compressor.copy()
+            data = compressor.compress("".join(block).encode("utf8"))
+            data += compressor.flush()
+            block_file.write(data)
+            block_offsets.append(block_offsets[-1] + len(data))
+
+        for title, image, abstract in read_entries(input_file, line_offsets):
+            if compress:
+                record = "\t".join((title, image))
+                if block and block_len + len(abstract) > block_size:
+                    write_block()
+                    block = []
+                    block_len = 0
+                block_numbers.append(len(block_offsets) - 1)
+                block_positions.append(block_len)
+                block.append(abstract)
+                block_len += len(abstract)
+            else:
+                record = "\t".join((title, image, abstract))
+            record = record.encode("utf8")
+            outfile.write(record)
+            offsets.append(offsets[-1] + len(record))
+
+        if compress:
+            if block:
+                write_block()
+            block_file.seek(0)
+            shutil.copyfileobj(block_file, outfile)
+
+    if compress:
+        # Align the block offsets to 8 bytes
+        outfile.write(bytes(-outfile.tell() % 8))
+        block_offsets_pos = outfile.tell()
+        outfile.write(block_offsets.tobytes())
+        outfile.seek(0)
+        outfile.write(COMPRESSED_HEADER.pack(
+            COMPRESSED_MAGIC, n, len(block_offsets) - 1, len(dictionary),
+            block_offsets_pos))
+        outfile.seek(offsets_pos)
+        outfile.write(offsets.tobytes())
+        outfile.write(block_numbers.tobytes())
+        outfile.write(block_positions.tobytes())
+    else:
+        outfile.seek(offsets_pos)
+        outfile.write(offsets.tobytes())
+    outfile.seek(0, io.SEEK_END)
+
+
+def build_index(input_file, output_file, compress=False,
+                block_size=BLOCK_SIZE):
+    """Build an index file for WikiInfoIndex from the given QID to Wikipedia
+    info tsv file. As in get_wikipedia_mapping(), QIDs are lower cased and
+    later lines win over earlier lines with the same QID.
+
+    Arguments:
+    input_file - path to the qid_to_wikipedia_info.tsv file
+    output_file - path to the index file
+    compress - whether to store the abstracts in compressed blocks
+    block_size - approximate number of characters of abstracts per block
+    """
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "wb") as outfile:
+        write_index(input_file, outfile, compress, block_size)
+        size = outfile.tell()
+    os.replace(tmp_file, output_file)
+    logger.info("Wrote index of %.1f MB to %s" % (size / 1e6, output_file))
+
+
+def load_index(input_file, compress=True, block_size=BLOCK_SIZE):
+    """Build the index for the given QID to Wikipedia info tsv file in
+    memory and return it as WikiInfoIndex.
+
+    Arguments:
+    input_file - path to the qid_to_wikipedia_info.tsv file
+    compress - whether to store the abstracts in compressed blocks
+    block_size - approximate number of characters of abstracts per block
+    """
+    buffer = io.BytesIO()
+    write_index(input_file, buffer, compress, block_size)
+    logger.info("Built index of %.1f MB in memory" % (buffer.tell() / 1e6))
+    # Use the buffer without copying it
+    return WikiInfoIndex.from_buffer(buffer.getbuffer())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build a memory-mappable index from a QID to Wikipedia"
+                    " info mapping file.")
+    parser.add_argument("input",
+                        help="QID to (title, image, abstract) mapping file.")
+    parser.add_argument("output",
+                        help="File to which to write the index.")
+    parser.add_argument("--compress", action="store_true",
+                        help="Store the abstracts in compressed blocks that"
+                             " are decompressed on access.")
+    parser.add_argument("--block-size", type=int, default=BLOCK_SIZE,
+                        help="Approximate number of characters of abstracts"
+                             " per compressed block.")
+
+    args = parser.parse_args()
+    build_index(args.input, args.output, args.compress, args.block_size)